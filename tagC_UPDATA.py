@@ -45,7 +45,7 @@ class DragDropBox(QWidget):
 
     def dragEnterEvent(self, event):
         text_exts = ('.txt', '.md', '.csv', '.log', '.json', '.xml', '.ini', '.yaml', '.yml', '.py', '.js', '.html', '.css')
-        img_exts = ('.png',)
+        img_exts = ('.png', '.jpg', '.jpeg', '.webp')
         if event.mimeData().hasUrls():
             for url in event.mimeData().urls():
                 f = url.toLocalFile().lower()
@@ -74,51 +74,13 @@ class DragDropBox(QWidget):
                         content = f.read()
                 except Exception as e:
                     content = f"读取文件失败: {e}"
-            elif file_path.lower().endswith('.png'):
+            elif file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
                 try:
-                    # 直接集成image_info.py算法
-                    import struct
-                    def extract_png_text_chunks(filename):
-                        def read_chunk(f):
-                            length_bytes = f.read(4)
-                            if len(length_bytes) < 4:
-                                return None, None, None
-                            length = struct.unpack(">I", length_bytes)[0]
-                            chunk_type = f.read(4)
-                            data = f.read(length)
-                            crc = f.read(4)
-                            return chunk_type, data, crc
-                        results = []
-                        with open(filename, "rb") as f:
-                            sig = f.read(8)
-                            if sig != b"\x89PNG\r\n\x1a\n":
-                                raise ValueError("Not a PNG file")
-                            while True:
-                                chunk_type, data, crc = read_chunk(f)
-                                if chunk_type is None:
-                                    break
-                                if chunk_type in [b"tEXt", b"iTXt"]:
-                                    if chunk_type == b"tEXt":
-                                        parts = data.split(b"\x00", 1)
-                                        if len(parts) == 2:
-                                            keyword, text = parts
-                                            results.append({"keyword": keyword.decode("utf-8", "ignore"), "text": text.decode("utf-8", "ignore")})
-                                    elif chunk_type == b"iTXt":
-                                        parts = data.split(b"\x00", 5)
-                                        if len(parts) == 6:
-                                            keyword, comp_flag, comp_method, lang_tag, trans_key, text = parts
-                                            results.append({"keyword": keyword.decode("utf-8", "ignore"), "text": text.decode("utf-8", "ignore")})
-                                if chunk_type == b"IEND":
-                                    break
-                        return results
-                    def format_image_info(info):
-                        if info and 'text' in info[0]:
-                            return info[0]['text']
-                        return ''
-                    info = extract_png_text_chunks(file_path)
+                    from tagc_image import extract_image_text_chunks, format_image_info
+                    info = extract_image_text_chunks(file_path)
                     content = format_image_info(info)
                 except Exception as e:
-                    content = f"PNG信息提取失败: {e}"
+                    content = f"图片信息提取失败: {e}"
             if content is not None:
                 # 在自身区域显示内容预览（只显示前300字，多余省略）
                 self.preview_text = content[:300] + ('...\n(内容已截断)' if len(content) > 300 else '')
@@ -167,7 +129,7 @@ class ProcessingThread(QThread):
     finished = Signal(str)  # 转换完成时发送结果文本
     error_occurred = Signal(str)  # 发生错误时发送错误信息
 
-    def __init__(self, input_text, mode, options, precise_mode=False, short_line_threshold=20, cnline_blank_count=3, compress_blank_threshold=4, weight_limit=1.6, alt_algo=False):
+    def __init__(self, input_text, mode, options, precise_mode=False, short_line_threshold=20, cnline_blank_count=3, compress_blank_threshold=4, weight_limit=1.6, alt_algo=False, weight_model='legacy'):
         """初始化处理线程
         Args:
             input_text (str): 需要转换的输入文本
@@ -179,6 +141,7 @@ class ProcessingThread(QThread):
             compress_blank_threshold (int): 压缩空行的阈值
             weight_limit (float): 权重上限
             alt_algo (bool): 是否启用备用权重算法
+            weight_model (str): 括号权重模型名称
         """
         super().__init__()
         self.input_text = input_text
@@ -190,6 +153,7 @@ class ProcessingThread(QThread):
         self.compress_blank_threshold = compress_blank_threshold
         self.weight_limit = weight_limit
         self.alt_algo = alt_algo
+        self.weight_model = weight_model
 
     def run(self):
         """线程执行函数，处理标签转换（调用后端核心）"""
@@ -207,7 +171,8 @@ class ProcessingThread(QThread):
                     self.short_line_threshold,
                     self.cnline_blank_count,
                     self.compress_blank_threshold,
-                    self.weight_limit
+                    self.weight_limit,
+                    self.weight_model
                 )
             self.finished.emit(result)
         except Exception as e:
@@ -634,6 +599,31 @@ class TagConverterApp(QMainWindow):
         mode_group.addWidget(self.dragdrop_box)
         # 精确权重转换开关放到拖拽框右侧
         mode_group.addWidget(self.precise_mode)
+        # 括号权重模型选择，两个方向的括号权重换算都按所选模型进行
+        from PySide6.QtWidgets import QComboBox
+        from tagc_weights import DEFAULT_WEIGHT_MODEL, WEIGHT_MODELS
+        self.weight_model_combo = QComboBox()
+        for name, model in WEIGHT_MODELS.items():
+            self.weight_model_combo.addItem(model.description or name, name)
+        self.weight_model_combo.setCurrentIndex(self.weight_model_combo.findData(DEFAULT_WEIGHT_MODEL))
+        self.weight_model_combo.setToolTip('括号权重模型：每层 {} / [] 对应的倍率')
+        self.weight_model_combo.setStyleSheet('''
+            QComboBox {
+                background-color: #232629;
+                color: #FFFFFF;
+                border: 1px solid #444;
+                border-radius: 6px;
+                padding: 2px 6px;
+                font-size: 11pt;
+                min-height: 24px;
+            }
+            QComboBox QAbstractItemView {
+                background-color: #232629;
+                color: #FFFFFF;
+                selection-background-color: #4CAF50;
+            }
+        ''')
+        mode_group.addWidget(self.weight_model_combo)
         # 算法切换滑块，仅SD->NAI时显示
         from PySide6.QtWidgets import QSlider
         self.algo_slider = QSlider(Qt.Horizontal)
@@ -789,6 +779,16 @@ class TagConverterApp(QMainWindow):
             }
         ''')
         self.option_checks[9].toggled.connect(self.weight_limit_spin.setVisible)
+        # 输入/输出框的语法高亮，权重上限与括号权重模型随界面设置更新
+        from tagc_highlight import TagHighlighter
+        self.highlighters = [
+            TagHighlighter(editor, self.weight_limit_spin.value(), self.weight_model_combo.currentData())
+            for editor in (self.input_text, self.output_text)
+        ]
+        for highlighter in self.highlighters:
+            self.weight_limit_spin.valueChanged.connect(highlighter.set_weight_limit)
+            self.weight_model_combo.currentIndexChanged.connect(
+                lambda index, highlighter=highlighter: highlighter.set_weight_model(self.weight_model_combo.itemData(index)))
         # 数字输入框：压缩空行阈值
         self.compress_blank_spin = QSpinBox()
         self.compress_blank_spin.setMinimum(2)
@@ -986,7 +986,8 @@ class TagConverterApp(QMainWindow):
             self.cnline_blank_spin.value(),
             self.compress_blank_spin.value(),
             self.weight_limit_spin.value(),
-            alt_algo
+            alt_algo,
+            self.weight_model_combo.currentData()
         )
         self.worker.finished.connect(self.update_output)
         self.worker.error_occurred.connect(self.show_error)
@@ -0,0 +1,406 @@
+import collections
+import itertools
+import mmap
+import os
+import sys
+
+from tagc_cache import add_cache_arguments, cache_from_args, cached_convert
+from tagc_core import (PARALLEL_MIN_SIZE, add_executor_arguments, add_pipeline_arguments, convert_stream, get_bytes_pipeline, get_pipeline,
+                       is_thread_executor, make_executor, params_from_args, parse_tags, process_tags, resolve_backend)
+from tagc_export import DEFAULT_ROW_GROUP_SIZE, open_export_writer
+from tagc_image import IMAGE_EXTS, extract_image_text_chunks, format_image_info
+from tagc_memory import add_memory_arguments, measure_peak, memory_limit_from_args, peak_rss
+from tagc_metrics import METRICS, MetricsFileWriter, add_metrics_arguments, labels, record_error, record_io
+from tagc_tokens import add_token_arguments, token_budget_from_args
+
+TEXT_EXTS = ('.txt',)
+# 未指定输出目录时，结果写到源文件旁边的 <文件名><后缀> 中
+DEFAULT_SUFFIX = '.tagc.txt'
+# 不小于该大小的文本文件通过 mmap 交给 bytes 引擎，避免整份读入再解码
+MMAP_THRESHOLD = 1024 * 1024
+
+_LABELS_BATCH_QUEUE = labels(queue='batch')
+
+
+def is_source_file(path, suffix=DEFAULT_SUFFIX):
+    """判断是否为需要转换的文件（文本标注或图片），排除本程序写出的结果文件"""
+    name = path.lower()
+    if suffix and name.endswith(suffix.lower()):
+        return False
+    return name.endswith(TEXT_EXTS) or name.endswith(IMAGE_EXTS)
+
+
+def read_source(path, image_field=None):
+    """
+    读取待转换的文本：文本文件直接读取（保留原换行符），图片（PNG/JPEG/WebP）只读取元数据中的提示词。
+    image_field 为 positive/negative 时按 WebUI/NAI/ComfyUI 格式只取出图片的正向或反向提示词。
+    """
+    if path.lower().endswith(IMAGE_EXTS):
+        return format_image_info(extract_image_text_chunks(path), image_field)
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return f.read()
+
+
+def output_path_for(path, root=None, out_dir=None, suffix=DEFAULT_SUFFIX):
+    """
+    计算结果文件路径。.txt 标注去掉扩展名（a.txt -> a.tagc.txt 或 输出目录/a.txt），
+    图片保留扩展名（img.png -> img.png.tagc.txt 或 输出目录/img.png.txt），与同目录下同名的标注区分开。
+    Args:
+        path (str): 源文件路径
+        root (str): 源根目录，指定 out_dir 时用于保持相对目录结构
+        out_dir (str): 输出目录，为 None 时写到源文件旁边
+        suffix (str): 旁路结果文件的后缀
+    Returns:
+        str: 结果文件路径
+    """
+    stem = path if path.lower().endswith(IMAGE_EXTS) else os.path.splitext(path)[0]
+    if out_dir is None:
+        return stem + suffix
+    rel = os.path.relpath(stem, root) if root else os.path.basename(stem)
+    return os.path.join(out_dir, rel + '.txt')
+
+
+def convert_text(data, params, workers=None):
+    """
+    转换 UTF-8 文本内容（bytes/mmap 等缓冲区），返回 UTF-8 编码的结果。
+    选项允许时直接用 bytes 引擎处理原始字节，否则解码后走 str 流水线。
+    指定 workers 时，大文本按行切分后用多进程并行转换。
+    """
+    if workers and workers > 1 and len(data) >= PARALLEL_MIN_SIZE:
+        return process_tags(str(data, 'utf-8'), workers=workers, **params).encode('utf-8')
+    bytes_pipeline = get_bytes_pipeline(**params)
+    if bytes_pipeline is None:
+        return get_pipeline(**params)(str(data, 'utf-8')).encode('utf-8')
+    return bytes_pipeline(data)
+
+
+def convert_source(path, params, workers=None, cache=None, image_field=None, budget=None):
+    """
+    转换单个源文件的内容，返回 UTF-8 编码的结果。
+    文本文件读取原始字节交给 convert_text（大文件经 mmap 读取），图片读取元数据中的提示词后转换。
+    指定 cache 时按文件内容查找结果缓存，命中则跳过转换；图片只以提示词为键，不读取图像数据。
+    指定 budget（tagc_tokens.TokenBudget）时对转换结果再做 CLIP 词元分块处理，该步骤不进入缓存。
+    """
+    result = _convert_source(path, params, workers, cache, image_field)
+    if budget is not None:
+        with METRICS.timer('token_budget'):
+            result = budget.apply(result.decode('utf-8')).encode('utf-8')
+    return result
+
+
+def _convert_source(path, params, workers, cache, image_field):
+    if path.lower().endswith(IMAGE_EXTS):
+        with METRICS.timer('read_image'):
+            text = read_source(path, image_field)
+        data = text.encode('utf-8')
+        result = cached_convert(cache, params, data, lambda: get_pipeline(**params)(text).encode('utf-8'))
+        record_io(len(data), len(result))
+        return result
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            data = f.read()
+            result = cached_convert(cache, params, data, lambda: convert_text(data, params, workers))
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                result = cached_convert(cache, params, buf, lambda: convert_text(buf, params, workers))
+    record_io(size, len(result))
+    return result
+
+
+def convert_file(path, params, root=None, out_dir=None, suffix=DEFAULT_SUFFIX, workers=None, cache=None, image_field=None, budget=None, stream=False):
+    """
+    转换单个文件并写出结果，返回结果文件路径。
+    stream 为真时文本文件逐段读取、转换并写出（见 tagc_core.convert_stream），内存占用与文件大小无关；
+    流式转换不使用缓存与词元预算。
+    """
+    is_image = path.lower().endswith(IMAGE_EXTS)
+    if is_image and os.path.exists(path + TEXT_EXTS[0]):
+        # img.png.txt 这样的标注与图片 img.png 的结果路径相同，保留标注的结果，图片报错而不是互相覆盖
+        raise ValueError(f'结果文件与 {path + TEXT_EXTS[0]} 的结果同名')
+    stream = stream and not is_image
+    result = None if stream else convert_source(path, params, workers, cache, image_field, budget)
+    out_path = output_path_for(path, root, out_dir, suffix)
+    out_parent = os.path.dirname(out_path)
+    if out_parent:
+        os.makedirs(out_parent, exist_ok=True)
+    # 先写临时文件再替换，避免其他程序读到写了一半的结果
+    tmp_path = out_path + '.tmp'
+    if stream:
+        with METRICS.timer('stream'):
+            with open(path, 'r', encoding='utf-8', newline='') as src, open(tmp_path, 'w', encoding='utf-8', newline='') as dst:
+                convert_stream(get_pipeline(**params), src, dst.write)
+        record_io(os.path.getsize(path), os.path.getsize(tmp_path))
+        os.replace(tmp_path, out_path)
+        return out_path
+    with METRICS.timer('write'):
+        with open(tmp_path, 'wb') as f:
+            f.write(result)
+        os.replace(tmp_path, out_path)
+    return out_path
+
+
+def iter_source_files(root, suffix=DEFAULT_SUFFIX, out_dir=None):
+    """按文件名顺序递归列出目录下需要转换的文件"""
+    out_dir = os.path.abspath(out_dir) if out_dir else None
+    for dirpath, dirnames, filenames in os.walk(root):
+        if out_dir:
+            dirnames[:] = [d for d in dirnames if os.path.abspath(os.path.join(dirpath, d)) != out_dir]
+        dirnames.sort()
+        for name in sorted(filenames):
+            if is_source_file(name, suffix):
+                yield os.path.join(dirpath, name)
+
+
+def _convert_task(args):
+    path, params, root, out_dir, suffix, workers, cache, image_field, budget = args
+    try:
+        return path, convert_file(path, params, root, out_dir, suffix, workers, cache, image_field, budget), None
+    except Exception as e:
+        record_error(e)
+        return path, None, f'{type(e).__name__}: {e}'
+
+
+def _memory_task(args):
+    """
+    内存预算下的子进程任务：按安排流式或整体转换，抽中时用 tracemalloc 测峰值。
+    返回 (源路径, 结果路径, 错误信息, 文件大小, 是否流式, 任务峰值, 进程号, 进程峰值常驻内存)。
+    """
+    (path, params, root, out_dir, suffix, workers, cache, image_field, budget), size, stream, measure, cost = args
+    peak = None
+    try:
+        convert_args = (path, params, root, out_dir, suffix, workers, cache, image_field, budget, stream)
+        if measure:
+            out_path, peak = measure_peak(convert_file, *convert_args)
+        else:
+            out_path = convert_file(*convert_args)
+        error = None
+    except Exception as e:
+        record_error(e)
+        out_path, error = None, f'{type(e).__name__}: {e}'
+    return path, out_path, error, size, stream, peak, os.getpid(), peak_rss()
+
+
+def _planned_tasks(paths, memory, task_args):
+    """按内存预算为每个文件安排执行方式；惰性产出，安排时使用的是当时已校正的放大倍数"""
+    for path in paths:
+        # 图片只转换元数据中的提示词，文件大小与内存占用无关
+        size = 0 if path.lower().endswith(IMAGE_EXTS) else os.path.getsize(path)
+        stream, measure, cost = memory.plan(path, size)
+        yield (path,) + task_args, size, stream, measure, cost
+
+
+def _run_chunk(fn, chunk, metrics=False):
+    """子进程任务：依次处理一组任务；启用指标时一并带回本进程的累计指标"""
+    if not metrics:
+        return [fn(task) for task in chunk], None
+    METRICS.enable()
+    return [fn(task) for task in chunk], METRICS.snapshot()
+
+
+def _imap(executor, fn, tasks, workers=None, chunksize=16, limiter=None):
+    """
+    与 executor.map 一样按输入顺序产出结果，但只提前提交有限的几组任务：
+    tasks 可以是很长的生成器，已完成但未被取走的结果也不会在内存中无限堆积。
+    指定 limiter（tagc_memory.MemoryLimit）时，已提交任务的估计峰值之和超出预算就暂缓提交，
+    但至少保留一组在执行，因此超大任务会等其他任务完成后单独执行。
+    """
+    tasks = iter(tasks)
+    pending = collections.deque()
+    metrics = METRICS.enabled
+    # 线程池任务直接写本进程的注册表，不需要带回累计值
+    snapshots = metrics and not is_thread_executor(executor)
+    ahead = 4 * (workers or os.cpu_count() or 1)
+    held = None
+
+    def submit():
+        nonlocal held
+        chunk, held = held or list(itertools.islice(tasks, chunksize)), None
+        if not chunk:
+            return False
+        cost = 0
+        if limiter is not None:
+            cost = limiter.chunk_cost(chunk)
+            if pending and not limiter.fits(cost):
+                held = chunk
+                return False
+            limiter.acquire(cost)
+        pending.append((executor.submit(_run_chunk, fn, chunk, snapshots), len(chunk), cost))
+        if metrics:
+            METRICS.inc('tagc_queue_depth', len(chunk), _LABELS_BATCH_QUEUE)
+        return True
+
+    try:
+        while len(pending) < ahead and submit():
+            pass
+        while pending:
+            future, size, cost = pending.popleft()
+            results, snapshot = future.result()
+            if limiter is not None:
+                limiter.release(cost)
+            if metrics:
+                METRICS.inc('tagc_queue_depth', -size, _LABELS_BATCH_QUEUE)
+                METRICS.merge_snapshot(snapshot)
+            while len(pending) < ahead and submit():
+                pass
+            yield from results
+    finally:
+        for future, size, cost in pending:
+            future.cancel()
+            if metrics:
+                METRICS.inc('tagc_queue_depth', -size, _LABELS_BATCH_QUEUE)
+
+
+def _map_tasks(fn, tasks, workers=None, executor=None, chunksize=16, limiter=None, backend=None):
+    if executor is not None:
+        yield from _imap(executor, fn, tasks, workers, chunksize, limiter)
+        return
+    with make_executor(workers, backend) as pool:
+        yield from _imap(pool, fn, tasks, workers, chunksize, limiter)
+
+
+def run_batch(paths, params, root=None, out_dir=None, suffix=DEFAULT_SUFFIX, workers=None, executor=None, cache=None, image_field=None, budget=None, memory=None, backend=None):
+    """
+    用进程池（无 GIL 时为线程池）批量转换文件，按输入顺序逐个产出 (源路径, 结果路径, 错误信息)。
+    Args:
+        paths (iterable): 源文件路径
+        params (dict): get_pipeline 关键字参数
+        workers (int): 进程数，默认为CPU核数
+        executor: 复用外部传入的执行器（如监视模式的常驻进程池）
+        cache (ResultCache): 结果缓存，各子进程各自打开同一缓存目录，线程池中各线程共用同一实例
+        image_field (str): 图片只转换的提示词字段（positive/negative），None 为整段文本
+        budget (TokenBudget): 转换后的 CLIP 词元分块处理，None 为不处理
+        memory (MemoryLimit): 内存预算；指定时进程数取 memory.workers，按预算限制同时执行的任务，
+                              超大文件改走流式转换，并把测得的峰值记入 memory
+        backend (str): 未传入 executor 时使用的执行器，见 tagc_core.make_executor
+    """
+    if memory is None:
+        tasks = ((path, params, root, out_dir, suffix, None, cache, image_field, budget) for path in paths)
+        yield from _map_tasks(_convert_task, tasks, workers, executor, backend=backend)
+        return
+    tasks = _planned_tasks(paths, memory, (params, root, out_dir, suffix, None, cache, image_field, budget))
+    for path, out_path, error, size, stream, peak, pid, rss in _map_tasks(_memory_task, tasks, memory.workers, executor, limiter=memory, backend=backend):
+        memory.record(path, size, peak, stream, pid, rss)
+        yield path, out_path, error
+
+
+def export_row(path, params, root=None, cache=None, image_field=None, budget=None):
+    """转换单个文件并返回列式导出的一行（见 tagc_export.COLUMNS）"""
+    converted = convert_source(path, params, cache=cache, image_field=image_field, budget=budget).decode('utf-8')
+    tags = parse_tags(converted, params.get('weight_model'))
+    return {
+        'path': os.path.relpath(path, root).replace(os.sep, '/') if root else path,
+        'raw': read_source(path, image_field),
+        'converted': converted,
+        'tags': [tag for tag, weight in tags],
+        'weights': [weight for tag, weight in tags],
+    }
+
+
+def _export_task(args):
+    path, params, root, cache, image_field, budget = args
+    try:
+        return path, export_row(path, params, root, cache, image_field, budget), None
+    except Exception as e:
+        record_error(e)
+        return path, None, f'{type(e).__name__}: {e}'
+
+
+def run_export(paths, params, writer, root=None, workers=None, executor=None, cache=None, image_field=None, budget=None, backend=None):
+    """
+    批量转换文件并把结果逐行写入列式导出写出器，按输入顺序逐个产出 (源路径, 错误信息)。
+    子进程只提前处理有限的几组文件，写出器按行组缓冲，整个过程内存占用有上限。
+    """
+    tasks = ((path, params, root, cache, image_field, budget) for path in paths)
+    for path, row, error in _map_tasks(_export_task, tasks, workers, executor, backend=backend):
+        if row is not None:
+            writer.write(row)
+        yield path, error
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Tag转换器批量模式：转换目录下的 .txt 标注与 .png/.jpg/.webp 图片提示词')
+    parser.add_argument('paths', nargs='+', help='要转换的目录或文件')
+    parser.add_argument('--out-dir', default=None, help='输出目录，省略时在源文件旁写出结果文件')
+    parser.add_argument('--suffix', default=DEFAULT_SUFFIX, help='旁路结果文件后缀')
+    parser.add_argument('--workers', type=int, default=None, help='进程数（线程池时为线程数），默认为CPU核数')
+    parser.add_argument('--export', default=None,
+                        help='把结果写入列式文件而不是逐个结果文件：.parquet（需要 pyarrow，否则改写为 .jsonl.gz）或 .jsonl[.gz]')
+    parser.add_argument('--image-field', choices=['positive', 'negative'], default=None,
+                        help='图片只转换按 WebUI/NAI/ComfyUI 格式拆出的正向或反向提示词，省略时转换整段文本')
+    parser.add_argument('--row-group-size', type=int, default=DEFAULT_ROW_GROUP_SIZE, help='列式导出每个行组的行数')
+    add_pipeline_arguments(parser)
+    add_cache_arguments(parser)
+    add_token_arguments(parser)
+    add_metrics_arguments(parser)
+    add_memory_arguments(parser)
+    add_executor_arguments(parser)
+    args = parser.parse_args(argv)
+    params = params_from_args(args)
+    cache = cache_from_args(args)
+    try:
+        budget = token_budget_from_args(args, params['weight_model'])
+    except (OSError, ValueError) as e:
+        parser.error(f'无法加载词元预算: {e}')
+    # 词元预算要看到整段提示词，启用时超大文件不能流式转换，只能等其他任务完成后单独转换
+    memory = memory_limit_from_args(args, args.workers, allow_stream=budget is None, threads=resolve_backend(args.executor) == 'thread')
+    if not args.metrics_file:
+        return _batch_main(args, params, cache, budget, memory)
+    with MetricsFileWriter(args.metrics_file):
+        return _batch_main(args, params, cache, budget, memory)
+
+
+def _batch_main(args, params, cache, budget=None, memory=None):
+    if args.export:
+        # 列式导出要把每行结果交给写出器，不能流式转换，只按预算减少进程数
+        failed = _export_main(args, params, cache, budget, memory.workers if memory is not None else args.workers)
+        if cache is not None:
+            cache.evict()
+        return 1 if failed else 0
+    failed = 0
+    for target in args.paths:
+        if os.path.isdir(target):
+            results = run_batch(iter_source_files(target, args.suffix, args.out_dir), params, target, args.out_dir, args.suffix, args.workers, cache=cache, image_field=args.image_field, budget=budget, memory=memory, backend=args.executor)
+        elif memory is not None:
+            # 单独指定的文件在本进程转换：放不进预算时流式转换，否则按预算内的进程数并行
+            task = next(_planned_tasks([target], memory, (params, os.path.dirname(target), args.out_dir, args.suffix, memory.workers, cache, args.image_field, budget)))
+            path, out_path, error, size, stream, peak, pid, rss = _memory_task(task)
+            memory.record(path, size, peak, stream, pid, rss)
+            results = [(path, out_path, error)]
+        else:
+            # 单独指定的文件在本进程转换，大文本按行切分后并行处理
+            workers = args.workers or os.cpu_count() or 1
+            results = [_convert_task((target, params, os.path.dirname(target), args.out_dir, args.suffix, workers, cache, args.image_field, budget))]
+        for path, out_path, error in results:
+            if error:
+                failed += 1
+                print(f'转换失败 {path}: {error}', file=sys.stderr)
+    if cache is not None:
+        cache.evict()
+    if memory is not None:
+        memory.write_report(args.memory_report)
+    return 1 if failed else 0
+
+
+def _export_main(args, params, cache, budget=None, workers=None):
+    failed = 0
+    with open_export_writer(args.export, args.row_group_size) as writer:
+        for target in args.paths:
+            if os.path.isdir(target):
+                results = run_export(iter_source_files(target, args.suffix), params, writer, target, workers, cache=cache, image_field=args.image_field, budget=budget, backend=args.executor)
+            else:
+                path, row, error = _export_task((target, params, None, cache, args.image_field, budget))
+                if row is not None:
+                    writer.write(row)
+                results = [(path, error)]
+            for path, error in results:
+                if error:
+                    failed += 1
+                    print(f'转换失败 {path}: {error}', file=sys.stderr)
+    print(f'已导出 {writer.rows} 行到 {writer.path}')
+    return failed
+
+
+if __name__ == '__main__':
+    sys.exit(main())
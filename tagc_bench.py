@@ -0,0 +1,114 @@
+# 执行器基准：在同一批语料上比较进程池与线程池（无 GIL 的自由线程构建下才有意义）的吞吐。
+# 两种负载：batch 为批量模式的完整路径（读文件、转换、写出结果文件），
+# texts 为服务模式的路径（文本已在内存中，按块交给执行器转换后取回结果），后者更能体现进程间传输的开销。
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from tagc_batch import iter_source_files, read_source, run_batch
+from tagc_core import EXECUTOR_BACKENDS, add_pipeline_arguments, gil_disabled, make_executor, params_from_args
+from tagc_server import _convert_many, _split_by_size
+
+WORKLOADS = ('batch', 'texts')
+# texts 负载每个执行器任务包含的大致字符数
+TEXT_CHUNK_SIZE = 256 * 1024
+
+
+def _collect(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(iter_source_files(path))
+        else:
+            files.append(path)
+    return files
+
+
+def _run_batch_once(executor, files, params, workers):
+    with tempfile.TemporaryDirectory(prefix='tagc-bench-') as out_dir:
+        errors = [error for path, out_path, error in run_batch(files, params, None, out_dir, workers=workers, executor=executor) if error]
+    if errors:
+        raise RuntimeError(f'{len(errors)} 个文件转换失败: {errors[0]}')
+
+
+def _run_texts_once(executor, chunks, params):
+    for future in [executor.submit(_convert_many, params, chunk) for chunk in chunks]:
+        future.result()
+
+
+def bench_backend(backend, workload, files, params, workers=None, repeat=3):
+    """
+    用指定执行器运行 repeat 次负载（先空跑一次预热进程/流水线），返回 (各次耗时, 处理的字节数)。
+    """
+    workers = workers or os.cpu_count() or 1
+    total = sum(os.path.getsize(path) for path in files)
+    if workload == 'texts':
+        chunks = _split_by_size([read_source(path) for path in files], TEXT_CHUNK_SIZE)
+        run = lambda: _run_texts_once(executor, chunks, params)
+    else:
+        run = lambda: _run_batch_once(executor, files, params, workers)
+    times = []
+    with make_executor(workers, backend) as executor:
+        run()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+    return times, total
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='在同一批语料上比较进程池与线程池执行器的转换吞吐')
+    parser.add_argument('paths', nargs='+', help='语料目录或文件')
+    parser.add_argument('--executor', default='process,thread', help='要比较的执行器，逗号分隔：' + ','.join(EXECUTOR_BACKENDS))
+    parser.add_argument('--workload', default=','.join(WORKLOADS), help='负载，逗号分隔：' + ','.join(WORKLOADS))
+    parser.add_argument('--workers', type=int, default=None, help='进程/线程数，默认为CPU核数')
+    parser.add_argument('--repeat', type=int, default=3, help='每组计时的次数（另有一次预热）')
+    parser.add_argument('--output', default=None, help='把结果写入该 JSON 文件')
+    add_pipeline_arguments(parser)
+    args = parser.parse_args(argv)
+    backends = [name.strip() for name in args.executor.split(',') if name.strip()]
+    workloads = [name.strip() for name in args.workload.split(',') if name.strip()]
+    for name in backends:
+        if name not in EXECUTOR_BACKENDS:
+            parser.error(f'未知的执行器: {name}')
+    for name in workloads:
+        if name not in WORKLOADS:
+            parser.error(f'未知的负载: {name}')
+    files = _collect(args.paths)
+    if not files:
+        parser.error('没有找到可转换的文件')
+    params = params_from_args(args)
+    print(f'Python {sys.version.split()[0]}，GIL {"关闭" if gil_disabled() else "开启"}，{len(files)} 个文件', file=sys.stderr)
+    results = []
+    for workload in workloads:
+        baseline = None
+        for backend in backends:
+            times, total = bench_backend(backend, workload, files, params, args.workers, args.repeat)
+            best = min(times)
+            baseline = baseline or best
+            result = {
+                'workload': workload,
+                'executor': backend,
+                'best_seconds': round(best, 4),
+                'median_seconds': round(statistics.median(times), 4),
+                'files_per_second': round(len(files) / best, 1),
+                'mb_per_second': round(total / best / 1024 / 1024, 2),
+                'speedup': round(baseline / best, 2),
+            }
+            results.append(result)
+            print(f'{workload:6} {backend:8} 最快 {best:.3f}s  中位 {result["median_seconds"]:.3f}s  '
+                  f'{result["files_per_second"]} 文件/s  {result["mb_per_second"]} MB/s  相对首项 ×{result["speedup"]}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'gil_disabled': gil_disabled(), 'workers': args.workers or os.cpu_count() or 1, 'files': len(files),
+                       'results': results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+from tagc_core import PARAM_DEFAULTS, normalize_options
+from tagc_metrics import METRICS, labels
+
+# 转换逻辑改变、同样输入会得到不同结果时递增，使旧缓存整体失效
+CACHE_VERSION = 1
+CACHE_FILE = 'tagc_cache.sqlite3'
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+# 命中时最近使用时间的更新粒度（秒），避免每次命中都写库
+TOUCH_INTERVAL = 3600
+# 淘汰时清理到上限的该比例，避免刚好卡在上限附近频繁淘汰
+EVICT_TARGET = 0.9
+
+_LABELS_HIT = labels(result='hit')
+_LABELS_MISS = labels(result='miss')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    key BLOB PRIMARY KEY,
+    result BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    accessed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed);
+'''
+
+
+def _vocab_path(params):
+    """参数实际使用的标签词表路径，不按词表排序时为 None"""
+    if params.get('tag_order') == 'vocab' and params.get('tag_vocab'):
+        return params['tag_vocab']
+    return None
+
+
+def _vocab_stat(params):
+    path = _vocab_path(params)
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def params_fingerprint(params):
+    """
+    转换参数的指纹：参数相同（含缺省值）的两次运行得到相同指纹。
+    按词表排序时计入词表文件的内容，词表修改后旧结果不再命中。
+    """
+    full = dict(PARAM_DEFAULTS, **params)
+    full['options'] = list(normalize_options(full.get('options')))
+    path = _vocab_path(full)
+    if path is not None:
+        try:
+            with open(path, 'rb') as f:
+                full['tag_vocab_digest'] = hashlib.blake2b(f.read(), digest_size=32).hexdigest()
+        except OSError:
+            # 词表读不出时转换本身会报错，不会写入缓存
+            full['tag_vocab_digest'] = None
+    return hashlib.blake2b(json.dumps([CACHE_VERSION, sorted(full.items())]).encode(), digest_size=32).digest()
+
+
+class ResultCache:
+    """
+    以内容寻址的转换结果缓存，保存在缓存目录下的单个 SQLite 文件中。
+    键为 转换参数指纹 + 源文件内容 的哈希，内容与参数都未变的文件直接复用上次的结果；
+    总大小超过 max_size 时按最近使用时间淘汰。
+    多个进程可同时使用同一缓存目录（WAL 模式），传给子进程时在子进程内重新打开；
+    同一进程内的多个线程（如无 GIL 时的线程池）可共用一个实例，每个线程使用自己的 SQLite 连接。
+    Args:
+        cache_dir (str): 缓存目录，不存在时自动创建
+        max_size (int): 缓存结果的总字节数上限
+    """
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.path = os.path.join(cache_dir, CACHE_FILE)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 本进程各线程打开的连接，close() 时一并关闭
+        self._conns = []
+        self._pid = None
+        self._fingerprints = {}
+        self._inserted = 0
+
+    def __reduce__(self):
+        return (open_cache, (self.cache_dir, self.max_size))
+
+    def _connection(self):
+        # SQLite 连接不能跨 fork 使用，子进程中首次访问时重新连接；同一连接也不在线程间共用
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._local = threading.local()
+                    self._conns = []
+                    self._pid = pid
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # 只在所属线程使用；关闭时可能在其他线程，因此关闭同线程检查
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def make_key(self, params, data):
+        """计算源内容（bytes/mmap 等缓冲区）在给定参数下的缓存键"""
+        # 词表文件的修改时间与大小一并作为键，运行中修改词表后重新计算指纹
+        fingerprint_key = (repr(sorted(params.items())), _vocab_stat(params))
+        fingerprint = self._fingerprints.get(fingerprint_key)
+        if fingerprint is None:
+            fingerprint = self._fingerprints[fingerprint_key] = params_fingerprint(params)
+        h = hashlib.blake2b(fingerprint, digest_size=32)
+        h.update(data)
+        return h.digest()
+
+    def get(self, key):
+        """返回缓存的结果，未命中返回 None"""
+        conn = self._connection()
+        row = conn.execute('SELECT result, accessed FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        now = int(time.time())
+        if now - row[1] >= TOUCH_INTERVAL:
+            conn.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def put(self, key, result):
+        """写入结果；本进程累计写入较多时顺带检查总大小并淘汰"""
+        conn = self._connection()
+        conn.execute('INSERT OR REPLACE INTO results (key, result, size, accessed) VALUES (?, ?, ?, ?)',
+                     (key, result, len(result), int(time.time())))
+        self._inserted += len(result)
+        if self._inserted >= self.max_size // 8:
+            self._inserted = 0
+            self.evict()
+
+    def evict(self):
+        """总大小超过上限时删除最久未使用的结果，返回删除的条数"""
+        conn = self._connection()
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_size:
+            return 0
+        excess = total - int(self.max_size * EVICT_TARGET)
+        keys = []
+        for key, size in conn.execute('SELECT key, size FROM results ORDER BY accessed'):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('DELETE FROM results WHERE key = ?', keys)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return len(keys)
+
+    def stats(self):
+        """返回 (条目数, 结果总字节数)"""
+        return tuple(self._connection().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone())
+
+    def close(self):
+        """关闭本进程各线程打开的连接"""
+        with self._lock:
+            conns, self._conns = self._conns, []
+            self._local = threading.local()
+            if self._pid != os.getpid():
+                return
+        for conn in conns:
+            conn.close()
+
+
+@lru_cache(maxsize=8)
+def open_cache(cache_dir, max_size=DEFAULT_MAX_SIZE):
+    """获取（并在本进程内复用）缓存目录对应的 ResultCache"""
+    return ResultCache(cache_dir, max_size)
+
+
+def cached_convert(cache, params, data, convert):
+    """
+    带缓存地转换：cache 为 None 时直接调用 convert()，
+    否则按 data（源文件原始内容）查缓存，未命中时调用 convert() 并写入结果。
+    """
+    if cache is None:
+        return convert()
+    key = cache.make_key(params, data)
+    result = cache.get(key)
+    if METRICS.enabled:
+        METRICS.inc('tagc_cache_requests', 1, _LABELS_HIT if result is not None else _LABELS_MISS)
+    if result is None:
+        result = convert()
+        cache.put(key, result)
+    return result
+
+
+def add_cache_arguments(parser):
+    """为命令行解析器添加结果缓存参数（批量/监视模式共用）"""
+    parser.add_argument('--cache-dir', default=None, help='结果缓存目录，内容与参数未变的文件直接复用上次的结果')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_SIZE // (1024 * 1024), help='结果缓存大小上限（MB）')
+
+
+def cache_from_args(args):
+    """按 add_cache_arguments 解析出的参数打开缓存，未指定 --cache-dir 时返回 None"""
+    if not args.cache_dir:
+        return None
+    return open_cache(args.cache_dir, args.cache_size * 1024 * 1024)
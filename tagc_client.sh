@@ -0,0 +1,62 @@
+#!/bin/sh
+# tagc_daemon.py 守护进程的 shell 客户端，走文本协议，不启动 Python 解释器，适合 find -exec 这类逐文件调用。
+# 依赖 socat（或支持 -U -N 的 OpenBSD nc）。
+# 用法：tagc_client.sh [-s 套接字] [-p 参数JSON] [-i] [文件...]
+#   -p  转换参数，同守护进程请求中除 text 以外的字段，如 '{"mode": 0, "options": "cn_comma,remove_artist"}'
+#   -i  直接写回原文件（先写临时文件再替换）
+#   省略文件时转换标准输入
+socket_path=${TAGC_SOCKET:-${XDG_RUNTIME_DIR:+$XDG_RUNTIME_DIR/tagc.sock}}
+socket_path=${socket_path:-/tmp/tagc-$(id -u).sock}
+params='{}'
+in_place=
+while getopts 's:p:i' opt; do
+    case $opt in
+        s) socket_path=$OPTARG ;;
+        p) params=$OPTARG ;;
+        i) in_place=1 ;;
+        *) exit 2 ;;
+    esac
+done
+shift $((OPTIND - 1))
+# 参数只能占一行
+params=$(printf '%s' "$params" | tr '\n' ' ')
+
+connect() {
+    if command -v socat >/dev/null 2>&1; then
+        socat - "UNIX-CONNECT:$socket_path"
+    else
+        nc -U -N "$socket_path"
+    fi
+}
+
+# 读取标准输入并转换，结果写到标准输出；失败时把守护进程的错误信息写到标准错误并返回 1
+convert() {
+    { printf '%s\n' "$params"; cat; } | connect | {
+        IFS= read -r status
+        case $status in
+            ok) cat ;;
+            '') printf '转换失败: 守护进程无响应: %s\n' "$socket_path" >&2; exit 1 ;;
+            *) printf '转换失败: %s\n' "${status#error }" >&2; exit 1 ;;
+        esac
+    }
+}
+
+if [ $# -eq 0 ]; then
+    convert
+    exit
+fi
+rc=0
+for path in "$@"; do
+    if [ -n "$in_place" ]; then
+        # 临时文件先复制原文件得到相同的权限，写入已有文件不改变权限，再整体替换原文件
+        if cp -p "$path" "$path.tmp" && convert < "$path" > "$path.tmp"; then
+            mv -f "$path.tmp" "$path" || rc=1
+        else
+            rm -f "$path.tmp"
+            rc=1
+        fi
+    else
+        convert < "$path" || rc=1
+    fi
+done
+exit $rc
@@ -1,7 +1,502 @@
+import asyncio
+import collections
+import os
 import re
-import math
+import sys
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 
-def process_tags(input_text, mode, options, precise_mode=False, short_line_threshold=20, cnline_blank_count=3, compress_blank_threshold=4, weight_limit=1.6):
+from tagc_metrics import METRICS, labels
+from tagc_weights import DEFAULT_WEIGHT_MODEL, WEIGHT_MODELS, get_weight_model
+
+# 预处理选项的名称，顺序与界面复选框及 options 列表下标一一对应
+OPTION_NAMES = (
+    'cn_comma',           # 0 转换中文逗号为英文逗号
+    'remove_cn',          # 1 删除中文标签
+    'cn_line_blank',      # 2 将中文行替换空行
+    'remove_artist',      # 3 删除artist标签
+    'compress_blank',     # 4 压缩空行
+    'remove_backslash',   # 5 移除反斜杠
+    'split_compound',     # 6 拆分复合标签
+    'underscore_space',   # 7 替换下划线为空格
+    'remove_short_line',  # 8 删除短行
+    'limit_weight',       # 9 限制权重最大值
+)
+
+# process_tags 的可选参数及默认值
+PARAM_DEFAULTS = {
+    'precise_mode': False,
+    'short_line_threshold': 20,
+    'cnline_blank_count': 3,
+    'compress_blank_threshold': 4,
+    'weight_limit': 1.6,
+    'weight_model': DEFAULT_WEIGHT_MODEL,
+    'tag_dedup': '',
+    'tag_order': '',
+    'tag_vocab': '',
+}
+
+# 指标标签，预先构造避免热路径上重复创建
+_LABELS_STR = labels(engine='str')
+_LABELS_BYTES = labels(engine='bytes')
+_LABELS_PARALLEL = labels(engine='parallel')
+
+# 同一行内重复标签的合并方式：max 取最大权重，first 取第一次出现的权重，sum 把权重的指数相加（即权重相乘）
+TAG_DEDUP_POLICIES = ('max', 'first', 'sum')
+# 标签排序方式：weight 按权重从高到低，vocab 按 tag_vocab 词表中的顺序（不在词表中的排在最后）
+TAG_ORDERS = ('weight', 'vocab')
+
+# 预编译正则，所有流水线共用
+_RE_CJK = re.compile(r'[\u4e00-\u9fff]+')
+_RE_ARTIST_MID = re.compile(r'([,，])[^,，]*artist[^,，]*([,，])', re.I)
+_RE_ARTIST_TAIL = re.compile(r'(^|[,，])[^,，]*artist[^,，]*$', re.I | re.M)
+_RE_ARTIST_HEAD = re.compile(r'[^,，]*artist[^,，]*([,，])', re.I)
+_RE_MULTI_COMMA = re.compile(r',{2,}')
+_RE_EDGE_COMMA = re.compile(r'^,|,$')
+# 分段转换时按该段是否位于全文开头/结尾选用的首尾逗号正则
+_RE_EDGE_COMMAS = {
+    (True, True): _RE_EDGE_COMMA,
+    (True, False): re.compile(r'^,'),
+    (False, True): re.compile(r',$'),
+    (False, False): None,
+}
+_RE_ARTIST_WORD = re.compile(r'artist', re.I)
+# 没有字符在 re.I 下匹配或小写后变为 y/e/a/r，因此与 lower() 后查找 year 等价
+_RE_YEAR = re.compile(r'year', re.I)
+_RE_FLOAT_OPEN = re.compile(r'\d+\.\d+::')
+_RE_FLOAT_WEIGHT = re.compile(r'(\d+\.\d+)::(.*?)::', re.DOTALL)
+_RE_BRACKET_WEIGHT = re.compile(r'([{{\[{]+)(.*?)([}}\]]+)', re.DOTALL)
+_RE_SD_WEIGHT = re.compile(r'\(([^:]+):([\d.]+)\)')
+_RE_WEIGHT_VALUE = re.compile(r'(:)(\d+\.?\d*)')
+_RE_TRIM_WEIGHT = re.compile(r'\(([^:()]+):([0-9]+\.[0-9]+)\)')
+
+
+class TagPipeline:
+    """
+    预编译的标签处理流水线。
+    构造时按参数一次性确定要执行的步骤，之后可对任意文本重复调用，
+    避免每次转换都重新判断选项、拼接正则。
+    """
+    def __init__(self, mode, options, precise_mode=False, short_line_threshold=20, cnline_blank_count=3, compress_blank_threshold=4, weight_limit=1.6, weight_model=DEFAULT_WEIGHT_MODEL, tag_dedup='', tag_order='', tag_vocab=''):
+        self.mode = mode
+        self.options = tuple(options)
+        self.precise_mode = precise_mode
+        self.short_line_threshold = short_line_threshold
+        self.cnline_blank_count = cnline_blank_count
+        self.compress_blank_threshold = compress_blank_threshold
+        self.weight_limit = weight_limit
+        self.weight_model = weight_model
+        self._weights = get_weight_model(weight_model)
+        self.tag_dedup = tag_dedup
+        self.tag_order = tag_order
+        self.tag_vocab = tag_vocab
+        if tag_dedup and tag_dedup not in TAG_DEDUP_POLICIES:
+            raise ValueError(f"未知的重复标签合并方式: {tag_dedup}")
+        if tag_order and tag_order not in TAG_ORDERS:
+            raise ValueError(f"未知的标签排序方式: {tag_order}")
+        if tag_order == 'vocab' and not tag_vocab:
+            raise ValueError("按词表排序需要指定 tag_vocab")
+        self._vocab = load_tag_vocab(tag_vocab) if tag_order == 'vocab' else None
+        # 写出权重的小数位数由权重模型决定（digits / precise_digits）
+        self._weight_spec = f'.{self._weights.precise_digits if precise_mode else self._weights.digits}f'
+        self._filters = self._build_filters()
+        self._chunk_filters = {}
+        self._convert = self._convert_nai_to_sd if mode == 0 else self._convert_sd_to_nai
+
+    def __reduce__(self):
+        # 流水线内含闭包无法直接序列化，传给子进程时按参数在子进程内重新获取
+        return (get_pipeline, (self.mode, self.options, self.precise_mode, self.short_line_threshold,
+                               self.cnline_blank_count, self.compress_blank_threshold, self.weight_limit,
+                               self.weight_model, self.tag_dedup, self.tag_order, self.tag_vocab))
+
+    def _build_filters(self, edge_comma=_RE_EDGE_COMMA):
+        options = self.options
+        filters = []
+        if options[0]:
+            filters.append(lambda text: text.replace('，', ','))
+        if options[1] and not options[2]:
+            filters.append(lambda text: _RE_CJK.sub('', text))
+        def add_line_stage(stage):
+            # 相邻的按行步骤合并为一组，共用同一份逐行索引
+            if not filters or not isinstance(filters[-1], _LineStages):
+                filters.append(_LineStages())
+            filters[-1].stages.append(stage)
+        if options[2] and not options[1]:
+            blank_count = self.cnline_blank_count
+            add_line_stage(lambda index: index.blank_cjk_lines(blank_count))
+        if options[3]:
+            filters.append(lambda text: self._remove_artist(text, edge_comma))
+        if options[4]:
+            threshold = self.compress_blank_threshold
+            if threshold >= 1:
+                add_line_stage(lambda index: index.compress_blank_lines(threshold))
+            else:
+                compress = re.compile(r'(\n\s*){' + str(threshold) + ',}')
+                filters.append(lambda text: compress.sub('\n', text))
+        if options[5]:
+            filters.append(lambda text: text.replace('\\', ''))
+        if options[7]:
+            filters.append(lambda text: text.replace('_', ' '))
+        if len(options) > 8 and options[8]:
+            short_line_threshold = self.short_line_threshold
+            add_line_stage(lambda index: index.filter_short_lines(short_line_threshold))
+        return filters
+
+    def __call__(self, text):
+        """对文本执行完整的处理流程，返回处理后的文本"""
+        if METRICS.enabled:
+            return self._call_with_metrics(text)
+        for apply_filter in self._filters:
+            text = apply_filter(text)
+        result = self._convert(text)
+        if self.tag_dedup or self.tag_order:
+            result = self._canonicalize_tags(result)
+        if len(self.options) > 9 and self.options[9]:
+            result = _RE_WEIGHT_VALUE.sub(self._limit_weight, result)
+        # 权重自动规整，仅在精确权重转换关闭时启用
+        if not self.precise_mode:
+            result = _RE_TRIM_WEIGHT.sub(_trim_weight_zero, result)
+        return result
+
+    def _call_with_metrics(self, text):
+        """与 __call__ 相同，另外记录转换次数与各步骤耗时"""
+        METRICS.inc('tagc_conversions', 1, _LABELS_STR)
+        with METRICS.timer('preprocess'):
+            text = self._preprocess(text)
+        with METRICS.timer('convert'):
+            result = self._convert(text)
+        if self.tag_dedup or self.tag_order:
+            with METRICS.timer('canonicalize'):
+                result = self._canonicalize_tags(result)
+        with METRICS.timer('postprocess'):
+            return self._postprocess(result)
+
+    def _preprocess(self, text):
+        for apply_filter in self._filters:
+            text = apply_filter(text)
+        return text
+
+    def _postprocess(self, result):
+        if len(self.options) > 9 and self.options[9]:
+            result = _RE_WEIGHT_VALUE.sub(self._limit_weight, result)
+        if not self.precise_mode:
+            result = _RE_TRIM_WEIGHT.sub(_trim_weight_zero, result)
+        return result
+
+    def convert_chunk(self, text, first=True, last=True):
+        """
+        转换大文本中按行切出的一段，供并行转换使用。
+        Args:
+            text (str): 该段文本，除最后一段外均以换行结尾
+            first (bool): 该段是否位于全文开头（决定是否删除开头的逗号）
+            last (bool): 该段是否位于全文结尾（决定是否删除结尾的逗号）
+        Returns:
+            tuple: (转换结果, 段尾是否留有未闭合的权重语法, 是否所有行都被删除短行删掉)；
+                   第二项为 True 时该段与下一段之间不能切开，需要合并后重新转换
+        """
+        filters = self._chunk_filters.get((first, last))
+        if filters is None:
+            filters = self._chunk_filters[(first, last)] = self._build_filters(_RE_EDGE_COMMAS[(first, last)])
+        # 删除短行总是最后一组按行步骤的最后一步，这里单独执行该组以便得知是否删光了所有行
+        filter_lines = len(self.options) > 8 and self.options[8]
+        for apply_filter in filters[:-1] if filter_lines else filters:
+            text = apply_filter(text)
+        emptied = False
+        if filter_lines:
+            index = filters[-1].run(text)
+            emptied = not index.lines
+            text = index.text()
+        if self.mode == 0:
+            text = self._convert_float_weight(text)
+            # 未闭合的 数字:: 会原样留在结果中；最后一个左括号之后没有右括号时同样可能与下一段配对
+            unclosed = _RE_FLOAT_OPEN.search(text) is not None
+            unclosed = unclosed or max(text.rfind('{'), text.rfind('[')) > max(text.rfind('}'), text.rfind(']'))
+            text = self._convert_bracket_weight(text)
+        else:
+            unclosed = text.rfind('(') > text.rfind(':')
+            text = self._convert_sd_to_nai(text)
+        if self.tag_dedup or self.tag_order:
+            text = self._canonicalize_tags(text)
+        if len(self.options) > 9 and self.options[9]:
+            text = _RE_WEIGHT_VALUE.sub(self._limit_weight, text)
+        if not self.precise_mode:
+            unclosed = unclosed or text.rfind('(') > max(text.rfind(':'), text.rfind(')'))
+            text = _RE_TRIM_WEIGHT.sub(_trim_weight_zero, text)
+        return text, unclosed, emptied
+
+    @staticmethod
+    def _remove_artist(text, edge_comma=_RE_EDGE_COMMA):
+        text = _RE_ARTIST_MID.sub(',', text)
+        text = _RE_ARTIST_TAIL.sub('', text)
+        text = _RE_ARTIST_HEAD.sub(r'\1', text)
+        text = _RE_MULTI_COMMA.sub(',', text)
+        return edge_comma.sub('', text) if edge_comma is not None else text
+
+    def _format_weighted(self, content, weight):
+        weight_text = format(weight, self._weight_spec)
+        if self.options[6]:
+            tags = [tag.strip() for tag in content.split(',') if tag.strip()]
+            return ','.join([f'({tag}:{weight_text})' for tag in tags])
+        return f'({content.strip()}:{weight_text})'
+
+    def _convert_nai_to_sd(self, text):
+        return self._convert_bracket_weight(self._convert_float_weight(text))
+
+    def _convert_float_weight(self, text):
+        def replace_float_weight(match):
+            return self._format_weighted(match.group(2), float(match.group(1)))
+        return _RE_FLOAT_WEIGHT.sub(replace_float_weight, text)
+
+    def _convert_bracket_weight(self, text):
+        def replace_bracket_weight(match):
+            left_brackets = match.group(1)
+            count = max(len(left_brackets), len(match.group(3)))
+            weight = bracket_weight(left_brackets[0] == '{', count, precise)
+            return self._format_weighted(match.group(2), weight)
+        bracket_weight = self._weights.bracket_weight
+        precise = self.precise_mode
+        return _RE_BRACKET_WEIGHT.sub(replace_bracket_weight, text)
+
+    def _convert_sd_to_nai(self, text):
+        def replace_sd(match):
+            content, weight = match.groups()
+            is_up, count = brackets_for(float(weight))
+            if is_up:
+                return '{' * count + content + '}' * count
+            else:
+                return '[' * count + content + ']' * count
+        brackets_for = self._weights.brackets_for
+        return _RE_SD_WEIGHT.sub(replace_sd, text)
+
+    def _canonicalize_tags(self, text):
+        """
+        逐行合并重复标签并按需排序，每行只做一遍哈希查找。标签按 canonical_tag 比较（忽略大小写与下划线/空格差异），
+        合并后的标签保留第一次出现的写法与位置；只重写需要改动的行，且只重新格式化权重有变化或需拆开的括号组。
+        """
+        dedup = self.tag_dedup
+        lines = text.split('\n')
+        for i, line in enumerate(lines):
+            # 括号不配对（如跨行的权重组）的行不改动
+            if (line.count('{') != line.count('}') or line.count('[') != line.count(']')
+                    or line.count('(') != line.count(')') or line.count('::') % 2):
+                continue
+            groups = list(iter_tag_groups(line, self.weight_model))
+            if not groups:
+                continue
+            # 每项为 [标签, 权重, 原文, 有符号括号层数]；原文为 None 时按权重（或层数）重新写出
+            entries = []
+            index = {}
+            changed = False
+            for start, end, tags in groups:
+                prefix, suffix, depth = _group_wrapper(_RE_TAG_TOKEN.match(line, start))
+                single = line[start:end].strip() if len(tags) == 1 else None
+                for tag, weight in tags:
+                    # 多个标签共用的括号组拆开后，每个标签仍套上该组原来的括号
+                    source = single or prefix + tag + suffix
+                    key = canonical_tag(tag)
+                    position = index.get(key) if dedup else None
+                    if position is None:
+                        index[key] = len(entries)
+                        entries.append([tag, weight, source, depth])
+                        continue
+                    changed = True
+                    entry = entries[position]
+                    if dedup == 'max' and weight > entry[1]:
+                        # 沿用权重最大的那次出现的原文，括号权重换算有舍入，重新写出可能多出一层
+                        entry[1], entry[2], entry[3] = weight, source, depth
+                    elif dedup == 'sum' and weight != 1.0:
+                        both = entry[3] is not None and depth is not None
+                        entry[1], entry[2], entry[3] = entry[1] * weight, None, entry[3] + depth if both else None
+            if self.tag_order == 'weight':
+                ordered = sorted(entries, key=lambda entry: -entry[1])
+            elif self.tag_order == 'vocab':
+                vocab = self._vocab
+                ordered = sorted(entries, key=lambda entry: vocab.get(canonical_tag(entry[0]), len(vocab)))
+            else:
+                ordered = entries
+            if not changed and ordered == entries:
+                continue
+            body = ', '.join(source or self._format_tag(tag, weight, depth) for tag, weight, source, depth in ordered)
+            lines[i] = line[:groups[0][0]] + body + line[groups[-1][1]:]
+        return '\n'.join(lines)
+
+    def _format_tag(self, tag, weight, depth=None):
+        """按转换目标格式写出单个带权重的标签；SD→NAI 时已知括号层数（{} 为正，[] 为负）则直接按层数写出"""
+        if self.mode == 1 and depth is not None:
+            return '{' * depth + tag + '}' * depth if depth >= 0 else '[' * -depth + tag + ']' * -depth
+        if abs(weight - 1.0) < 1e-9:
+            return tag
+        if self.mode == 0:
+            return f'({tag}:{format(weight, self._weight_spec)})'
+        is_up, count = self._weights.brackets_for(weight)
+        return '{' * count + tag + '}' * count if is_up else '[' * count + tag + ']' * count
+
+    def _limit_weight(self, match):
+        colon = match.group(1)
+        weight = float(match.group(2))
+        limit = self.weight_limit
+        if weight > limit:
+            return f"{colon}{limit:.2f}"
+        else:
+            return f"{colon}{weight:.2f}" if '.' in match.group(2) else match.group(0)
+
+
+def _filter_line(line, threshold):
+    """删除短行但保留空行和中文行，year特殊处理；返回保留的内容，删除时返回 None"""
+    line_stripped = line.strip()
+    if not line_stripped:
+        return line
+    has_chinese = _RE_CJK.search(line_stripped) is not None
+    if has_chinese or len(line_stripped) >= threshold:
+        if 'year' in line_stripped.lower():
+            return line[line.lower().find('year'):]
+        return line
+    return None
+
+
+class LineIndex:
+    """
+    文本的逐行特征索引：按换行拆分后的各行、每行去除首尾空白后的长度（为0即空行）
+    以及是否含中文，year 的位置在删除短行时按需计算。
+    中文行替换空行、压缩空行、删除短行三个按行步骤直接在索引上修改，
+    相邻步骤之间不必重新拼接文本、逐字符扫描。
+    """
+    __slots__ = ('lines', 'stripped', 'cjk')
+
+    def __init__(self, text):
+        self.lines = lines = text.split('\n')
+        self.stripped = list(map(len, map(str.strip, lines)))
+        search = _RE_CJK.search
+        self.cjk = bytearray([0 if line.isascii() else search(line) is not None for line in lines])
+
+    def text(self):
+        return '\n'.join(self.lines)
+
+    def blank_cjk_lines(self, count):
+        """把含中文的行替换为 count 个换行，即该行变为 count+1 个空行"""
+        if 1 not in self.cjk:
+            return
+        blank = max(count, 0) + 1
+        lines, stripped = [], []
+        prev = 0
+        line = self.cjk.find(1)
+        while line != -1:
+            lines += self.lines[prev:line]
+            lines += [''] * blank
+            stripped += self.stripped[prev:line]
+            stripped += [0] * blank
+            prev = line + 1
+            line = self.cjk.find(1, prev)
+        lines += self.lines[prev:]
+        stripped += self.stripped[prev:]
+        self.lines, self.stripped, self.cjk = lines, stripped, bytearray(len(lines))
+
+    def compress_blank_lines(self, threshold):
+        """
+        与 re.sub(r'(\n\s*){threshold,}', '\n', text) 等价的空行压缩（threshold >= 1）。
+        两个非空行（或文本首尾）之间的换行数达到阈值时，删除其间的空行，并去掉后一行开头的空白。
+        """
+        stripped = self.stripped
+        last = len(stripped) - 1
+        if last < threshold:
+            return
+        if threshold == 1:
+            # 阈值为1时每个换行都会吞掉其后的空白：删除全部中间空行，其余行去掉开头的空白
+            keep = [0] + [i for i in range(1, last) if stripped[i]] + [last]
+            lines = self.lines
+            self.lines = [lines[0]] + [lines[i].lstrip() for i in keep[1:]]
+            self.stripped = [stripped[i] for i in keep]
+            self.cjk = bytearray(self.cjk[i] for i in keep)
+            return
+        # 找出各段连续空行，a/b 为其前后的边界行（文本开头/结尾的空行本身作为边界行）
+        spans = []
+        prev = 0
+        start = stripped.index(0) if 0 in stripped else -1
+        while start != -1:
+            end = start
+            while end < last and not stripped[end + 1]:
+                end += 1
+            a = start - 1 if start else 0
+            b = end + 1 if end < last else last
+            if b - a >= threshold:
+                spans.append((prev, a + 1))
+                prev = b
+            if b >= last:
+                break
+            try:
+                start = stripped.index(0, b + 1)
+            except ValueError:
+                start = -1
+        if not spans:
+            return
+        spans.append((prev, last + 1))
+        lines, new_stripped, cjk = [], [], bytearray()
+        for i, (start, end) in enumerate(spans):
+            if i:
+                # 被压缩的空白延伸到下一行开头
+                lines.append(self.lines[start].lstrip())
+                lines += self.lines[start + 1:end]
+            else:
+                lines += self.lines[start:end]
+            new_stripped += stripped[start:end]
+            cjk += self.cjk[start:end]
+        self.lines, self.stripped, self.cjk = lines, new_stripped, cjk
+
+    def filter_short_lines(self, threshold):
+        """删除短行但保留空行和中文行，含 year 的行从 year 处截断（与 _filter_line 一致）"""
+        lines, stripped, cjk = self.lines, self.stripped, self.cjk
+        keep = [i for i, length in enumerate(stripped) if length >= threshold or not length or cjk[i]]
+        self.lines = lines = [lines[i] for i in keep]
+        self.stripped = stripped = [stripped[i] for i in keep]
+        self.cjk = cjk = bytearray([cjk[i] for i in keep])
+        search = _RE_YEAR.search
+        for i in [i for i, line in enumerate(lines) if search(line)]:
+            line = lines[i]
+            line = lines[i] = line[line.lower().find('year'):]
+            stripped[i] = len(line.strip())
+            cjk[i] = _RE_CJK.search(line) is not None
+
+
+class _LineStages:
+    """一组相邻的按行步骤，对同一份 LineIndex 依次执行"""
+    def __init__(self):
+        self.stages = []
+
+    def run(self, text):
+        index = LineIndex(text)
+        for stage in self.stages:
+            stage(index)
+        return index
+
+    def __call__(self, text):
+        return self.run(text).text()
+
+
+def _trim_weight_zero(m):
+    tag = m.group(1)
+    weight = m.group(2)
+    weight_str = str(float(weight)).rstrip('0').rstrip('.') if '.' in weight else weight
+    return f'({tag}:{weight_str})'
+
+
+@lru_cache(maxsize=64)
+def _compile_pipeline(mode, options, precise_mode, short_line_threshold, cnline_blank_count, compress_blank_threshold, weight_limit, weight_model, tag_dedup, tag_order, tag_vocab):
+    return TagPipeline(mode, options, precise_mode, short_line_threshold, cnline_blank_count, compress_blank_threshold, weight_limit, weight_model, tag_dedup, tag_order, tag_vocab)
+
+
+def get_pipeline(mode, options, precise_mode=False, short_line_threshold=20, cnline_blank_count=3, compress_blank_threshold=4, weight_limit=1.6, weight_model=DEFAULT_WEIGHT_MODEL, tag_dedup='', tag_order='', tag_vocab=''):
+    """
+    获取（并缓存）与参数对应的预编译流水线。
+    相同参数组合在同一进程内只构建一次，服务模式下可保持常驻。
+    Returns:
+        TagPipeline: 可调用的流水线对象
+    """
+    return _compile_pipeline(mode, tuple(bool(o) for o in options), bool(precise_mode), short_line_threshold, cnline_blank_count, compress_blank_threshold, weight_limit, weight_model, tag_dedup, tag_order, tag_vocab)
+
+
+def process_tags(input_text, mode, options, precise_mode=False, short_line_threshold=20, cnline_blank_count=3, compress_blank_threshold=4, weight_limit=1.6, weight_model=DEFAULT_WEIGHT_MODEL, tag_dedup='', tag_order='', tag_vocab='', workers=None):
     """
     后端核心处理函数，负责标签文本的全部处理逻辑。
     Args:
@@ -13,109 +508,823 @@ def process_tags(input_text, mode, options, precise_mode=False, short_line_thres
         cnline_blank_count (int): 中文行替换空行数
         compress_blank_threshold (int): 压缩空行阈值
         weight_limit (float): 权重上限
+        weight_model (str): 括号权重模型名称，见 tagc_weights.WEIGHT_MODELS
+        tag_dedup (str): 行内重复标签的合并方式（见 TAG_DEDUP_POLICIES），空字符串为不合并
+        tag_order (str): 标签排序方式（见 TAG_ORDERS），空字符串为保持原顺序
+        tag_vocab (str): tag_order 为 vocab 时使用的标签词表文件
+        workers (int): 并行转换的进程数；大于1且文本足够大时按行切分后并行转换，结果与串行一致
     Returns:
         str: 处理后的文本
     """
-    def apply_optional_filters(text):
-        if options[0]:
-            text = re.sub(r'，', ',', text)
-        if options[1] and not options[2]:
-            text = re.sub(r'[\u4e00-\u9fff]+', '', text)
-        if options[2] and not options[1]:
-            blank = '\n' * cnline_blank_count
-            text = re.sub(r'^.*[\u4e00-\u9fff]+.*$', blank, text, flags=re.M)
+    pipeline = get_pipeline(mode, options, precise_mode, short_line_threshold, cnline_blank_count, compress_blank_threshold, weight_limit, weight_model, tag_dedup, tag_order, tag_vocab)
+    if workers and workers > 1 and len(input_text) >= PARALLEL_MIN_SIZE:
+        if METRICS.enabled:
+            METRICS.inc('tagc_conversions', 1, _LABELS_PARALLEL)
+            with METRICS.timer('parallel'):
+                return convert_parallel(pipeline, input_text, workers)
+        return convert_parallel(pipeline, input_text, workers)
+    return pipeline(input_text)
+
+
+_RE_TAG_TOKEN = re.compile(
+    r'(?P<float_weight>\d+(?:\.\d*)?)::(?P<float_body>.*?)::'
+    r'|\((?P<sd_body>[^():]+):(?P<sd_weight>\d+(?:\.\d*)?)\)'
+    r'|(?P<up>\{+)(?P<up_body>[^{}]*)\}+'
+    r'|(?P<down>\[+)(?P<down_body>[^\[\]]*)\]+'
+    r'|(?P<plain>[^,，\s][^,，\n]*)',
+    re.DOTALL,
+)
+
+
+def canonical_tag(tag):
+    """标签的比较用形式：小写、下划线视为空格、连续空白合并"""
+    return ' '.join(tag.replace('_', ' ').split()).lower()
+
+
+def has_cjk(text):
+    """文本中是否含有中文字符（与中文相关预处理选项使用同一判定）"""
+    return _RE_CJK.search(text) is not None
+
+
+@lru_cache(maxsize=8)
+def load_tag_vocab(path):
+    """
+    读取标签词表，返回 {canonical_tag: 序号}。每行一个标签，
+    也可直接使用 danbooru 等标签 CSV（tag,category,count,...），只取每行第一列。
+    """
+    vocab = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            key = canonical_tag(line.split(',', 1)[0])
+            if key and key not in vocab:
+                vocab[key] = len(vocab)
+    return vocab
+
+
+def _group_wrapper(match):
+    """标签组的前缀、后缀（如 '{{' 与 '}}'）与有符号括号层数：{} 为正，[] 为负，无权重为 0，其他权重写法为 None"""
+    for name in ('float_body', 'sd_body', 'up_body', 'down_body'):
+        if match.group(name) is not None:
+            prefix = match.string[match.start():match.start(name)]
+            suffix = match.string[match.end(name):match.end()]
+            if name == 'up_body':
+                return prefix, suffix, len(match.group('up'))
+            if name == 'down_body':
+                return prefix, suffix, -len(match.group('down'))
+            return prefix, suffix, None
+    return '', '', 0
+
+
+def iter_tag_groups(text, weight_model=DEFAULT_WEIGHT_MODEL):
+    """
+    逐组产出提示词中的标签：单个标签或一个权重括号组为一组，产出 (起始位置, 结束位置, [(标签, 权重), ...])。
+    与 parse_tags 的拆分规则相同，附带原文位置，便于按组删改提示词。
+    """
+    model = get_weight_model(weight_model)
+    for match in _RE_TAG_TOKEN.finditer(text):
+        if match.group('plain') is not None:
+            tag = match.group('plain').strip().strip('()').strip()
+            if tag:
+                yield match.start(), match.end(), [(tag, 1.0)]
+            continue
+        if match.group('float_weight') is not None:
+            body, weight = match.group('float_body'), float(match.group('float_weight'))
+        elif match.group('sd_body') is not None:
+            body, weight = match.group('sd_body'), float(match.group('sd_weight'))
+        elif match.group('up') is not None:
+            body, weight = match.group('up_body'), model.bracket_weight(True, len(match.group('up')), True)
+        else:
+            body, weight = match.group('down_body'), model.bracket_weight(False, len(match.group('down')), True)
+        tags = [(tag, weight) for tag in (part.strip() for part in re.split('[,，\n]', body)) if tag]
+        if tags:
+            yield match.start(), match.end(), tags
+
+
+def parse_tags(text, weight_model=DEFAULT_WEIGHT_MODEL):
+    """
+    把提示词拆分为 (标签, 权重) 列表，SD 的 (tag:1.2)、NAI 的 {tag}/[tag] 与 1.2::tag:: 均可识别。
+    括号内以逗号分隔的多个标签共用同一权重，括号权重按 weight_model 换算（保留三位小数），无权重的标签为 1.0。
+    Args:
+        text (str): 提示词文本（转换前后均可）
+        weight_model (str): 括号权重模型名称
+    Returns:
+        list: [(标签, 权重), ...]
+    """
+    return [tag for start, end, tags in iter_tag_groups(text, weight_model) for tag in tags]
+
+
+# ---- 执行器：有 GIL 时用进程池并行；无 GIL 的自由线程构建（3.13t 起）用线程池，
+# 各线程共用本进程缓存的流水线与权重表，任务参数与结果不经序列化、不在进程间复制 ----
+
+# 'auto' 按解释器是否启用 GIL 选择线程池或进程池
+EXECUTOR_BACKENDS = ('auto', 'process', 'thread')
+
+
+def gil_disabled():
+    """当前解释器是否在无 GIL 模式下运行（自由线程构建，且未用 PYTHON_GIL=1 重新启用 GIL）"""
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def resolve_backend(backend=None):
+    """把 'auto'（或 None）解析为实际使用的 'process' 或 'thread'"""
+    if backend is None or backend == 'auto':
+        return 'thread' if gil_disabled() else 'process'
+    if backend not in EXECUTOR_BACKENDS:
+        raise ValueError(f"executor 只能为 {'/'.join(EXECUTOR_BACKENDS)}")
+    return backend
+
+
+def make_executor(workers=None, backend=None, initializer=None):
+    """
+    创建转换用的执行器。
+    Args:
+        workers (int): 线程/进程数，默认为CPU核数
+        backend (str): EXECUTOR_BACKENDS 之一，默认 'auto'
+        initializer (callable): 每个线程/子进程启动时调用
+    """
+    workers = workers or os.cpu_count() or 1
+    if resolve_backend(backend) == 'thread':
+        return ThreadPoolExecutor(workers, thread_name_prefix='tagc', initializer=initializer)
+    return ProcessPoolExecutor(workers, initializer=initializer)
+
+
+def is_thread_executor(executor):
+    """执行器的任务是否在本进程内执行（与主线程共用缓存与指标注册表）"""
+    return isinstance(executor, ThreadPoolExecutor)
+
+
+# ---- 单个大文本的并行转换：在安全的行边界切分，各段并行处理后按顺序拼接 ----
+
+# 小于该长度的文本不值得切分
+PARALLEL_MIN_SIZE = 4 * 1024 * 1024
+# 每段的最小长度
+PARALLEL_CHUNK_MIN = 1024 * 1024
+
+
+def _is_safe_seam(prev_line, next_line, options):
+    """
+    判断两行之间能否切开：前置过滤步骤（删除artist、压缩空行等）的匹配不会跨过这个换行。
+    权重语法是否闭合要在过滤之后才能确定，由 convert_chunk 在转换时检查。
+    """
+    if (options[1] or options[2]) and (_RE_CJK.search(prev_line) or _RE_CJK.search(next_line)):
+        return False
+    if options[3]:
+        # artist 相关正则以逗号为界。两行都不含 artist 时，前一行最后一个逗号与后一行前两个逗号
+        # 在删除过程中都会保留，匹配不会越过它们之间的换行
+        if _RE_ARTIST_WORD.search(prev_line) or _RE_ARTIST_WORD.search(next_line):
+            return False
+        if (',' not in prev_line and '，' not in prev_line) or next_line.count(',') + next_line.count('，') < 2:
+            return False
+    if options[4]:
+        # 前一行非空、后一行不以空白开头时，空行压缩的匹配不会包含这个换行之外的内容
+        if not prev_line.strip() or not next_line or next_line[0].isspace():
+            return False
+    return True
+
+
+def split_safe_chunks(text, chunk_size, options, compress_blank_threshold=4):
+    """
+    在可安全切分的行边界把文本切成长度约为 chunk_size 的若干段，每段（最后一段除外）以换行结尾。
+    Returns:
+        list: 按顺序排列的文本段，拼接后等于原文本
+    """
+    options = tuple(bool(o) for o in options)
+    if options[4] and compress_blank_threshold < 1:
+        return [text]
+    chunks = []
+    start = 0
+    while len(text) - start > chunk_size:
+        pos = text.find('\n', start + chunk_size)
+        seam = None
+        while pos != -1:
+            next_end = text.find('\n', pos + 1)
+            if next_end == -1:
+                break
+            if _is_safe_seam(text[text.rfind('\n', 0, pos) + 1:pos], text[pos + 1:next_end], options):
+                seam = pos + 1
+                break
+            pos = next_end
+        if seam is None:
+            break
+        chunks.append(text[start:seam])
+        start = seam
+    chunks.append(text[start:])
+    return chunks
+
+
+def _convert_chunk_task(pipeline, text, first, last):
+    return pipeline.convert_chunk(text, first, last)
+
+
+def convert_parallel(pipeline, text, workers=None, executor=None, chunk_size=None):
+    """
+    把单个大文本切分后并行转换（进程池或无 GIL 时的线程池，见 make_executor），结果与 pipeline(text) 完全一致。
+    某段末尾留有未闭合的 {、[、:: 等语法时，与后面的段合并后在本进程重新转换，
+    连续合并时每次合并的段数翻倍，避免未闭合语法出现在开头时退化为平方复杂度。
+    Args:
+        pipeline (TagPipeline): get_pipeline 返回的流水线
+        text (str): 输入文本
+        workers (int): 进程数，默认为CPU核数
+        executor: 复用外部传入的执行器
+        chunk_size (int): 每段的目标长度，默认按进程数的4倍切分
+    """
+    workers = workers or os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(PARALLEL_CHUNK_MIN, len(text) // (workers * 4))
+    chunks = split_safe_chunks(text, chunk_size, pipeline.options, pipeline.compress_blank_threshold)
+    if len(chunks) == 1:
+        return pipeline(text)
+    own_executor = executor is None
+    if own_executor:
+        executor = make_executor(min(workers, len(chunks)))
+    try:
+        count = len(chunks)
+        futures = [executor.submit(_convert_chunk_task, pipeline, chunk, i == 0, i == count - 1) for i, chunk in enumerate(chunks)]
+        results = []
+        i = 0
+        while i < count:
+            result, unclosed, emptied = futures[i].result()
+            start, end, step = i, i + 1, 1
+            while unclosed and end < count:
+                end = min(count, end + step)
+                step *= 2
+                result, unclosed, emptied = pipeline.convert_chunk(''.join(chunks[start:end]), start == 0, end == count)
+            for future in futures[i + 1:end]:
+                future.cancel()
+            results.append(result)
+            i = end
+        output = ''.join(results)
+        # 最后一段的行全部被删除时，串行处理不会保留前一段末尾的换行
+        return output[:-1] if emptied else output
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+
+# ---- 超大文本的流式转换：按安全的行边界逐段读取、转换并写出，内存占用与文本大小无关 ----
+
+# 流式转换每次读取与转换的字符数
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def convert_stream(pipeline, source, write, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    从文本流 source 逐段读取并转换，结果依次交给 write，拼接后与 pipeline(source.read()) 完全一致。
+    切分规则与 convert_parallel 相同；某段末尾留有未闭合的权重语法时与后面的段合并后再转换，
+    合并时等到累计长度翻倍才重试，因此只有这种情况下内存占用才会随文本增长。
+    Args:
+        pipeline (TagPipeline): get_pipeline 返回的流水线
+        source: 文本流（如 open(path, encoding='utf-8', newline='')），按 read(size) 读取
+        write (callable): 接收每段转换结果的函数
+        chunk_size (int): 每段的目标长度
+    """
+    options, threshold = pipeline.options, pipeline.compress_blank_threshold
+    buffer = ''
+    # 尚未写出的待合并原文，以及上次尝试转换时它的长度
+    carry, retry_at = '', 0
+    first = True
+    # 最后一段的行全部被删除时要去掉此前结果末尾的换行，因此总是留着已有结果的最后一个字符不写
+    held = ''
+    eof = False
+    while not eof:
+        block = source.read(chunk_size)
+        eof = not block
+        buffer += block
+        if eof:
+            pieces, buffer = [buffer], ''
+        else:
+            # 最后一段之后的内容还没读到，无法判断能否在其后切开，留到下一轮
+            pieces = split_safe_chunks(buffer, chunk_size, options, threshold)
+            buffer = pieces.pop()
+        for i, piece in enumerate(pieces):
+            last = eof and i == len(pieces) - 1
+            carry += piece
+            if not last and len(carry) < retry_at:
+                continue
+            result, unclosed, emptied = pipeline.convert_chunk(carry, first, last)
+            if unclosed and not last:
+                retry_at = len(carry) * 2
+                continue
+            first = False
+            carry, retry_at = '', 0
+            if last and emptied:
+                held = ''
+            if result:
+                write(held + result[:-1])
+                held = result[-1]
+    if held:
+        write(held)
+
+
+# ---- bytes 引擎：未启用中文相关选项（options[0..2]）时直接处理 UTF-8 字节，省去解码/编码 ----
+
+# str.strip() 会去掉的 ASCII 空白字符（比 bytes.strip() 多出 \x1c-\x1f）
+_ASCII_WHITESPACE = b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f'
+_bytes_patterns = None
+_bytes_patterns_lock = threading.Lock()
+
+
+def _utf8_alternation(chars):
+    """
+    把一组字符编译为匹配其 UTF-8 编码的 bytes 正则片段。
+    编码按字节前缀组织成前缀树，并在最前面用首字节集合做一次快速预判，
+    非候选字节只需一次字符集检查即可失败。
+    """
+    trie = {}
+    for char in chars:
+        node = trie
+        for byte in char.encode('utf-8'):
+            node = node.setdefault(byte, {})
+    def byte_class(values):
+        return b'[' + b''.join(b'\\x%02x' % v for v in sorted(values)) + b']'
+    def emit(node):
+        leaves = [b for b, child in node.items() if not child]
+        parts = [byte_class(leaves)] if leaves else []
+        for byte, child in sorted(node.items()):
+            if child:
+                parts.append(b'\\x%02x' % byte + emit(child))
+        return parts[0] if len(parts) == 1 else b'(?:' + b'|'.join(parts) + b')'
+    return b'(?:(?=' + byte_class(trie) + b')' + emit(trie) + b')'
+
+
+def _get_bytes_patterns():
+    """
+    构建与 str 版正则语义一致的 bytes 正则（首次使用 bytes 引擎时构建一次）。
+    \d、\s、中文逗号与 artist 的忽略大小写匹配在 str 模式下涉及非 ASCII 字符，这里按 UTF-8 编码展开。
+    展开后的正则较慢，因此每类还准备一个纯 ASCII 版本，输入中没有对应的非 ASCII 字符时使用。
+    """
+    global _bytes_patterns
+    if _bytes_patterns is not None:
+        return _bytes_patterns
+    # 构建较慢（约需扫描全部码位），多个线程同时首次使用时只构建一次
+    with _bytes_patterns_lock:
+        if _bytes_patterns is not None:
+            return _bytes_patterns
+        # 按 64K 个码位一段查找：一次拼出全部码位要先建上百万个单字符 str，瞬时占用约 100MB
+        unicode_digits, unicode_spaces = [], []
+        for start in range(0x80, 0x110000, 0x10000):
+            chars = ''.join(map(chr, range(start, min(start + 0x10000, 0x110000))))
+            unicode_digits += re.findall(r'\d', chars)
+            unicode_spaces += re.findall(r'\s', chars)
+        # re.I 下 i 还能匹配 İ/ı，s 还能匹配 ſ
+        artist = rb'[aA][rR][tT](?:[iI]|\xc4[\xb0\xb1])(?:[sS]|\xc5\xbf)[tT]'
+        variants = {
+            'ascii': (rb'[0-9]', rb'[\t-\r\x1c- ]', rb',', rb'[^,]'),
+            'unicode': (
+                rb'(?:[0-9]|' + _utf8_alternation(unicode_digits) + rb')',
+                rb'(?:[\t-\r\x1c- ]|' + _utf8_alternation(unicode_spaces) + rb')',
+                rb'(?:,|\xef\xbc\x8c)',
+                # 按完整的 UTF-8 字符匹配，保证匹配不会从多字节字符（如中文逗号）的中间开始
+                rb'(?:[^,\x80-\xff]|(?!\xef\xbc\x8c)[\xc0-\xff][\x80-\xbf]*)',
+            ),
+        }
+        patterns = {
+            # 探测用的正则写成纯字面量的分支，搜索时可以按首字节快速跳过
+            'has_unicode_digit': re.compile(b'|'.join(re.escape(c.encode('utf-8')) for c in unicode_digits)),
+            'has_unicode_space': re.compile(b'|'.join(re.escape(c.encode('utf-8')) for c in unicode_spaces)),
+            'has_cn_comma': re.compile(rb'\xef\xbc\x8c'),
+            'multi_comma': re.compile(rb',{2,}'),
+            'edge_comma': re.compile(rb'^,|,$'),
+            'bracket_weight': re.compile(rb'([{\[]+)(.*?)([}\]]+)', re.DOTALL),
+            'trim_weight': re.compile(rb'\(([^:()]+):([0-9]+\.[0-9]+)\)'),
+        }
+        for name, (digit, space, comma, not_comma) in variants.items():
+            patterns[name] = {
+                'space': space,
+                'artist_mid': re.compile(b'(' + comma + b')' + not_comma + b'*' + artist + not_comma + b'*(' + comma + b')'),
+                'artist_tail': re.compile(b'(^|' + comma + b')' + not_comma + b'*' + artist + not_comma + b'*$', re.M),
+                'artist_head': re.compile(not_comma + b'*' + artist + not_comma + b'*(' + comma + b')'),
+                'float_weight': re.compile(b'(' + digit + b'+\\.' + digit + b'+)::(.*?)::', re.DOTALL),
+                'sd_weight': re.compile(rb'\(([^:]+):((?:' + digit + rb'|\.)+)\)'),
+                'weight_value': re.compile(b'(:)(' + digit + b'+\\.?' + digit + b'*)'),
+            }
+        # 全部构建完成后才赋值，锁外的读取不会看到构建了一半的字典
+        _bytes_patterns = patterns
+    return _bytes_patterns
+
+
+def _to_bytes(data):
+    return data if isinstance(data, bytes) else bytes(data)
+
+
+def _strip_bytes(data):
+    """与 str.strip() 等价的 bytes 去空白，非 ASCII 内容按 UTF-8 解码后处理"""
+    if data.isascii():
+        return data.strip(_ASCII_WHITESPACE)
+    return data.decode('utf-8', 'surrogateescape').strip().encode('utf-8', 'surrogateescape')
+
+
+class BytesTagPipeline(TagPipeline):
+    """
+    直接在 UTF-8 字节上运行的流水线，输出与 TagPipeline 编码后的结果一致。
+    输入可以是 bytes、bytearray、memoryview 或 mmap，返回 bytes。
+    """
+    def __reduce__(self):
+        return (get_bytes_pipeline, (self.mode, self.options, self.precise_mode, self.short_line_threshold,
+                                     self.cnline_blank_count, self.compress_blank_threshold, self.weight_limit,
+                                     self.weight_model, self.tag_dedup, self.tag_order, self.tag_vocab))
+
+    def __init__(self, *args, **kwargs):
+        self._patterns = _get_bytes_patterns()
+        super().__init__(*args, **kwargs)
+        if any(self.options[:3]):
+            raise ValueError('启用中文相关选项时不能使用 bytes 引擎')
+        if self.options[4] and self.compress_blank_threshold < 1:
+            raise ValueError('压缩空行阈值小于 1 时不能使用 bytes 引擎')
+        self._compress = {}
+        if self.options[4]:
+            repeat = b'{' + str(self.compress_blank_threshold).encode() + b',}'
+            for name in ('ascii', 'unicode'):
+                space = self._patterns[name]['space']
+                self._compress[name] = re.compile(b'(?:\\n' + space + b'*)' + repeat)
+
+    def _build_filters(self):
+        options = self.options
+        filters = []
         if options[3]:
-            def remove_artist_tag(match):
-                return ','
-            text = re.sub(r'([,，])[^,，]*artist[^,，]*([,，])', remove_artist_tag, text, flags=re.I)
-            text = re.sub(r'(^|[,，])[^,，]*artist[^,，]*$', '', text, flags=re.I|re.M)
-            text = re.sub(r'[^,，]*artist[^,，]*([,，])', r'\1', text, flags=re.I)
-            text = re.sub(r',{2,}', ',', text)
-            text = re.sub(r'^,|,$', '', text)
+            filters.append(self._remove_artist)
         if options[4]:
-            threshold = compress_blank_threshold
-            text = re.sub(r'(\n\s*){' + str(threshold) + ',}', '\n', text)
+            filters.append(lambda text, pats: pats['compress'].sub(b'\n', text))
         if options[5]:
-            text = text.replace('\\', '')
+            filters.append(lambda text, pats: _to_bytes(text).replace(b'\\', b''))
         if options[7]:
-            text = re.sub(r'_', ' ', text)
+            filters.append(lambda text, pats: _to_bytes(text).replace(b'_', b' '))
         if len(options) > 8 and options[8]:
-            text = filter_lines(text)
+            filters.append(lambda text, pats: self._filter_lines(text))
+        return filters
+
+    def _select_patterns(self, data):
+        """按输入中是否出现相关非 ASCII 字符，为每类正则选用 ASCII 版或完整版"""
+        patterns = self._patterns
+        def pick(probe):
+            return patterns['unicode' if patterns[probe].search(data) else 'ascii']
+        digit_set = pick('has_unicode_digit')
+        selected = {name: digit_set[name] for name in ('float_weight', 'sd_weight', 'weight_value')}
+        if self.options[3]:
+            comma_set = pick('has_cn_comma')
+            selected.update({name: comma_set[name] for name in ('artist_mid', 'artist_tail', 'artist_head')})
+        if self.options[4]:
+            selected['compress'] = self._compress['unicode' if patterns['has_unicode_space'].search(data) else 'ascii']
+        return selected
+
+    def __call__(self, data):
+        """对字节数据执行完整的处理流程，返回处理后的 bytes"""
+        if METRICS.enabled:
+            return self._call_with_metrics(data)
+        pats = self._select_patterns(data)
+        return self._postprocess(self._convert(self._preprocess(data, pats), pats), pats)
+
+    def _call_with_metrics(self, data):
+        METRICS.inc('tagc_conversions', 1, _LABELS_BYTES)
+        with METRICS.timer('preprocess'):
+            pats = self._select_patterns(data)
+            text = self._preprocess(data, pats)
+        with METRICS.timer('convert'):
+            result = self._convert(text, pats)
+        with METRICS.timer('postprocess'):
+            return self._postprocess(result, pats)
+
+    def _preprocess(self, text, pats):
+        for apply_filter in self._filters:
+            text = apply_filter(text, pats)
         return text
 
-    def filter_lines(content):
-        lines = content.split('\n')
+    def _postprocess(self, result, pats):
+        if len(self.options) > 9 and self.options[9]:
+            result = pats['weight_value'].sub(self._limit_weight, result)
+        if not self.precise_mode:
+            result = self._patterns['trim_weight'].sub(_trim_weight_zero_bytes, result)
+        return result
+
+    def _remove_artist(self, text, pats):
+        text = pats['artist_mid'].sub(b',', text)
+        text = pats['artist_tail'].sub(b'', text)
+        text = pats['artist_head'].sub(rb'\1', text)
+        text = self._patterns['multi_comma'].sub(b',', text)
+        return self._patterns['edge_comma'].sub(b'', text)
+
+    def _filter_lines(self, content):
+        threshold = self.short_line_threshold
         filtered_lines = []
-        for line in lines:
-            line_stripped = line.strip()
-            if not line_stripped:
-                filtered_lines.append(line)
-                continue
-            has_chinese = any('\u4e00' <= char <= '\u9fff' for char in line_stripped)
-            if has_chinese or len(line_stripped) >= short_line_threshold:
-                if 'year' in line_stripped.lower():
-                    filtered_lines.append(line[line.lower().find('year'):])
-                else:
-                    filtered_lines.append(line)
-        return '\n'.join(filtered_lines)
-
-    def convert_nai_to_sd(text):
+        for line in _to_bytes(content).split(b'\n'):
+            if line.isascii():
+                line_stripped = line.strip(_ASCII_WHITESPACE)
+                if line_stripped and len(line_stripped) < threshold:
+                    continue
+                year_index = line.lower().find(b'year') if line_stripped else -1
+                filtered_lines.append(line[year_index:] if year_index >= 0 else line)
+            else:
+                # 非 ASCII 行需要按字符计算长度、判断中文，退回 str 逻辑
+                line = _filter_line(line.decode('utf-8', 'surrogateescape'), threshold)
+                if line is not None:
+                    filtered_lines.append(line.encode('utf-8', 'surrogateescape'))
+        return b'\n'.join(filtered_lines)
+
+    def _format_weighted(self, content, weight):
+        weight_text = format(weight, self._weight_spec).encode()
+        if self.options[6]:
+            tags = [_strip_bytes(tag) for tag in content.split(b',')]
+            return b','.join([b'(' + tag + b':' + weight_text + b')' for tag in tags if tag])
+        return b'(' + _strip_bytes(content) + b':' + weight_text + b')'
+
+    def _convert_nai_to_sd(self, text, pats):
         def replace_float_weight(match):
-            weight = float(match.group(1))
-            content = match.group(2)
-            if options[6]:
-                tags = [tag.strip() for tag in content.split(',') if tag.strip()]
-                return ','.join([f'({tag}:{weight:.{3 if precise_mode else 1}f})' for tag in tags])
-            return f'({content.strip()}:{weight:.{3 if precise_mode else 1}f})'
+            return self._format_weighted(match.group(2), float(match.group(1).decode('utf-8')))
         def replace_bracket_weight(match):
             left_brackets = match.group(1)
-            right_brackets = match.group(3)
-            content = match.group(2)
-            count = max(len(left_brackets), len(right_brackets))
-            weight = math.pow(1.1 if left_brackets[0] == '{' else 0.9, count)
-            weight = round(weight, 3 if precise_mode else 1)
-            if options[6]:
-                tags = [tag.strip() for tag in content.split(',') if tag.strip()]
-                return ','.join([f'({tag}:{weight:.{3 if precise_mode else 1}f})' for tag in tags])
-            return f'({content.strip()}:{weight:.{3 if precise_mode else 1}f})'
-        text = re.sub(r'(\d+\.\d+)::(.*?)::', replace_float_weight, text, flags=re.DOTALL)
-        return re.sub(r'([{{\[{]+)(.*?)([}}\]]+)', replace_bracket_weight, text, flags=re.DOTALL)
-
-    def convert_sd_to_nai(text):
+            count = max(len(left_brackets), len(match.group(3)))
+            weight = bracket_weight(left_brackets[0] == 0x7b, count, precise)
+            return self._format_weighted(match.group(2), weight)
+        bracket_weight = self._weights.bracket_weight
+        precise = self.precise_mode
+        text = pats['float_weight'].sub(replace_float_weight, text)
+        return self._patterns['bracket_weight'].sub(replace_bracket_weight, text)
+
+    def _convert_sd_to_nai(self, text, pats):
         def replace_sd(match):
             content, weight = match.groups()
-            weight = float(weight)
-            if weight >= 1:
-                count = math.ceil((weight - 1) / 0.1)
-                return '{' * count + content + '}' * count
+            is_up, count = brackets_for(float(weight.decode('utf-8')))
+            if is_up:
+                return b'{' * count + content + b'}' * count
             else:
-                count = math.ceil((1 - weight) / 0.1)
-                return '[' * count + content + ']' * count
-        return re.sub(r'\(([^:]+):([\d.]+)\)', replace_sd, text)
-
-    # 主处理流程
-    text = apply_optional_filters(input_text)
-    if mode == 0:
-        result = convert_nai_to_sd(text)
-    else:
-        result = convert_sd_to_nai(text)
-    if len(options) > 9 and options[9]:
-        pattern = r'(:)(\d+\.?\d*)'
-        limit = weight_limit
-        def replace_weight(match):
-            colon = match.group(1)
-            weight = float(match.group(2))
-            if weight > limit:
-                return f"{colon}{limit:.2f}"
+                return b'[' * count + content + b']' * count
+        brackets_for = self._weights.brackets_for
+        return pats['sd_weight'].sub(replace_sd, text)
+
+    def _limit_weight(self, match):
+        weight_text = match.group(2).decode('utf-8')
+        weight = float(weight_text)
+        limit = self.weight_limit
+        if weight > limit:
+            return f":{limit:.2f}".encode()
+        else:
+            return f":{weight:.2f}".encode() if '.' in weight_text else match.group(0)
+
+
+@lru_cache(maxsize=4096)
+def _trimmed_weight_bytes(weight):
+    return str(float(weight)).rstrip('0').rstrip('.').encode()
+
+
+def _trim_weight_zero_bytes(m):
+    tag, weight = m.groups()
+    return b'(' + tag + b':' + _trimmed_weight_bytes(weight) + b')'
+
+
+def bytes_engine_supported(options):
+    """未启用中文相关选项（options[0..2]）时可使用 bytes 引擎"""
+    return not any(options[:3])
+
+
+@lru_cache(maxsize=64)
+def _compile_bytes_pipeline(mode, options, precise_mode, short_line_threshold, cnline_blank_count, compress_blank_threshold, weight_limit, weight_model, tag_dedup, tag_order, tag_vocab):
+    return BytesTagPipeline(mode, options, precise_mode, short_line_threshold, cnline_blank_count, compress_blank_threshold, weight_limit, weight_model, tag_dedup, tag_order, tag_vocab)
+
+
+def get_bytes_pipeline(mode, options, precise_mode=False, short_line_threshold=20, cnline_blank_count=3, compress_blank_threshold=4, weight_limit=1.6, weight_model=DEFAULT_WEIGHT_MODEL, tag_dedup='', tag_order='', tag_vocab=''):
+    """
+    获取与参数对应的 bytes 流水线；选项组合需要 Unicode 语义时返回 None。
+    Returns:
+        BytesTagPipeline | None
+    """
+    options = tuple(bool(o) for o in options)
+    # 重复标签合并与排序只在 str 流水线中实现
+    if not bytes_engine_supported(options) or tag_dedup or tag_order:
+        return None
+    # 阈值小于 1 时 str 流水线走单独的正则过滤器（见 TagPipeline._build_filters），bytes 引擎不复刻该特例
+    if options[4] and compress_blank_threshold < 1:
+        return None
+    return _compile_bytes_pipeline(mode, options, bool(precise_mode), short_line_threshold, cnline_blank_count, compress_blank_threshold, weight_limit, weight_model, tag_dedup, tag_order, tag_vocab)
+
+
+def process_tags_bytes(data, mode, options, precise_mode=False, short_line_threshold=20, cnline_blank_count=3, compress_blank_threshold=4, weight_limit=1.6, weight_model=DEFAULT_WEIGHT_MODEL, tag_dedup='', tag_order='', tag_vocab=''):
+    """
+    处理 UTF-8 字节数据（bytes/bytearray/memoryview/mmap），返回 bytes。
+    选项允许时自动使用 bytes 引擎，否则解码后走 str 流水线再编码。
+    """
+    pipeline = get_bytes_pipeline(mode, options, precise_mode, short_line_threshold, cnline_blank_count, compress_blank_threshold, weight_limit, weight_model, tag_dedup, tag_order, tag_vocab)
+    if pipeline is not None:
+        return pipeline(data)
+    text = str(data, 'utf-8') if not isinstance(data, str) else data
+    return process_tags(text, mode, options, precise_mode, short_line_threshold, cnline_blank_count, compress_blank_threshold, weight_limit, weight_model, tag_dedup, tag_order, tag_vocab).encode('utf-8')
+
+
+def normalize_options(options):
+    """
+    将多种形式的预处理选项统一为与 OPTION_NAMES 等长的布尔元组。
+    Args:
+        options: 布尔列表、{名称: 布尔} 字典、逗号分隔的名称字符串或 None
+    Returns:
+        tuple: 布尔元组
+    """
+    if options is None:
+        return (False,) * len(OPTION_NAMES)
+    if isinstance(options, str):
+        options = [name.strip() for name in options.split(',') if name.strip()]
+        options = {name: True for name in options}
+    if isinstance(options, dict):
+        unknown = set(options) - set(OPTION_NAMES)
+        if unknown:
+            raise ValueError(f"未知的预处理选项: {', '.join(sorted(unknown))}")
+        return tuple(bool(options.get(name, False)) for name in OPTION_NAMES)
+    values = [bool(o) for o in options]
+    if len(values) > len(OPTION_NAMES):
+        raise ValueError(f"预处理选项最多 {len(OPTION_NAMES)} 项")
+    return tuple(values + [False] * (len(OPTION_NAMES) - len(values)))
+
+
+def _check_param(key, value, default):
+    """按默认值的类型校验请求中的参数：null 视为未指定；bool 不算数值，数值也不会被当作 bool"""
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        if not isinstance(value, bool):
+            raise ValueError(f"{key} 必须为布尔值")
+    elif isinstance(default, (int, float)):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"{key} 必须为数值")
+        if isinstance(default, int) and not float(value).is_integer():
+            raise ValueError(f"{key} 必须为整数")
+        return type(default)(value)
+    elif not isinstance(value, str):
+        raise ValueError(f"{key} 必须为字符串")
+    return value
+
+
+def parse_params(payload):
+    """
+    从请求字典中解析转换参数（服务/守护进程模式共用）。
+    Args:
+        payload (dict): 包含 mode、options 及 PARAM_DEFAULTS 中各参数的字典
+    Returns:
+        dict: 可直接传给 get_pipeline 的关键字参数
+    """
+    mode = payload.get('mode')
+    if mode is None:
+        mode = 0
+    if isinstance(mode, bool) or mode not in (0, 1):
+        raise ValueError("mode 只能为 0(NAI→SD) 或 1(SD→NAI)")
+    params = {'mode': mode, 'options': normalize_options(payload.get('options'))}
+    for key, default in PARAM_DEFAULTS.items():
+        params[key] = _check_param(key, payload.get(key), default)
+    get_weight_model(params['weight_model'])
+    if params['tag_dedup'] and params['tag_dedup'] not in TAG_DEDUP_POLICIES:
+        raise ValueError(f"tag_dedup 只能为 {'/'.join(TAG_DEDUP_POLICIES)}")
+    if params['tag_order'] and params['tag_order'] not in TAG_ORDERS:
+        raise ValueError(f"tag_order 只能为 {'/'.join(TAG_ORDERS)}")
+    if params['tag_order'] == 'vocab' and not params['tag_vocab']:
+        raise ValueError("tag_order 为 vocab 时需要指定 tag_vocab")
+    return params
+
+
+
+def _run_in_worker(params, text):
+    """执行器任务：在线程/子进程内用缓存的流水线转换文本"""
+    return get_pipeline(**params)(text)
+
+
+class AsyncTagConverter:
+    """
+    asyncio 异步转换器，把耗 CPU 的转换放到线程池或进程池执行，避免阻塞事件循环。
+    同时执行的任务数受 max_pending 限制，超出时 await 等待（背压）；
+    取消调用方的任务会一并取消尚未开始执行的转换。
+    Args:
+        executor (str): 'process' 使用进程池，'thread' 使用线程池，'auto'（默认）在无 GIL 时使用线程池，否则使用进程池
+        max_workers (int): 池大小，默认为CPU核数
+        max_pending (int): 最多同时提交的任务数，默认为池大小的两倍
+        inline_limit (int): 小于该长度的文本直接在事件循环内转换
+    """
+    def __init__(self, executor='auto', max_workers=None, max_pending=None, inline_limit=2048):
+        self.executor_kind = resolve_backend(executor)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 2
+        self.inline_limit = inline_limit
+        self._executor = None
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = make_executor(self.max_workers, self.executor_kind)
+        return self._executor
+
+    def _get_semaphore(self, loop):
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_pending)
+        return semaphore
+
+    async def convert(self, input_text, mode, options, precise_mode=False, short_line_threshold=20, cnline_blank_count=3, compress_blank_threshold=4, weight_limit=1.6, weight_model=DEFAULT_WEIGHT_MODEL, tag_dedup='', tag_order='', tag_vocab=''):
+        """异步版 process_tags，参数与返回值相同"""
+        params = {
+            'mode': mode,
+            'options': tuple(bool(o) for o in options),
+            'precise_mode': precise_mode,
+            'short_line_threshold': short_line_threshold,
+            'cnline_blank_count': cnline_blank_count,
+            'compress_blank_threshold': compress_blank_threshold,
+            'weight_limit': weight_limit,
+            'weight_model': weight_model,
+            'tag_dedup': tag_dedup,
+            'tag_order': tag_order,
+            'tag_vocab': tag_vocab,
+        }
+        if len(input_text) <= self.inline_limit:
+            return get_pipeline(**params)(input_text)
+        loop = asyncio.get_running_loop()
+        async with self._get_semaphore(loop):
+            return await loop.run_in_executor(self._get_executor(), _run_in_worker, params, input_text)
+
+    async def convert_batch(self, texts, mode, options, **kwargs):
+        """
+        异步批量转换，按输入顺序逐个产出结果。
+        texts 可以是普通可迭代对象或异步可迭代对象；只有在途任务少于 max_pending 时
+        才会读取下一条输入，因此上游生产者会被自然限速。
+        """
+        pending = collections.deque()
+        try:
+            if hasattr(texts, '__aiter__'):
+                async for text in texts:
+                    pending.append(asyncio.ensure_future(self.convert(text, mode, options, **kwargs)))
+                    if len(pending) >= self.max_pending:
+                        yield await pending.popleft()
             else:
-                return f"{colon}{weight:.2f}" if '.' in match.group(2) else match.group(0)
-        result = re.sub(pattern, replace_weight, result)
-    # 权重自动规整，仅在精确权重转换关闭时启用
-    if not precise_mode:
-        def trim_weight_zero(m):
-            tag = m.group(1)
-            weight = m.group(2)
-            weight_str = str(float(weight)).rstrip('0').rstrip('.') if '.' in weight else weight
-            return f'({tag}:{weight_str})'
-        result = re.sub(r'\(([^:()]+):([0-9]+\.[0-9]+)\)', trim_weight_zero, result)
-    return result
+                for text in texts:
+                    pending.append(asyncio.ensure_future(self.convert(text, mode, options, **kwargs)))
+                    if len(pending) >= self.max_pending:
+                        yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def close(self):
+        """关闭内部线程池/进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+_default_async_converter = None
+
+
+def _get_default_async_converter():
+    global _default_async_converter
+    if _default_async_converter is None:
+        _default_async_converter = AsyncTagConverter()
+    return _default_async_converter
+
+
+async def aprocess_tags(input_text, mode, options, precise_mode=False, short_line_threshold=20, cnline_blank_count=3, compress_blank_threshold=4, weight_limit=1.6, weight_model=DEFAULT_WEIGHT_MODEL, tag_dedup='', tag_order='', tag_vocab=''):
+    """
+    process_tags 的异步版本，使用默认的转换器（进程池，无 GIL 时为线程池）。
+    需要自定义池类型或并发上限时请直接创建 AsyncTagConverter。
+    """
+    converter = _get_default_async_converter()
+    return await converter.convert(input_text, mode, options, precise_mode, short_line_threshold, cnline_blank_count, compress_blank_threshold, weight_limit, weight_model, tag_dedup, tag_order, tag_vocab)
+
+
+async def aprocess_batch(texts, mode, options, **kwargs):
+    """异步批量转换的便捷入口，按输入顺序产出结果，参数同 AsyncTagConverter.convert_batch"""
+    async for result in _get_default_async_converter().convert_batch(texts, mode, options, **kwargs):
+        yield result
+
+
+def add_pipeline_arguments(parser):
+    """为命令行解析器添加转换参数（批量/监视等命令行入口共用）"""
+    parser.add_argument('--mode', choices=['nai2sd', 'sd2nai'], default='nai2sd', help='转换方向')
+    parser.add_argument('--options', default='', help='启用的预处理选项，逗号分隔：' + ','.join(OPTION_NAMES))
+    parser.add_argument('--precise', action='store_true', help='精确权重转换')
+    parser.add_argument('--short-line-threshold', type=int, default=PARAM_DEFAULTS['short_line_threshold'], help='短行阈值')
+    parser.add_argument('--cnline-blank-count', type=int, default=PARAM_DEFAULTS['cnline_blank_count'], help='中文行替换空行数')
+    parser.add_argument('--compress-blank-threshold', type=int, default=PARAM_DEFAULTS['compress_blank_threshold'], help='压缩空行阈值')
+    parser.add_argument('--weight-limit', type=float, default=PARAM_DEFAULTS['weight_limit'], help='权重上限')
+    parser.add_argument('--weight-model', choices=list(WEIGHT_MODELS), default=PARAM_DEFAULTS['weight_model'], help='括号权重模型')
+    parser.add_argument('--tag-dedup', choices=TAG_DEDUP_POLICIES, default=None,
+                        help='合并同一行内的重复标签（忽略大小写与下划线）：max 取最大权重，first 取首次出现的权重，sum 权重相乘')
+    parser.add_argument('--tag-order', choices=TAG_ORDERS, default=None, help='标签排序：weight 按权重从高到低，vocab 按 --tag-vocab 词表顺序')
+    parser.add_argument('--tag-vocab', default=None, help='标签词表文件（每行一个标签，或标签 CSV），--tag-order vocab 时使用')
+
+
+def params_from_args(args):
+    """把 add_pipeline_arguments 解析出的命令行参数转换为 get_pipeline 关键字参数"""
+    return {
+        'mode': 0 if args.mode == 'nai2sd' else 1,
+        'options': normalize_options(args.options),
+        'precise_mode': args.precise,
+        'short_line_threshold': args.short_line_threshold,
+        'cnline_blank_count': args.cnline_blank_count,
+        'compress_blank_threshold': args.compress_blank_threshold,
+        'weight_limit': args.weight_limit,
+        'weight_model': args.weight_model,
+        'tag_dedup': args.tag_dedup or '',
+        'tag_order': args.tag_order or '',
+        'tag_vocab': args.tag_vocab or '',
+    }
+
+
+def add_executor_arguments(parser):
+    """为命令行解析器添加执行器参数（批量/服务等并行入口共用）"""
+    parser.add_argument('--executor', choices=EXECUTOR_BACKENDS, default='auto',
+                        help='并行方式：process 为进程池，thread 为线程池（适合无 GIL 的自由线程构建），auto 按是否启用 GIL 自动选择')
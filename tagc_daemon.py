@@ -0,0 +1,271 @@
+# Unix 域套接字守护进程与轻量客户端。
+# 守护进程常驻并保持流水线预编译，客户端只负责收发数据，
+# 避免每次转换都重新启动解释器、导入并构建处理流程。
+#
+# 协议：每帧为 4 字节大端长度 + UTF-8 编码的 JSON。
+# 请求 {"text": "...", "mode": 0, "options": "cn_comma,..." 或列表/字典, ...}
+# 响应 {"result": "..."} 或 {"error": "..."}
+# 请求 {"metrics": true} 返回 OpenMetrics 文本格式的运行指标（守护进程以 --metrics-file 启动时可用）
+#
+# 文本协议（连接的首字节为 "{" 时启用，供 socat/nc 等不启动解释器的客户端使用，见 tagc_client.sh）：
+# 每行一个 JSON 请求，响应也是一行 JSON；若首行 JSON 不含 text，则首行之后直到客户端关闭写端的全部字节都作为原文，
+# 响应为状态行 "ok" 或 "error 信息"，随后是原样的转换结果，然后关闭连接。
+# 帧协议的长度不超过 MAX_FRAME_SIZE，首字节不可能是 "{"，两种协议不会混淆。
+import json
+import os
+import shutil
+import socket
+import struct
+import sys
+
+_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+
+
+def default_socket_path():
+    """默认套接字路径：优先 TAGC_SOCKET 环境变量，其次用户运行时目录"""
+    path = os.environ.get('TAGC_SOCKET')
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'tagc.sock')
+    return f'/tmp/tagc-{os.getuid()}.sock'
+
+
+def _recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        part = sock.recv(size - len(buf))
+        if not part:
+            return None
+        buf += part
+    return bytes(buf)
+
+
+def recv_frame(sock):
+    """读取一帧并解析为对象，对端关闭连接时返回 None"""
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+    length = _HEADER.unpack(header)[0]
+    if length > MAX_FRAME_SIZE:
+        raise ValueError('帧长度超出上限')
+    body = _recv_exact(sock, length)
+    if body is None:
+        return None
+    return json.loads(body)
+
+
+def send_frame(sock, obj):
+    """把对象编码为一帧发送（头部与数据合并为一次写入）"""
+    body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(body)) + body)
+
+
+def _json_line(obj):
+    # json.dumps 会转义字符串中的换行，编码结果恰好占一行
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def serve(socket_path=None, metrics_file=None):
+    """
+    启动守护进程并阻塞运行，每个连接一个线程，连接上可连续发送多个请求。
+    指定 metrics_file 时记录运行指标并定期写出到该文件。
+    """
+    import socketserver
+    from tagc_core import get_pipeline, parse_params
+    from tagc_metrics import METRICS, MetricsFileWriter, labels, record_error, record_io
+    queue_labels = labels(queue='daemon')
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            first = self.request.recv(1, socket.MSG_PEEK)
+            if first == b'{':
+                self.handle_lines()
+            elif first:
+                self.handle_frames()
+
+        def handle_frames(self):
+            while True:
+                try:
+                    payload = recv_frame(self.request)
+                except (ValueError, OSError) as e:
+                    send_frame(self.request, {'error': f'请求解析失败: {e}'})
+                    return
+                if payload is None:
+                    return
+                send_frame(self.request, self.respond(payload))
+
+        def handle_lines(self):
+            reader = self.request.makefile('rb')
+            while True:
+                line = reader.readline(MAX_FRAME_SIZE + 1)
+                if not line:
+                    return
+                if not line.strip():
+                    continue
+                try:
+                    if len(line) > MAX_FRAME_SIZE:
+                        raise ValueError('请求行长度超出上限')
+                    payload = json.loads(line)
+                except ValueError as e:
+                    self.request.sendall(_json_line({'error': f'请求解析失败: {e}'}))
+                    return
+                if isinstance(payload, dict) and 'text' not in payload and not payload.get('metrics'):
+                    self.convert_raw(payload, reader)
+                    return
+                self.request.sendall(_json_line(self.respond(payload)))
+
+        def convert_raw(self, params, reader):
+            try:
+                params['text'] = reader.read().decode('utf-8')
+            except UnicodeDecodeError as e:
+                response = {'error': f'请求解析失败: {e}'}
+            else:
+                response = self.convert(params)
+            if 'error' in response:
+                # 状态行只占一行，信息中的换行替换为空格
+                self.request.sendall(f"error {' '.join(response['error'].split())}\n".encode('utf-8'))
+            else:
+                self.request.sendall(b'ok\n' + response['result'].encode('utf-8'))
+
+        def respond(self, payload):
+            if isinstance(payload, dict) and payload.get('metrics'):
+                return {'result': METRICS.render()} if METRICS.enabled else {'error': '守护进程未启用运行指标'}
+            return self.convert(payload)
+
+        def convert(self, payload):
+            if METRICS.enabled:
+                METRICS.inc('tagc_queue_depth', 1, queue_labels)
+            try:
+                with METRICS.timer('request'):
+                    if not isinstance(payload, dict) or not isinstance(payload.get('text'), str):
+                        raise ValueError('请求必须为包含 text 字符串的JSON对象')
+                    result = get_pipeline(**parse_params(payload))(payload['text'])
+                    if METRICS.enabled:
+                        record_io(len(payload['text'].encode('utf-8')), len(result.encode('utf-8')))
+                    return {'result': result}
+            except Exception as e:
+                record_error(e)
+                return {'error': f'处理错误: {e}'}
+            finally:
+                if METRICS.enabled:
+                    METRICS.inc('tagc_queue_depth', -1, queue_labels)
+
+    class Server(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+    socket_path = socket_path or default_socket_path()
+    if os.path.exists(socket_path):
+        # 清理上次异常退出遗留的套接字文件；若仍有守护进程在监听则拒绝启动
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            os.unlink(socket_path)
+        else:
+            probe.close()
+            raise RuntimeError(f'守护进程已在运行: {socket_path}')
+    server = Server(socket_path, Handler)
+    os.chmod(socket_path, 0o600)
+    metrics_writer = MetricsFileWriter(metrics_file).start() if metrics_file else None
+    print(f'Tag转换守护进程已启动: {socket_path}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+        if metrics_writer is not None:
+            metrics_writer.stop()
+
+
+class DaemonClient:
+    """
+    守护进程客户端，一个实例复用同一连接。
+    Args:
+        socket_path (str): 套接字路径，默认见 default_socket_path
+    """
+    def __init__(self, socket_path=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path or default_socket_path())
+
+    def convert(self, text, **params):
+        """发送文本和转换参数，返回转换结果；守护进程报错时抛出 RuntimeError"""
+        send_frame(self.sock, dict(params, text=text))
+        response = recv_frame(self.sock)
+        if response is None:
+            raise RuntimeError('守护进程意外断开连接')
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+    def metrics(self):
+        """返回守护进程 OpenMetrics 文本格式的运行指标"""
+        send_frame(self.sock, {'metrics': True})
+        response = recv_frame(self.sock)
+        if response is None:
+            raise RuntimeError('守护进程意外断开连接')
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    import argparse
+    from tagc_core import add_pipeline_arguments, params_from_args
+    parser = argparse.ArgumentParser(description='Tag转换器守护进程/客户端。不带 --serve 时作为客户端，转换文件或标准输入')
+    parser.add_argument('files', nargs='*', help='要转换的文件，省略时读取标准输入')
+    parser.add_argument('--serve', action='store_true', help='启动守护进程')
+    parser.add_argument('--socket', default=None, help='套接字路径')
+    parser.add_argument('--in-place', action='store_true', help='直接写回原文件而不是输出到标准输出')
+    parser.add_argument('--metrics-file', default=None, help='守护进程记录运行指标并定期以 OpenMetrics 文本格式写出到该文件')
+    parser.add_argument('--metrics', action='store_true', help='输出守护进程的运行指标')
+    add_pipeline_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.serve:
+        serve(args.socket, args.metrics_file and os.path.abspath(args.metrics_file))
+        return 0
+    params = params_from_args(args)
+    if params['tag_vocab']:
+        # 守护进程的工作目录与客户端不同，词表路径传绝对路径
+        params['tag_vocab'] = os.path.abspath(params['tag_vocab'])
+    try:
+        with DaemonClient(args.socket) as client:
+            if args.metrics:
+                sys.stdout.write(client.metrics())
+                return 0
+            # 按字节读写，保留原文件的换行符
+            if not args.files:
+                sys.stdout.buffer.write(client.convert(sys.stdin.buffer.read().decode('utf-8'), **params).encode('utf-8'))
+            for path in args.files:
+                with open(path, 'rb') as f:
+                    result = client.convert(f.read().decode('utf-8'), **params).encode('utf-8')
+                if args.in_place:
+                    # 先写临时文件再替换，避免中途出错时原文件只写了一半
+                    tmp_path = path + '.tmp'
+                    with open(tmp_path, 'wb') as f:
+                        f.write(result)
+                    shutil.copymode(path, tmp_path)
+                    os.replace(tmp_path, path)
+                else:
+                    sys.stdout.buffer.write(result)
+    except (OSError, RuntimeError, UnicodeDecodeError) as e:
+        print(f'转换失败: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
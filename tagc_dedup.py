@@ -0,0 +1,269 @@
+# 语料级近似重复提示词检测：把转换规整后的提示词视为标签集合（忽略顺序与权重），
+# 计算 MinHash 签名，用 LSH 分桶找出候选对，再按签名估计的 Jaccard 相似度确认，
+# 避免对所有提示词两两比较。安装了 numpy 时签名计算与分桶均为向量化实现。
+import os
+import random
+import sys
+import zlib
+
+from tagc_batch import iter_source_files, read_source
+from tagc_core import add_executor_arguments, add_pipeline_arguments, get_pipeline, make_executor, params_from_args, parse_tags
+from tagc_weights import DEFAULT_WEIGHT_MODEL
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_NUM_PERM = 64
+# 空标签集合的签名值，这类提示词不参与去重
+EMPTY_HASH = 0xFFFFFFFF
+DEFAULT_THRESHOLD = 0.8
+# 候选对还要按签名相似度确认，误报只多花确认时间，漏报则直接漏掉重复项，因此选分段参数时降低误报的权重
+FALSE_POSITIVE_WEIGHT = 0.1
+# 每个执行器任务处理的文件数
+BATCH_SIZE = 1024
+
+
+def tag_set(text, weight_model=DEFAULT_WEIGHT_MODEL):
+    """提示词 → 标签集合（小写、去除权重），用于计算相似度"""
+    return {tag.lower() for tag, weight in parse_tags(text, weight_model)}
+
+
+def optimal_bands(threshold, num_perm, false_positive_weight=FALSE_POSITIVE_WEIGHT):
+    """
+    选择 LSH 的分段数 b 与每段行数 r（b*r <= num_perm），
+    使相似度低于阈值却成为候选（误报）与高于阈值却漏掉（漏报）的加权概率之和最小。
+    """
+    def integrate(f, a, b, steps=200):
+        step = (b - a) / steps
+        return sum(f(a + (i + 0.5) * step) for i in range(steps)) * step
+
+    best, best_error = (1, num_perm), float('inf')
+    for b in range(1, num_perm + 1):
+        for r in range(1, num_perm // b + 1):
+            false_positive = integrate(lambda s: 1 - (1 - s ** r) ** b, 0.0, threshold)
+            false_negative = integrate(lambda s: (1 - s ** r) ** b, threshold, 1.0)
+            error = false_positive_weight * false_positive + false_negative
+            if error < best_error:
+                best, best_error = (b, r), error
+    return best
+
+
+class MinHasher:
+    """
+    MinHash 签名计算：每个标签先哈希为 32 位整数 x，再经 num_perm 个乘移位哈希 ((a*x+b) mod 2^64) >> 32 取最小值。
+    有 numpy 时一批提示词的所有标签分块一起计算，再按提示词分段取最小值。
+    Args:
+        num_perm (int): 签名长度
+        seed (int): 随机哈希的种子，不同进程使用相同种子才能比较签名
+    """
+    # 每次向量化计算的标签数，控制临时数组大小（行数 × num_perm × 8 字节）
+    block_size = 16384
+
+    def __init__(self, num_perm=DEFAULT_NUM_PERM, seed=1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.a = [rng.randrange(1 << 64) | 1 for _ in range(num_perm)]
+        self.b = [rng.randrange(1 << 64) for _ in range(num_perm)]
+        if np is not None:
+            self._a = np.array(self.a, dtype=np.uint64)
+            self._b = np.array(self.b, dtype=np.uint64)
+
+    def signatures(self, tag_sets):
+        """
+        计算一批标签集合的签名。
+        Returns:
+            有 numpy 时为形状 (n, num_perm) 的 uint32 数组，否则为元组列表；空集合的签名全为 EMPTY_HASH
+        """
+        hashed = [[zlib.crc32(tag.encode('utf-8')) for tag in tags] for tags in tag_sets]
+        if np is None:
+            mask = (1 << 64) - 1
+            return [tuple(min(((a * x + b) & mask) >> 32 for x in xs) if xs else EMPTY_HASH
+                          for a, b in zip(self.a, self.b)) for xs in hashed]
+        result = np.full((len(hashed), self.num_perm), EMPTY_HASH, dtype=np.uint32)
+        shift = np.uint64(32)
+        first = 0
+        while first < len(hashed):
+            # 按块取整条提示词，使每块的标签数接近 block_size
+            last, count = first, 0
+            while last < len(hashed) and (count == 0 or count + len(hashed[last]) <= self.block_size):
+                count += len(hashed[last])
+                last += 1
+            sizes = np.array([len(xs) for xs in hashed[first:last]])
+            nonempty = np.flatnonzero(sizes)
+            if len(nonempty):
+                values = np.fromiter((x for xs in hashed[first:last] for x in xs), dtype=np.uint64, count=count)
+                mixed = values[:, None] * self._a
+                mixed += self._b
+                mixed >>= shift
+                starts = np.concatenate(([0], np.cumsum(sizes[nonempty])[:-1]))
+                result[first + nonempty] = np.minimum.reduceat(mixed, starts, axis=0)
+            first = last
+        return result
+
+
+def _find_pairs_numpy(signatures, bands, rows):
+    """每段的行拼成一个 64 位桶键，排序后同键的提示词与该桶的第一个组成候选对"""
+    multipliers = np.array(random.Random(0).sample(range(1, 1 << 62), rows), dtype=np.uint64) | np.uint64(1)
+    pairs = []
+    for band in range(bands):
+        block = signatures[:, band * rows:(band + 1) * rows].astype(np.uint64)
+        keys = (block * multipliers).sum(axis=1)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        is_start = np.ones(len(order), dtype=bool)
+        is_start[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        group_first = order[is_start][np.cumsum(is_start) - 1]
+        members = ~is_start
+        pairs.append(np.stack((group_first[members], order[members]), axis=1))
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = np.unique(np.concatenate(pairs), axis=0)
+    return pairs
+
+
+def _find_pairs_python(signatures, bands, rows):
+    pairs = set()
+    for band in range(bands):
+        buckets = {}
+        for i, signature in enumerate(signatures):
+            first = buckets.setdefault(signature[band * rows:(band + 1) * rows], i)
+            if first != i:
+                pairs.add((first, i))
+    return sorted(pairs)
+
+
+def find_duplicates(signatures, threshold=DEFAULT_THRESHOLD, bands=None, rows=None):
+    """
+    按 LSH 候选对与签名估计的 Jaccard 相似度找出重复项。
+    Args:
+        signatures: MinHasher.signatures 的结果（按提示词顺序拼接）
+        threshold (float): Jaccard 相似度阈值
+        bands, rows (int): LSH 分段参数，省略时按阈值自动选择
+    Returns:
+        list: 与输入等长，重复项为其保留代表（同一簇中最靠前的提示词）的下标，保留项为 -1；
+              以及 {重复项下标: 与代表的估计相似度}（经其他成员间接并入的重复项与代表的相似度可能低于阈值）
+    """
+    n = len(signatures)
+    if n == 0:
+        return [], {}
+    num_perm = len(signatures[0])
+    if bands is None or rows is None:
+        bands, rows = optimal_bands(threshold, num_perm)
+    if np is not None:
+        signatures = np.asarray(signatures, dtype=np.uint32)
+        pairs = _find_pairs_numpy(signatures, bands, rows)
+        # 分块计算候选对的相似度，避免一次生成过大的临时数组
+        similarity = np.concatenate([(signatures[chunk[:, 0]] == signatures[chunk[:, 1]]).mean(axis=1)
+                                     for chunk in np.array_split(pairs, max(1, len(pairs) // 65536))]) if len(pairs) else []
+        nonempty = signatures[:, 0] != EMPTY_HASH
+        verified = [(int(p), int(q), float(s)) for (p, q), s in zip(pairs, similarity) if s >= threshold and nonempty[p]]
+    else:
+        verified = []
+        for p, q in _find_pairs_python(signatures, bands, rows):
+            s = sum(x == y for x, y in zip(signatures[p], signatures[q])) / num_perm
+            if s >= threshold and signatures[p][0] != EMPTY_HASH:
+                verified.append((p, q, s))
+    # 并查集合并候选对，每簇以最小下标为代表
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for p, q, s in verified:
+        rp, rq = find(p), find(q)
+        if rp != rq:
+            parent[max(rp, rq)] = min(rp, rq)
+    dup_of = [-1] * n
+    for i in range(n):
+        root = find(i)
+        if root != i:
+            dup_of[i] = root
+    if np is not None:
+        members = [i for i in range(n) if dup_of[i] >= 0]
+        similarity = (signatures[members] == signatures[[dup_of[i] for i in members]]).mean(axis=1) if members else []
+        scores = {i: float(s) for i, s in zip(members, similarity)}
+    else:
+        scores = {i: sum(x == y for x, y in zip(signatures[i], signatures[rep])) / num_perm
+                  for i, rep in enumerate(dup_of) if rep >= 0}
+    return dup_of, scores
+
+
+def _signature_task(args):
+    paths, params, num_perm, seed = args
+    pipeline = get_pipeline(**params)
+    hasher = MinHasher(num_perm, seed)
+    tag_sets = []
+    errors = []
+    for path in paths:
+        try:
+            tag_sets.append(tag_set(pipeline(read_source(path)), params.get('weight_model', DEFAULT_WEIGHT_MODEL)))
+        except Exception as e:
+            # 读取或转换失败的文件先占位为空集合，由调用方报告并剔除
+            tag_sets.append(set())
+            errors.append([path, f'{type(e).__name__}: {e}'])
+    return hasher.signatures(tag_sets), errors
+
+
+def compute_signatures(paths, params, num_perm=DEFAULT_NUM_PERM, seed=1, workers=None, backend=None, errors=None):
+    """
+    用进程池（无 GIL 时为线程池，见 tagc_core.make_executor）分批转换文件并计算签名，按 paths 顺序返回。
+    读取或转换失败的文件签名为空（全为 EMPTY_HASH）；errors 为列表时记入 [文件, 错误信息]，否则抛出 ValueError。
+    """
+    batches = [paths[i:i + BATCH_SIZE] for i in range(0, len(paths), BATCH_SIZE)]
+    with make_executor(workers, backend) as pool:
+        results = list(pool.map(_signature_task, ((batch, params, num_perm, seed) for batch in batches)))
+    failed = [error for result, batch_errors in results for error in batch_errors]
+    if failed:
+        if errors is None:
+            raise ValueError(f'读取失败 {failed[0][0]}: {failed[0][1]}')
+        errors.extend(failed)
+    if np is not None:
+        return np.concatenate([result for result, _ in results]) if results else np.empty((0, num_perm), dtype=np.uint32)
+    return [signature for result, _ in results for signature in result]
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Tag转换器去重模式：找出转换规整后标签集合近似重复的提示词')
+    parser.add_argument('paths', nargs='+', help='要检查的目录或文件')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Jaccard 相似度阈值')
+    parser.add_argument('--num-perm', type=int, default=DEFAULT_NUM_PERM, help='MinHash 签名长度')
+    parser.add_argument('--workers', type=int, default=None, help='进程数（线程数），默认为CPU核数')
+    parser.add_argument('--output', default=None, help='重复项报告（制表符分隔：重复文件、保留文件、与保留文件的估计相似度），省略时输出到标准输出')
+    add_pipeline_arguments(parser)
+    add_executor_arguments(parser)
+    args = parser.parse_args(argv)
+    paths = []
+    for target in args.paths:
+        paths.extend(iter_source_files(target) if os.path.isdir(target) else [target])
+    errors = []
+    signatures = compute_signatures(paths, params_from_args(args), args.num_perm, workers=args.workers, backend=args.executor, errors=errors)
+    if errors:
+        # 读取失败的文件不参与去重
+        for path, error in errors:
+            print(f'读取失败 {path}: {error}', file=sys.stderr)
+        failed = {path for path, error in errors}
+        kept = [i for i, path in enumerate(paths) if path not in failed]
+        paths = [paths[i] for i in kept]
+        signatures = signatures[kept] if np is not None else [signatures[i] for i in kept]
+    dup_of, scores = find_duplicates(signatures, args.threshold)
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for i, rep in enumerate(dup_of):
+            if rep >= 0:
+                out.write(f'{paths[i]}\t{paths[rep]}\t{scores[i]:.3f}\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    duplicates = sum(rep >= 0 for rep in dup_of)
+    print(f'共 {len(paths)} 个文件，近似重复 {duplicates} 个', file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
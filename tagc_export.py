@@ -0,0 +1,107 @@
+# 转换结果的列式导出：安装了 pyarrow 时写 Parquet，否则写 gzip 压缩的 JSONL。
+# 每行包含 path、raw（原文）、converted（转换结果）、tags（标签列表）、weights（对应权重列表），
+# 行按 row_group_size 分组缓冲后写出，内存中最多只保留一组。
+import gzip
+import json
+
+COLUMNS = ('path', 'raw', 'converted', 'tags', 'weights')
+DEFAULT_ROW_GROUP_SIZE = 8192
+
+
+def _parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('path', pa.string()),
+        ('raw', pa.string()),
+        ('converted', pa.string()),
+        ('tags', pa.list_(pa.string())),
+        ('weights', pa.list_(pa.float64())),
+    ])
+
+
+class _RowGroupWriter:
+    """按行组缓冲写出的基类，子类实现 _write_group 与 _close"""
+    def __init__(self, path, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+        self.path = path
+        self.row_group_size = row_group_size
+        self.rows = 0
+        self._buffer = []
+
+    def write(self, row):
+        """写入一行（包含 COLUMNS 各键的字典）"""
+        self._buffer.append(row)
+        if len(self._buffer) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._write_group(self._buffer)
+            self.rows += len(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        self.flush()
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ParquetExportWriter(_RowGroupWriter):
+    """Parquet 写出器，每个缓冲组写为一个行组（需要 pyarrow）"""
+    format = 'parquet'
+
+    def __init__(self, path, row_group_size=DEFAULT_ROW_GROUP_SIZE, compression='zstd'):
+        import pyarrow.parquet as pq
+        super().__init__(path, row_group_size)
+        self._schema = _parquet_schema()
+        self._writer = pq.ParquetWriter(path, self._schema, compression=compression)
+
+    def _write_group(self, rows):
+        import pyarrow as pa
+        columns = {name: [row[name] for row in rows] for name in COLUMNS}
+        self._writer.write_table(pa.Table.from_pydict(columns, schema=self._schema), row_group_size=len(rows))
+
+    def _close(self):
+        self._writer.close()
+
+
+class JsonlExportWriter(_RowGroupWriter):
+    """gzip 压缩的 JSONL 写出器，未安装 pyarrow 时使用"""
+    format = 'jsonl'
+
+    def __init__(self, path, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+        super().__init__(path, row_group_size)
+        self._file = gzip.open(path, 'wt', encoding='utf-8') if path.lower().endswith('.gz') else open(path, 'w', encoding='utf-8')
+
+    def _write_group(self, rows):
+        self._file.write(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows))
+
+    def _close(self):
+        self._file.close()
+
+
+def pyarrow_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def open_export_writer(path, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+    """
+    按扩展名打开写出器：.jsonl/.jsonl.gz 写 JSONL，其余写 Parquet。
+    未安装 pyarrow 时 Parquet 退回为同名的 .jsonl.gz（如 out.parquet → out.jsonl.gz），
+    实际路径见返回对象的 path 属性。
+    """
+    name = path.lower()
+    if name.endswith(('.jsonl', '.jsonl.gz')):
+        return JsonlExportWriter(path, row_group_size)
+    if pyarrow_available():
+        return ParquetExportWriter(path, row_group_size)
+    stem = path[:-len('.parquet')] if name.endswith('.parquet') else path
+    return JsonlExportWriter(stem + '.jsonl.gz', row_group_size)
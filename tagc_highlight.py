@@ -0,0 +1,264 @@
+# 输入/输出编辑框的标签语法高亮。
+# 基于 QSyntaxHighlighter 的逐块（逐行）状态：NAI 的 {}/[] 深度与 数字:: 权重组可以跨行，
+# 行尾状态存进块状态，编辑某一行时 Qt 只重新高亮该行，以及行尾状态发生变化的后续行。
+# 不在可视区域内的行既不设置格式也不推算状态，而是沿用旧状态，让 Qt 的逐行连锁重算停在可视区域边界；
+# 从该行起的状态记为过期，滚动或编辑后再从最近的有效状态往下补算到可视区域并补上格式，
+# 十万行的文本也能流畅滚动，在开头输入括号也不会逐行重算到文末。
+import re
+
+from PySide6.QtCore import QTimer
+from PySide6.QtGui import QColor, QFont, QSyntaxHighlighter, QTextCharFormat
+
+from tagc_weights import DEFAULT_WEIGHT_MODEL, get_weight_model
+
+# 块数不超过该值时全部直接高亮，不做延迟
+FULL_HIGHLIGHT_BLOCKS = 2000
+# 可视区域上下额外提前高亮的行数
+VISIBLE_MARGIN = 50
+# 滚动/编辑后补高亮的延迟（毫秒），连续滚动时合并为一次
+DEFER_INTERVAL = 30
+
+_RE_SYNTAX = re.compile(
+    r'(?P<float_open>\d+(?:\.\d+)?::)'
+    r'|(?P<float_close>::)'
+    r'|\((?P<sd_body>[^():]+):(?P<sd_weight>\d+(?:\.\d*)?)\)'
+    r'|(?P<brace>[{}\[\]])'
+)
+# 只推算状态时用的记号，与 _RE_SYNTAX 中影响状态的部分相同
+_RE_STATE_TOKEN = re.compile(r'\d+(?:\.\d+)?::|::|[{}\[\]]')
+_RE_ARTIST_TAG = re.compile(r'[^,，\n]*artist[^,，\n]*', re.I)
+
+# 块状态：低 6 位为 { 深度，其上 6 位为 [ 深度，再往上 14 位为所在 数字:: 组的权重（百分之一，0 表示不在组内），
+# 最高的 HIGHLIGHTED 位表示该块已按完整规则设置格式（否则只推算了状态）
+_DEPTH_MASK = 0x3F
+_MAX_DEPTH = _DEPTH_MASK
+_WEIGHT_MASK = 0x3FFF
+_HIGHLIGHTED = 1 << 26
+# 没有过期状态时 _stale_from 的取值
+_NO_STALE = 1 << 62
+
+
+def _encode_state(up, down, float_weight, highlighted):
+    state = min(up, _MAX_DEPTH) | min(down, _MAX_DEPTH) << 6 | min(int(round(float_weight * 100)), _WEIGHT_MASK) << 12
+    return state | _HIGHLIGHTED if highlighted else state
+
+
+def _decode_state(state):
+    if state < 0:
+        return 0, 0, 0.0
+    return state & _DEPTH_MASK, state >> 6 & _DEPTH_MASK, (state >> 12 & _WEIGHT_MASK) / 100
+
+
+def _scan_state(text, up, down, float_weight):
+    """不设置格式，只按行内的括号与 :: 推算行尾状态（与 TagHighlighter._advance 规则相同）"""
+    for token in _RE_STATE_TOKEN.findall(text):
+        if token == '{':
+            up += 1
+        elif token == '}':
+            up = max(up - 1, 0)
+        elif token == '[':
+            down += 1
+        elif token == ']':
+            down = max(down - 1, 0)
+        elif float_weight or token == '::':
+            float_weight = 0.0
+        else:
+            float_weight = float(token[:-2]) or 0.01
+    return up, down, float_weight
+
+
+def _format(color, bold=False, italic=False, background=None, underline=False):
+    fmt = QTextCharFormat()
+    fmt.setForeground(QColor(color))
+    if bold:
+        fmt.setFontWeight(QFont.Bold)
+    if italic:
+        fmt.setFontItalic(True)
+    if background:
+        fmt.setBackground(QColor(background))
+    if underline:
+        fmt.setFontUnderline(True)
+    return fmt
+
+
+class TagHighlighter(QSyntaxHighlighter):
+    """
+    标签语法高亮：按深度着色的 NAI 括号、数字:: 权重组、SD 的 (tag:w) 权重、超过权重上限的权重与 artist 标签。
+    Args:
+        editor (QPlainTextEdit): 要高亮的编辑框
+        weight_limit (float): 超过该值的权重按警告色显示
+        weight_model (str): 换算 NAI 括号权重使用的模型
+    """
+    BRACE_COLORS = ('#FFB74D', '#FF8A65', '#F06292', '#BA68C8', '#9575CD')
+
+    def __init__(self, editor, weight_limit=1.6, weight_model=DEFAULT_WEIGHT_MODEL):
+        super().__init__(editor.document())
+        self.editor = editor
+        self.weight_limit = weight_limit
+        self.weight_model = weight_model
+        self._model = get_weight_model(weight_model)
+        self._visible = (0, -1)
+        # 块号不小于该值的块状态可能已过期，需要补算后才能用作后续行的起始状态
+        self._stale_from = _NO_STALE
+        self._block_count = editor.document().blockCount()
+        self.formats = {
+            'up': _format('#FFCC80'),
+            'down': _format('#81D4FA'),
+            'float_weight': _format('#AED581', bold=True),
+            'float_body': _format('#C5E1A5', italic=True),
+            'sd_body': _format('#FFE082'),
+            'sd_weight': _format('#AED581', bold=True),
+            'over_limit': _format('#FFFFFF', bold=True, background='#C62828'),
+            'artist': _format('#CE93D8', underline=True),
+        }
+        self._brace_formats = [_format(color, bold=True) for color in self.BRACE_COLORS]
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(DEFER_INTERVAL)
+        self._timer.timeout.connect(self._highlight_visible)
+        # updateRequest 在光标闪烁时也会发出，只在滚动或整个视口重绘（改变大小等）时补高亮
+        editor.updateRequest.connect(self._on_update_request)
+        self.document().contentsChange.connect(self._on_contents_change)
+        self._update_visible()
+
+    def set_weight_limit(self, weight_limit):
+        if weight_limit != self.weight_limit:
+            self.weight_limit = weight_limit
+            self.rehighlight()
+
+    def set_weight_model(self, weight_model):
+        if weight_model != self.weight_model:
+            self.weight_model = weight_model
+            self._model = get_weight_model(weight_model)
+            self.rehighlight()
+
+    def _on_update_request(self, rect, dy):
+        if dy or rect.contains(self.editor.viewport().rect()):
+            self._timer.start()
+
+    def _on_contents_change(self, position, removed, added):
+        # 增删行后编辑点之后的块号整体移动，记录的过期起点不再可靠，从编辑点起一律视为过期
+        document = self.document()
+        count = document.blockCount()
+        if count != self._block_count:
+            self._block_count = count
+            if count > FULL_HIGHLIGHT_BLOCKS:
+                self._stale_from = min(self._stale_from, document.findBlock(position).blockNumber() + 1)
+        self._timer.start()
+
+    def _update_visible(self):
+        """计算可视区域（含上下余量）的块号范围"""
+        document = self.document()
+        if document.blockCount() <= FULL_HIGHLIGHT_BLOCKS:
+            self._visible = (0, document.blockCount())
+            return
+        editor = self.editor
+        block = editor.firstVisibleBlock()
+        first = block.blockNumber()
+        bottom = editor.viewport().height()
+        offset = editor.contentOffset()
+        last = first
+        while block.isValid() and editor.blockBoundingGeometry(block).translated(offset).top() <= bottom:
+            last = block.blockNumber()
+            block = block.next()
+        self._visible = (max(0, first - VISIBLE_MARGIN), last + VISIBLE_MARGIN)
+
+    def _highlight_visible(self):
+        """补算可视区域之前的过期状态，再补高亮可视区域内过期或尚未设置格式的块"""
+        self._update_visible()
+        first, last = self._visible
+        document = self.document()
+        stale_from = self._stale_from
+        if stale_from <= last:
+            self._refresh_states(stale_from, first)
+            # 可视区域之后的块仍沿用旧状态
+            self._stale_from = last + 1
+        block = document.findBlockByNumber(first)
+        while block.isValid() and block.blockNumber() <= last:
+            state = block.userState()
+            if block.blockNumber() >= stale_from or state < 0 or not state & _HIGHLIGHTED:
+                self.rehighlightBlock(block)
+            block = block.next()
+
+    def _refresh_states(self, start, stop):
+        """从 start 块起按前一块的状态逐行推算到 stop 之前，只更新状态，格式在进入可视区域时再补"""
+        block = self.document().findBlockByNumber(start)
+        state = _decode_state(block.previous().userState()) if start > 0 else (0, 0, 0.0)
+        for _ in range(stop - start):
+            if not block.isValid():
+                break
+            state = _scan_state(block.text(), *state)
+            block.setUserState(_encode_state(*state, False))
+            block = block.next()
+
+    def highlightBlock(self, text):
+        up, down, float_weight = _decode_state(self.previousBlockState())
+        first, last = self._visible
+        number = self.currentBlock().blockNumber()
+        if not first <= number <= last:
+            # 可视区域外沿用旧状态，连锁重算到此为止；从该块起的状态过期，滚动到附近时再补算
+            self._stale_from = min(self._stale_from, number)
+            self.setCurrentBlockState(self.currentBlockState())
+            return
+        formats = self.formats
+        position = 0
+        for match in _RE_SYNTAX.finditer(text):
+            self._format_plain(position, match.start() - position, up, down, float_weight)
+            position = match.end()
+            kind = match.lastgroup
+            if kind == 'brace':
+                char = match.group()
+                depth = up if char in '{}' else down
+                depth = depth + 1 if char in '{[' else depth
+                self.setFormat(match.start(), 1, self._brace_formats[max(depth - 1, 0) % len(self._brace_formats)])
+            elif kind == 'float_open' and not float_weight:
+                weight = float(match.group()[:-2])
+                self.setFormat(match.start(), len(match.group()), formats['over_limit' if weight > self.weight_limit else 'float_weight'])
+            elif kind in ('float_open', 'float_close'):
+                self.setFormat(match.end() - 2, 2, formats['float_weight'])
+            elif kind == 'sd_weight':
+                weight = float(match.group('sd_weight'))
+                self.setFormat(match.start('sd_body'), len(match.group('sd_body')), formats['sd_body'])
+                self.setFormat(match.start('sd_weight'), len(match.group('sd_weight')),
+                               formats['over_limit' if weight > self.weight_limit else 'sd_weight'])
+            up, down, float_weight = self._advance(match, up, down, float_weight)
+        self._format_plain(position, len(text) - position, up, down, float_weight)
+        for match in _RE_ARTIST_TAG.finditer(text):
+            if match.group().strip():
+                self.setFormat(match.start(), match.end() - match.start(), formats['artist'])
+        self.setCurrentBlockState(_encode_state(up, down, float_weight, True))
+
+    @staticmethod
+    def _advance(match, up, down, float_weight):
+        """按一个语法记号更新括号深度与权重组状态"""
+        kind = match.lastgroup
+        if kind == 'brace':
+            char = match.group()
+            if char == '{':
+                up += 1
+            elif char == '}':
+                up = max(up - 1, 0)
+            elif char == '[':
+                down += 1
+            else:
+                down = max(down - 1, 0)
+        elif kind == 'float_open' and not float_weight:
+            float_weight = float(match.group()[:-2]) or 0.01
+        elif kind in ('float_open', 'float_close'):
+            float_weight = 0.0
+        return up, down, float_weight
+
+    def _format_plain(self, start, length, up, down, float_weight):
+        """括号或权重组内的普通文本按所在权重着色，超过上限时显示警告色"""
+        if length <= 0:
+            return
+        formats = self.formats
+        if float_weight:
+            weight, fmt = float_weight, formats['float_body']
+        elif up > down:
+            weight, fmt = self._model.bracket_weight(True, up - down), formats['up']
+        elif down > up:
+            weight, fmt = self._model.bracket_weight(False, down - up), formats['down']
+        else:
+            return
+        self.setFormat(start, length, formats['over_limit'] if weight > self.weight_limit else fmt)
@@ -0,0 +1,479 @@
+import gzip
+import html
+import json
+import re
+import struct
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def extract_png_text_chunks(filename):
+    """
+    读取PNG中的 tEXt/iTXt 文本块（生成图片时写入的提示词等信息）。
+    Args:
+        filename (str): PNG文件路径
+    Returns:
+        list: [{"keyword": 关键字, "text": 文本}, ...]
+    """
+    def read_chunk(f):
+        length_bytes = f.read(4)
+        if len(length_bytes) < 4:
+            return None, None, None
+        length = struct.unpack(">I", length_bytes)[0]
+        chunk_type = f.read(4)
+        if chunk_type not in (b"tEXt", b"iTXt"):
+            # 图像数据等无关块直接跳过，不读入内存
+            f.seek(length + 4, 1)
+            return chunk_type, None, None
+        data = f.read(length)
+        crc = f.read(4)
+        return chunk_type, data, crc
+    results = []
+    with open(filename, "rb") as f:
+        sig = f.read(8)
+        if sig != PNG_SIGNATURE:
+            raise ValueError("Not a PNG file")
+        while True:
+            chunk_type, data, crc = read_chunk(f)
+            if chunk_type is None:
+                break
+            if chunk_type in [b"tEXt", b"iTXt"]:
+                if chunk_type == b"tEXt":
+                    parts = data.split(b"\x00", 1)
+                    if len(parts) == 2:
+                        keyword, text = parts
+                        results.append({"keyword": keyword.decode("utf-8", "ignore"), "text": text.decode("utf-8", "ignore")})
+                elif chunk_type == b"iTXt":
+                    parts = data.split(b"\x00", 5)
+                    if len(parts) == 6:
+                        keyword, comp_flag, comp_method, lang_tag, trans_key, text = parts
+                        results.append({"keyword": keyword.decode("utf-8", "ignore"), "text": text.decode("utf-8", "ignore")})
+            if chunk_type == b"IEND":
+                break
+    return results
+
+
+def format_image_info(info, field=None):
+    """
+    取第一个文本块的内容作为提示词；
+    指定 field（positive/negative/settings）时按来源格式拆分后只取该字段，见 parse_image_metadata。
+    """
+    if field:
+        return parse_image_metadata(info)[field]
+    if info and 'text' in info[0]:
+        return info[0]['text']
+    return ''
+
+
+JPEG_SIGNATURE = b"\xff\xd8"
+_EXIF_HEADER = b"Exif\x00\x00"
+_XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+# TIFF 标签：ImageDescription、Exif IFD 指针、UserComment
+_TAG_IMAGE_DESCRIPTION = 0x010E
+_TAG_EXIF_IFD = 0x8769
+_TAG_USER_COMMENT = 0x9286
+# XMP 中可能存放提示词的属性，按优先级排列
+_XMP_FIELDS = ('exif:UserComment', 'dc:description', 'tiff:ImageDescription')
+
+
+def _decode_user_comment(data, byte_order):
+    """按 EXIF UserComment 前 8 字节的字符集标识解码"""
+    code, body = data[:8], data[8:]
+    if code.startswith(b"UNICODE"):
+        # 多数工具按 TIFF 字节序写 UTF-16，也有固定写大端的（如 piexif），按零字节位置判断
+        sample = body[:256]
+        even_zeros, odd_zeros = sample[0::2].count(0), sample[1::2].count(0)
+        if even_zeros != odd_zeros:
+            encoding = 'utf-16-be' if even_zeros > odd_zeros else 'utf-16-le'
+        else:
+            encoding = 'utf-16-be' if byte_order == '>' else 'utf-16-le'
+        return body.decode(encoding, 'ignore').rstrip('\x00')
+    if code.startswith(b"JIS"):
+        return body.decode('shift_jis', 'ignore').rstrip('\x00')
+    if code.startswith(b"ASCII") or code == b"\x00" * 8:
+        return body.decode('utf-8', 'ignore').rstrip('\x00')
+    # 没有字符集标识的写法，整段按 UTF-8 解码
+    return data.decode('utf-8', 'ignore').rstrip('\x00')
+
+
+def parse_exif_text(data):
+    """
+    从 TIFF 结构的 EXIF 数据中取出 UserComment 与 ImageDescription。
+    Args:
+        data (bytes): EXIF 数据，可带 "Exif\\0\\0" 前缀
+    Returns:
+        list: [{"keyword": 关键字, "text": 文本}, ...]，UserComment 的关键字与 WebUI PNG 一致记为 parameters
+    """
+    if data.startswith(_EXIF_HEADER):
+        data = data[len(_EXIF_HEADER):]
+    if data[:4] == b"II*\x00":
+        byte_order = '<'
+    elif data[:4] == b"MM\x00*":
+        byte_order = '>'
+    else:
+        return []
+    entry = struct.Struct(byte_order + 'HHII')
+
+    def read_ifd(offset):
+        """返回 {标签: (类型, 数量, 值或偏移所在的原始4字节位置)}"""
+        entries = {}
+        if offset + 2 > len(data):
+            return entries
+        count = struct.unpack_from(byte_order + 'H', data, offset)[0]
+        for i in range(count):
+            pos = offset + 2 + i * 12
+            if pos + 12 > len(data):
+                break
+            tag, typ, n, value = entry.unpack_from(data, pos)
+            entries[tag] = (typ, n, value, pos + 8)
+        return entries
+
+    def read_value(item):
+        typ, n, value, inline_pos = item
+        if n <= 4:
+            return data[inline_pos:inline_pos + n]
+        return data[value:value + n]
+
+    results = []
+    ifd0 = read_ifd(struct.unpack_from(byte_order + 'I', data, 4)[0])
+    if _TAG_EXIF_IFD in ifd0:
+        exif_ifd = read_ifd(ifd0[_TAG_EXIF_IFD][2])
+        if _TAG_USER_COMMENT in exif_ifd:
+            text = _decode_user_comment(read_value(exif_ifd[_TAG_USER_COMMENT]), byte_order)
+            if text:
+                results.append({"keyword": "parameters", "text": text})
+    if _TAG_IMAGE_DESCRIPTION in ifd0:
+        text = read_value(ifd0[_TAG_IMAGE_DESCRIPTION]).rstrip(b"\x00").decode('utf-8', 'ignore')
+        if text:
+            results.append({"keyword": "ImageDescription", "text": text})
+    return results
+
+
+def parse_xmp_text(data):
+    """从 XMP 数据包中取出可能存放提示词的字段（元素与属性两种写法）"""
+    packet = data.decode('utf-8', 'ignore')
+    results = []
+    for field in _XMP_FIELDS:
+        match = re.search(r'<' + field + r'\b[^>]*>(.*?)</' + field + '>', packet, re.DOTALL)
+        if match:
+            # rdf:Alt/rdf:li 等包装元素去掉，只保留文本
+            text = re.sub(r'<[^>]+>', '', match.group(1)).strip()
+        else:
+            match = re.search(field + r'="([^"]*)"', packet)
+            text = match.group(1) if match else ''
+        if text:
+            results.append({"keyword": field, "text": html.unescape(text)})
+    return results
+
+
+def extract_jpeg_text_chunks(filename):
+    """
+    只读取 JPEG 的标记段头部：解析 APP1 中的 EXIF/XMP，跳过其他段，
+    遇到 SOS（图像数据开始）即停止，不读取压缩图像数据。
+    Returns:
+        list: [{"keyword": 关键字, "text": 文本}, ...]
+    """
+    results = []
+    with open(filename, "rb") as f:
+        if f.read(2) != JPEG_SIGNATURE:
+            raise ValueError("Not a JPEG file")
+        while True:
+            header = f.read(2)
+            if len(header) < 2 or header[0] != 0xFF:
+                break
+            marker = header[1]
+            if marker == 0xFF:
+                # 填充字节，回退一位继续读标记
+                f.seek(-1, 1)
+                continue
+            if marker in (0xD9, 0xDA):
+                # EOI 或 SOS：之后是图像数据
+                break
+            if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+                continue
+            length_bytes = f.read(2)
+            if len(length_bytes) < 2:
+                break
+            length = struct.unpack(">H", length_bytes)[0] - 2
+            if marker == 0xE1:
+                data = f.read(length)
+                if data.startswith(_EXIF_HEADER):
+                    results.extend(parse_exif_text(data))
+                elif data.startswith(_XMP_HEADER):
+                    results.extend(parse_xmp_text(data[len(_XMP_HEADER):]))
+            elif marker == 0xFE:
+                text = f.read(length).rstrip(b"\x00").decode('utf-8', 'ignore')
+                if text:
+                    results.append({"keyword": "Comment", "text": text})
+            else:
+                f.seek(length, 1)
+    return results
+
+
+def extract_webp_text_chunks(filename):
+    """
+    遍历 WebP 的 RIFF 块：只读取 EXIF 与 "XMP " 块，图像数据等其他块按长度直接跳过。
+    Returns:
+        list: [{"keyword": 关键字, "text": 文本}, ...]
+    """
+    results = []
+    with open(filename, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WEBP":
+            raise ValueError("Not a WebP file")
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                break
+            fourcc = chunk_header[:4]
+            size = struct.unpack("<I", chunk_header[4:])[0]
+            padded = size + (size & 1)
+            if fourcc == b"EXIF":
+                results.extend(parse_exif_text(f.read(size)))
+                f.seek(padded - size, 1)
+            elif fourcc == b"XMP ":
+                results.extend(parse_xmp_text(f.read(size)))
+                f.seek(padded - size, 1)
+            else:
+                f.seek(padded, 1)
+    return results
+
+
+# NovelAI 隐写信息（stealth pnginfo）：提示词按列优先顺序写在 alpha 通道的最低位，
+# 依次为 15 字节魔数、32 位大端的载荷比特数、载荷（pngcomp 为 gzip 压缩）
+_STEALTH_MAGICS = {b"stealth_pnginfo": False, b"stealth_pngcomp": True}
+_STEALTH_HEADER_BITS = 15 * 8 + 32
+
+
+def decode_stealth_alpha(alpha):
+    """
+    从 alpha 平面（numpy 二维 uint8 数组，形状为 高×宽）解码隐写载荷。
+    比特按列优先排列，只取出魔数、长度与载荷实际占用的那几列做位运算，读够声明的长度即停止。
+    Returns:
+        bytes: 载荷（已解压），没有隐写信息时返回 None
+    """
+    import numpy as np
+    height, width = alpha.shape
+
+    def read_bits(start, count):
+        first, last = start // height, -(-(start + count) // height)
+        if last > width:
+            return None
+        bits = np.ascontiguousarray(alpha[:, first:last].T).reshape(-1) & 1
+        offset = start - first * height
+        return np.packbits(bits[offset:offset + count]).tobytes()
+
+    header = read_bits(0, _STEALTH_HEADER_BITS)
+    if header is None or header[:15] not in _STEALTH_MAGICS:
+        return None
+    length = int.from_bytes(header[15:19], "big")
+    payload = read_bits(_STEALTH_HEADER_BITS, length)
+    if payload is None:
+        return None
+    if _STEALTH_MAGICS[header[:15]]:
+        payload = gzip.decompress(payload)
+    return payload
+
+
+def _png_has_alpha(filename):
+    """只读 IHDR 判断 PNG 是否带 alpha 通道（灰度+alpha 或 RGBA）"""
+    with open(filename, "rb") as f:
+        head = f.read(33)
+    return len(head) == 33 and head[12:16] == b"IHDR" and head[25] in (4, 6)
+
+
+def extract_stealth_pnginfo(filename):
+    """
+    读取 NovelAI 写在 alpha 通道最低位的隐写信息（文本块被去除的图片仍保留）。
+    需要 Pillow 与 numpy，未安装或图片没有隐写信息时返回空列表。
+    Returns:
+        list: 载荷为 JSON 对象时每个键一项（与 PNG 文本块格式一致），否则为 [{"keyword": "parameters", "text": 载荷}]
+    """
+    if not _png_has_alpha(filename):
+        return []
+    try:
+        import numpy as np
+        from PIL import Image
+    except ImportError:
+        return []
+    with Image.open(filename) as img:
+        alpha = np.asarray(img.getchannel("A"))
+    payload = decode_stealth_alpha(alpha)
+    if payload is None:
+        return []
+    text = payload.decode("utf-8", "ignore")
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        return [{"keyword": str(key), "text": value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)}
+                for key, value in data.items()]
+    return [{"keyword": "parameters", "text": text}]
+
+
+def extract_image_text_chunks(filename, stealth=True):
+    """
+    按文件头识别 PNG/JPEG/WebP 并读取其中的文本信息，格式同 extract_png_text_chunks。
+    stealth 为真时，没有文本块的 PNG 再尝试读取 NovelAI 的 alpha 通道隐写信息。
+    """
+    with open(filename, "rb") as f:
+        head = f.read(12)
+    if head.startswith(PNG_SIGNATURE):
+        results = extract_png_text_chunks(filename)
+        if not results and stealth:
+            results = extract_stealth_pnginfo(filename)
+        return results
+    if head.startswith(JPEG_SIGNATURE):
+        return extract_jpeg_text_chunks(filename)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return extract_webp_text_chunks(filename)
+    raise ValueError("Unsupported image format")
+
+
+try:
+    # 可选的快速 JSON 解析器，ComfyUI 的节点图可能很大
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+_RE_WEBUI_SETTINGS = re.compile(r'^Steps: \d+', re.M)
+# ComfyUI 中采样器节点引用正/负提示词的输入名
+_COMFY_PROMPT_INPUTS = (('positive', 'positive'), ('negative', 'negative'))
+# 沿连线查找提示词时只看这些前缀的输入（text、SDXL 的 text_g/text_l、字符串拼接节点的 text_a/string1、
+# 开关节点选中的 on_true 等），clip/model 等输入不会通向提示词，不必访问
+_COMFY_TEXT_INPUTS = ('text', 'string', 'prompt', 'positive', 'value', 'on_true')
+
+
+def _chunk_text(info, keyword):
+    for item in info:
+        if item.get('keyword') == keyword:
+            return item.get('text')
+    return None
+
+
+def parse_webui_parameters(text):
+    """
+    拆分 WebUI 的 parameters 文本：正向提示词、"Negative prompt:" 之后的反向提示词，以及末尾 "Steps: ..." 起的设置行。
+    Returns:
+        dict: {"positive": ..., "negative": ..., "settings": ...}
+    """
+    settings = ''
+    match = None
+    for match in _RE_WEBUI_SETTINGS.finditer(text):
+        pass
+    if match is not None:
+        text, settings = text[:match.start()], text[match.start():].strip()
+    positive, sep, negative = text.partition('Negative prompt:')
+    return {'positive': positive.strip(), 'negative': negative.strip() if sep else '', 'settings': settings}
+
+
+def parse_novelai_comment(text):
+    """解析 NovelAI 写在 Comment 中的 JSON，prompt 为正向、uc 为反向提示词，其余标量字段作为设置"""
+    data = _json_loads(text)
+    if not isinstance(data, dict):
+        raise ValueError('Comment 不是 JSON 对象')
+    settings = {key: value for key, value in data.items()
+                if key not in ('prompt', 'uc') and isinstance(value, (str, int, float, bool))}
+    return {
+        'positive': data.get('prompt') or '',
+        'negative': data.get('uc') or '',
+        'settings': ', '.join(f'{key}: {value}' for key, value in settings.items()),
+    }
+
+
+def parse_comfyui_prompt(text):
+    """
+    解析 ComfyUI 的 prompt 节点图：从采样器节点的 positive/negative 输入出发，
+    沿连线找到文本编码节点并取出提示词，只访问这几条路径上的节点。
+    拼接节点的各段按输入顺序以换行连接；未找到采样器时退回为按节点编号顺序的第一个文本节点。
+    """
+    graph = _json_loads(text)
+    if not isinstance(graph, dict):
+        raise ValueError('prompt 不是 JSON 对象')
+
+    def node_text(ref, depth=0):
+        # 连线为 [节点编号, 输出序号]；经过条件合并等中间节点时继续向上游查找
+        if depth > 16 or not isinstance(ref, list) or not ref:
+            return ''
+        node = graph.get(str(ref[0]))
+        if not isinstance(node, dict):
+            return ''
+        texts = []
+        for name, value in (node.get('inputs') or {}).items():
+            if not name.lower().startswith(_COMFY_TEXT_INPUTS):
+                continue
+            if isinstance(value, list):
+                value = node_text(value, depth + 1)
+            if isinstance(value, str) and value.strip() and value not in texts:
+                texts.append(value)
+        return '\n'.join(texts)
+
+    result = {'positive': '', 'negative': '', 'settings': ''}
+    for node_id in sorted(graph, key=lambda key: (len(key), key)):
+        node = graph[node_id]
+        inputs = node.get('inputs') if isinstance(node, dict) else None
+        if not isinstance(inputs, dict) or not isinstance(inputs.get('positive'), list):
+            continue
+        for field, name in _COMFY_PROMPT_INPUTS:
+            result[field] = node_text(inputs.get(name))
+        result['settings'] = ', '.join(f'{key}: {value}' for key, value in inputs.items()
+                                       if isinstance(value, (str, int, float)) and not isinstance(value, bool))
+        return result
+    for node_id in sorted(graph, key=lambda key: (len(key), key)):
+        inputs = graph[node_id].get('inputs') if isinstance(graph[node_id], dict) else None
+        if isinstance(inputs, dict) and isinstance(inputs.get('text'), str):
+            result['positive'] = inputs['text']
+            break
+    return result
+
+
+def parse_image_metadata(info):
+    """
+    识别图片文本信息的来源格式并拆分字段。
+    Args:
+        info (list): extract_image_text_chunks 的返回值
+    Returns:
+        dict: {"format": "webui"/"novelai"/"comfyui"/"unknown", "positive": 正向提示词,
+               "negative": 反向提示词, "settings": 其余设置（文本）}
+        ComfyUI 的 workflow 块（界面布局，可能很大）不会被解析。
+    """
+    comment = _chunk_text(info, 'Comment')
+    if comment is not None and (_chunk_text(info, 'Software') == 'NovelAI' or comment.lstrip().startswith('{')):
+        try:
+            return dict(parse_novelai_comment(comment), format='novelai')
+        except ValueError:
+            pass
+    # ComfyUI 的保存节点常同时写入 WebUI 格式的 parameters，有则优先使用，不必解析节点图
+    parameters = _chunk_text(info, 'parameters')
+    if parameters is not None:
+        return dict(parse_webui_parameters(parameters), format='webui')
+    prompt = _chunk_text(info, 'prompt')
+    if prompt is not None:
+        try:
+            return dict(parse_comfyui_prompt(prompt), format='comfyui')
+        except ValueError:
+            pass
+    description = _chunk_text(info, 'Description')
+    if description is not None:
+        return {'format': 'novelai', 'positive': description, 'negative': '', 'settings': ''}
+    return {'format': 'unknown', 'positive': format_image_info(info), 'negative': '', 'settings': ''}
+
+
+def convert_image_metadata(info, **params):
+    """
+    分别转换图片的正向与反向提示词，设置行保持原样。
+    Args:
+        info (list): extract_image_text_chunks 的返回值
+        **params: get_pipeline 关键字参数
+    Returns:
+        dict: parse_image_metadata 的结果，positive/negative 为转换后的文本
+    """
+    from tagc_core import get_pipeline
+    meta = parse_image_metadata(info)
+    pipeline = get_pipeline(**params)
+    for field in ('positive', 'negative'):
+        if meta[field]:
+            meta[field] = pipeline(meta[field])
+    return meta
@@ -0,0 +1,214 @@
+# 批量转换的内存预算：按预算确定进程数、限制同时提交的任务、把放不进预算的超大文件改走流式转换，
+# 并记录每个任务与每个进程的峰值内存，运行结束后输出峰值报告。
+#
+# 单个任务的峰值按 输入字节数 × 放大倍数 估计（解码后的 str 与各个 re.sub 步骤都会产生整份文本的副本），
+# 放大倍数先取保守的默认值，之后用 tracemalloc 抽样测得的实际峰值与各子进程的峰值常驻内存校正。
+import json
+import os
+import sys
+import threading
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from tagc_core import STREAM_CHUNK_SIZE
+
+# 未测得实际值前使用的放大倍数（峰值内存 / 输入字节数）
+DEFAULT_MEMORY_RATIO = 20.0
+# 测得的放大倍数再乘以该系数作为估计值，留出余量
+SAFETY_FACTOR = 1.25
+# 开头的若干个任务（每个进程两个）全部测峰值，之后每隔多少个任务用 tracemalloc 测一次
+SAMPLE_EVERY = 32
+# 小于该大小的文件峰值主要是固定开销，不用于校正放大倍数
+MIN_SAMPLE_SIZE = 64 * 1024
+
+# tracemalloc 是进程级的，线程池中同一时刻只允许一个任务测量
+_measure_lock = threading.Lock()
+
+
+def current_rss():
+    """本进程当前的常驻内存（字节），无法读取时返回峰值常驻内存"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return peak_rss()
+
+
+def peak_rss():
+    """本进程的峰值常驻内存（字节），不支持的平台返回 0"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def measure_peak(fn, *args):
+    """
+    用 tracemalloc 执行 fn(*args)，返回 (结果, 期间 Python 分配内存的峰值字节数)。
+    其他线程正在测量时不测，峰值为 None；测量期间其他线程的分配也会计入，所得峰值偏大（估计因此偏保守）。
+    """
+    if not _measure_lock.acquire(blocking=False):
+        return fn(*args), None
+    try:
+        tracemalloc.start()
+        try:
+            result = fn(*args)
+            return result, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    finally:
+        _measure_lock.release()
+
+
+class MemoryLimit:
+    """
+    一次批量运行的内存预算。
+    子进程的基础占用按主进程当前的常驻内存估计（两者导入的模块相同），
+    预算先扣除主进程与各子进程的基础占用，剩下的部分分给正在执行的任务；
+    使用线程池时各线程共用主进程，只扣除一份基础占用。
+    Args:
+        max_memory (int): 整个运行（主进程加全部子进程）的内存上限，字节
+        workers (int): 期望的进程数，预算不够时减少
+        allow_stream (bool): 超出预算的文件是否改走流式转换；为假时只能等其他任务完成后单独执行
+        threads (bool): 任务在本进程的线程池中执行
+    """
+    def __init__(self, max_memory, workers=None, allow_stream=True, threads=False):
+        self.max_memory = max_memory
+        self.allow_stream = allow_stream
+        self.threads = threads
+        self.base = current_rss()
+        self.ratio = DEFAULT_MEMORY_RATIO
+        self.requested_workers = workers or os.cpu_count() or 1
+        available = max_memory - self.base
+        worker_base = 0 if threads else self.base
+        per_worker = worker_base + self.stream_cost()
+        self.workers = max(1, min(self.requested_workers, available // per_worker))
+        # 分给任务的容量：预算减去主进程与各子进程的基础占用
+        self.capacity = max(0, available - self.workers * worker_base)
+        self.in_use = 0
+        self.tasks = 0
+        self.streamed = []
+        self.samples = 0
+        self._calibrated = False
+        self.largest = None
+        self.worker_peaks = {}
+        # 子进程号 -> 该进程整体转换过的最大文件；流式转换过的进程不参与按常驻内存校正
+        self._worker_sizes = {}
+        self._streamed_pids = set()
+
+    def stream_cost(self):
+        """流式转换的峰值估计：读缓冲与待合并的段各约一段"""
+        return int(2 * STREAM_CHUNK_SIZE * self.ratio)
+
+    def estimate(self, size):
+        return int(size * self.ratio)
+
+    def plan(self, path, size):
+        """
+        为一个文件安排执行方式，返回 (是否流式转换, 是否抽样测峰值, 估计峰值)。
+        估计峰值超过全部任务容量的文件改走流式转换。
+        """
+        self.tasks += 1
+        cost = self.estimate(size)
+        stream = self.allow_stream and cost > self.capacity
+        if stream:
+            self.streamed.append(path)
+            cost = self.stream_cost()
+        measure = self.tasks <= 2 * self.workers or self.tasks % SAMPLE_EVERY == 1
+        return stream, measure, cost
+
+    def chunk_cost(self, chunk):
+        """一组任务在同一子进程内依次执行，峰值取其中最大的一个（任务元组的最后一项为估计峰值）"""
+        return max(task[-1] for task in chunk)
+
+    def fits(self, cost):
+        return self.in_use + cost <= self.capacity
+
+    def acquire(self, cost):
+        self.in_use += cost
+
+    def release(self, cost):
+        self.in_use -= cost
+
+    def record(self, path, size, peak, stream, pid, rss):
+        """记录子进程带回的测量结果：任务峰值（未抽样时为 None）与该进程的峰值常驻内存"""
+        if pid == os.getpid():
+            # 在本进程（线程池或单个文件）执行的任务：常驻内存已计入主进程，且包含其他任务的占用，不用于校正
+            self._record_peak(path, size, peak, stream)
+            return
+        self.worker_peaks[pid] = max(rss, self.worker_peaks.get(pid, 0))
+        if stream:
+            self._streamed_pids.add(pid)
+        elif size >= MIN_SAMPLE_SIZE:
+            # 常驻内存还包括内存碎片与 mmap 读入的页面，比 tracemalloc 看到的更接近容器实际计入的用量
+            largest = self._worker_sizes[pid] = max(size, self._worker_sizes.get(pid, 0))
+            if pid not in self._streamed_pids:
+                self._calibrate((rss - self.base) / largest)
+        self._record_peak(path, size, peak, stream)
+
+    def _record_peak(self, path, size, peak, stream):
+        if peak is None:
+            return
+        self.samples += 1
+        if self.largest is None or peak > self.largest['peak']:
+            self.largest = {'path': path, 'size': size, 'peak': peak, 'stream': stream}
+        if not stream and size >= MIN_SAMPLE_SIZE:
+            self._calibrate(peak / size)
+
+    def _calibrate(self, ratio):
+        # 第一次测得的值替换默认值，之后只往大调
+        ratio *= SAFETY_FACTOR
+        if ratio > self.ratio or not self._calibrated:
+            self.ratio = ratio
+            self._calibrated = True
+
+    def report(self):
+        """峰值内存报告（字典，单位为字节）"""
+        parent = peak_rss()
+        workers_total = sum(self.worker_peaks.values())
+        return {
+            'max_memory': self.max_memory,
+            'requested_workers': self.requested_workers,
+            'workers': self.workers,
+            'executor': 'thread' if self.threads else 'process',
+            'memory_ratio': round(self.ratio, 3),
+            'tasks': self.tasks,
+            'sampled_tasks': self.samples,
+            'streamed': self.streamed,
+            'largest_task': self.largest,
+            'parent_peak_rss': parent,
+            'worker_peak_rss': {str(pid): rss for pid, rss in sorted(self.worker_peaks.items())},
+            # 各进程峰值之和，是同时占用的上界
+            'total_peak_rss': parent + workers_total,
+            'within_budget': parent + workers_total <= self.max_memory,
+        }
+
+    def write_report(self, path=None):
+        """把报告写到 path（JSON），并在标准错误输出一行摘要"""
+        report = self.report()
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        mb = 1024 * 1024
+        print(f'内存: 峰值合计 {report["total_peak_rss"] / mb:.1f}MB / 预算 {self.max_memory / mb:.1f}MB，'
+              f'{"线程数" if self.threads else "进程数"} {self.workers}，流式转换 {len(self.streamed)} 个文件，抽样 {self.samples} 个任务', file=sys.stderr)
+        return report
+
+
+def add_memory_arguments(parser):
+    """为命令行解析器添加内存预算参数（批量/tar 分片模式共用）"""
+    parser.add_argument('--max-memory', type=int, default=None,
+                        help='内存预算（MB）：据此减少进程数、限制同时执行的任务，放不进预算的超大文件改走流式转换')
+    parser.add_argument('--memory-report', default=None, help='把峰值内存报告写入该 JSON 文件（需要 --max-memory）')
+
+
+def memory_limit_from_args(args, workers=None, allow_stream=True, threads=False):
+    """按 add_memory_arguments 解析出的参数创建 MemoryLimit，未指定 --max-memory 时返回 None"""
+    if not args.max_memory:
+        return None
+    return MemoryLimit(args.max_memory * 1024 * 1024, workers, allow_stream, threads)
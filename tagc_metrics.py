@@ -0,0 +1,282 @@
+# 运行指标：转换次数、输入/输出字节数、各步骤耗时直方图、缓存命中、按类型的错误数与队列深度，
+# 以 OpenMetrics 文本格式导出（HTTP 服务的 /metrics，或批量/守护进程写出的指标文件）。
+#
+# 默认关闭，未启用时热路径上只多一次属性判断。启用后每个线程写自己的计数分片，更新不加锁；
+# 导出时才汇总各分片。进程池中的子进程把本进程的累计值随任务结果带回，主进程按子进程保存最新一份后合并。
+import bisect
+import os
+import threading
+import time
+import weakref
+
+# 耗时直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# 指标名 -> (类型, 说明)
+METRIC_DEFS = {
+    'tagc_conversions': ('counter', '转换次数'),
+    'tagc_input_bytes': ('counter', '转换输入的字节数'),
+    'tagc_output_bytes': ('counter', '转换输出的字节数'),
+    'tagc_stage_seconds': ('histogram', '各处理步骤的耗时（秒）'),
+    'tagc_cache_requests': ('counter', '结果缓存查找次数'),
+    'tagc_errors': ('counter', '按异常类型统计的错误数'),
+    'tagc_queue_depth': ('gauge', '已提交但尚未完成的任务数'),
+}
+
+
+def labels(**kwargs):
+    """构造标签元组；热路径上应预先构造好再传入"""
+    return tuple(sorted(kwargs.items()))
+
+
+class MetricsRegistry:
+    """
+    指标注册表。计数器与仪表按 (指标名, 标签元组) 累加，直方图按桶累加，
+    每个线程一个分片字典，只由所属线程写入。仪表同样按分片累加增量，汇总后即为当前值。
+    线程结束时其分片并入已结束线程的汇总，服务模式下每个连接一个线程也不会让分片越积越多。
+    """
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        # 已结束线程的分片汇总
+        self._retired = {}
+        # 子进程标识 -> 该子进程最近一次带回的累计值
+        self._remote = {}
+        self._token = os.urandom(8).hex()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def _reset_after_fork(self):
+        # fork 出的子进程继承了父进程的计数，清空后只记录本进程自己的部分
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._remote = {}
+        self._token = os.urandom(8).hex()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            # 线程结束时 threading.local 中的对象随之释放，借此把分片并入汇总
+            holder = self._local.holder = _ShardHolder()
+            weakref.finalize(holder, self._retire, shard)
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            # fork 后重置过的注册表不再持有父进程线程的分片
+            if not any(s is shard for s in self._shards):
+                return
+            self._shards = [s for s in self._shards if s is not shard]
+            for key, value in shard.items():
+                _merge_value(self._retired, key, value)
+
+    def inc(self, name, value=1, label_items=()):
+        """计数器或仪表加 value（仪表可传负数）"""
+        shard = self._shard()
+        key = (name, label_items)
+        shard[key] = shard.get(key, 0) + value
+
+    def observe(self, name, value, label_items=()):
+        """直方图记录一个观测值"""
+        shard = self._shard()
+        key = (name, label_items)
+        buckets = shard.get(key)
+        if buckets is None:
+            # 各桶的（非累积）计数，最后一个为 +Inf 桶，其后为观测值总和
+            buckets = shard[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        buckets[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        buckets[-1] += value
+
+    def timer(self, stage):
+        """计时上下文：退出时把耗时记入 tagc_stage_seconds{stage=...}；未启用时不计时"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, labels(stage=stage))
+
+    def local_totals(self):
+        """本进程各线程分片的汇总（不含子进程）"""
+        with self._lock:
+            shards = list(self._shards)
+            totals = {}
+            for key, value in self._retired.items():
+                _merge_value(totals, key, value)
+        for shard in shards:
+            for key, value in list(shard.items()):
+                _merge_value(totals, key, value)
+        return totals
+
+    def snapshot(self):
+        """子进程带回主进程的累计值：(进程标识, 汇总)"""
+        return self._token, self.local_totals()
+
+    def merge_snapshot(self, snapshot):
+        """主进程收到子进程的累计值，替换该子进程之前的一份；线程池任务带回的是本进程自己的累计值，忽略"""
+        if snapshot is not None:
+            token, totals = snapshot
+            if token == self._token:
+                return
+            with self._lock:
+                self._remote[token] = totals
+
+    def totals(self):
+        totals = self.local_totals()
+        with self._lock:
+            remote = list(self._remote.values())
+        for part in remote:
+            for key, value in part.items():
+                _merge_value(totals, key, value)
+        return totals
+
+    def render(self):
+        """按 OpenMetrics 文本格式输出全部指标"""
+        families = {}
+        for (name, label_items), value in self.totals().items():
+            families.setdefault(name, []).append((label_items, value))
+        out = []
+        for name in sorted(families, key=lambda n: (n not in METRIC_DEFS, n)):
+            kind, help_text = METRIC_DEFS.get(name, ('unknown', ''))
+            out.append(f'# TYPE {name} {kind}')
+            if help_text:
+                out.append(f'# HELP {name} {help_text}')
+            for label_items, value in sorted(families[name], key=lambda item: item[0]):
+                if kind == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), value):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        out.append(f'{name}_bucket{_format_labels(label_items + (("le", le),))} {cumulative}')
+                    out.append(f'{name}_sum{_format_labels(label_items)} {value[-1]!r}')
+                    out.append(f'{name}_count{_format_labels(label_items)} {cumulative}')
+                else:
+                    suffix = '_total' if kind == 'counter' else ''
+                    out.append(f'{name}{suffix}{_format_labels(label_items)} {value}')
+        out.append('# EOF')
+        return '\n'.join(out) + '\n'
+
+    def write(self, path):
+        """写出指标文件（先写临时文件再替换，采集程序不会读到写了一半的内容）"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+class _ShardHolder:
+    """放在线程局部存储中的占位对象，线程结束被回收时触发分片合并"""
+    __slots__ = ('__weakref__',)
+
+
+class _StageTimer:
+    __slots__ = ('registry', 'label_items', 'start')
+
+    def __init__(self, registry, label_items):
+        self.registry = registry
+        self.label_items = label_items
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe('tagc_stage_seconds', time.perf_counter() - self.start, self.label_items)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def _merge_value(totals, key, value):
+    if isinstance(value, list):
+        current = totals.get(key)
+        totals[key] = list(value) if current is None else [a + b for a, b in zip(current, value)]
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_items):
+    if not label_items:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in label_items) + '}'
+
+
+# 进程内唯一的注册表
+METRICS = MetricsRegistry()
+
+
+def record_error(error):
+    """按异常类型记录一次错误"""
+    if METRICS.enabled:
+        METRICS.inc('tagc_errors', 1, labels(type=type(error).__name__))
+
+
+def record_io(input_size, output_size):
+    """记录一次转换的输入与输出字节数"""
+    if METRICS.enabled:
+        METRICS.inc('tagc_input_bytes', input_size)
+        METRICS.inc('tagc_output_bytes', output_size)
+
+
+def add_metrics_arguments(parser):
+    """为命令行解析器添加指标文件参数（批量/守护进程共用）"""
+    parser.add_argument('--metrics-file', default=None,
+                        help='启用运行指标并以 OpenMetrics 文本格式写出到该文件（可配合 node_exporter 的 textfile 采集）')
+
+
+class MetricsFileWriter:
+    """
+    后台线程按固定间隔把指标写到文件，停止时再写一次最终结果。
+    Args:
+        path (str): 指标文件路径
+        interval (float): 写出间隔（秒）
+    """
+    def __init__(self, path, interval=15.0):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='tagc-metrics', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            METRICS.write(self.path)
+
+    def start(self):
+        METRICS.enable()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        METRICS.write(self.path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
@@ -0,0 +1,224 @@
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tagc_core import add_executor_arguments, get_pipeline, make_executor, normalize_options, parse_params, resolve_backend
+from tagc_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, METRICS, labels, record_error, record_io
+
+# 小于该长度的文本直接在请求线程内转换，进程间传输的开销比转换本身更大
+INLINE_LIMIT = 4096
+# 请求体上限，防止误传超大文件拖垮服务
+MAX_BODY_SIZE = 64 * 1024 * 1024
+
+_LABELS_SERVER_QUEUE = labels(queue='server')
+
+
+def _convert_many(params, texts, metrics=False):
+    """执行器任务：用常驻的流水线转换一组文本；子进程启用指标时一并带回本进程的累计指标"""
+    pipeline = get_pipeline(**params)
+    if not metrics:
+        return [pipeline(text) for text in texts], None
+    METRICS.enable()
+    return [pipeline(text) for text in texts], METRICS.snapshot()
+
+
+def _warm_up():
+    """进程池初始化：提前导入并构建默认流水线"""
+    get_pipeline(0, normalize_options(None))
+
+
+class TagConverterServer(ThreadingHTTPServer):
+    """
+    本地 JSON HTTP 服务，提供 /convert 与 /convert_batch 两个接口。
+    每个连接一个线程（支持 keep-alive 与请求流水线），较大的转换任务分发到进程池；
+    无 GIL 时（或 backend='thread'）分发到线程池，各线程共用本进程的流水线，请求文本不经序列化。
+    启用指标（tagc_metrics.METRICS.enable()）后 GET /metrics 以 OpenMetrics 文本格式返回运行指标。
+    请求中的 tag_vocab 只能是 vocab_dir 目录下的词表文件名；未指定 vocab_dir 时不允许使用 tag_vocab，
+    防止调用方借此读取服务所在机器上的任意文件。
+    """
+    daemon_threads = True
+
+    def __init__(self, address, workers=None, inline_limit=INLINE_LIMIT, backend=None, vocab_dir=None):
+        super().__init__(address, TagRequestHandler)
+        self.inline_limit = inline_limit
+        self.vocab_dir = os.path.realpath(vocab_dir) if vocab_dir else None
+        self.workers = workers or os.cpu_count() or 1
+        self.backend = resolve_backend(backend)
+        if self.backend == 'thread':
+            _warm_up()
+            self.executor = make_executor(self.workers, 'thread')
+        else:
+            self.executor = make_executor(self.workers, 'process', initializer=_warm_up)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+
+    def resolve_vocab(self, params):
+        """把请求中的 tag_vocab 解析为 vocab_dir 下的绝对路径，越出该目录或文件不存在时抛出 ValueError"""
+        name = params['tag_vocab']
+        if not name:
+            return params
+        if not self.vocab_dir:
+            raise ValueError('服务未指定词表目录（--vocab-dir），不能使用 tag_vocab')
+        path = os.path.realpath(os.path.join(self.vocab_dir, name))
+        if os.path.commonpath([path, self.vocab_dir]) != self.vocab_dir or not os.path.isfile(path):
+            raise ValueError(f'词表目录中没有该文件: {name}')
+        return dict(params, tag_vocab=path)
+
+    def convert(self, params, texts):
+        """转换一组文本，小任务就地处理，大任务按块分发到执行器"""
+        total = sum(len(text) for text in texts)
+        if total <= self.inline_limit:
+            pipeline = get_pipeline(**params)
+            return [pipeline(text) for text in texts]
+        chunks = _split_by_size(texts, max(self.inline_limit, total // self.workers))
+        # 线程池任务直接写本进程的注册表，不需要带回累计值
+        metrics = METRICS.enabled and self.backend == 'process'
+        futures = [self.executor.submit(_convert_many, params, chunk, metrics) for chunk in chunks]
+        results = []
+        for future in futures:
+            chunk_results, snapshot = future.result()
+            results.extend(chunk_results)
+            METRICS.merge_snapshot(snapshot)
+        return results
+
+
+def _split_by_size(texts, chunk_size):
+    """按累计长度把文本列表切成若干块，保持原有顺序"""
+    chunks, current, size = [], [], 0
+    for text in texts:
+        current.append(text)
+        size += len(text)
+        if size >= chunk_size:
+            chunks.append(current)
+            current, size = [], 0
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class TagRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 默认保持连接，同一连接上的多个请求按顺序处理
+    protocol_version = 'HTTP/1.1'
+    server_version = 'TagConverter'
+    # 关闭 Nagle 算法，避免小响应在 keep-alive 连接上被延迟确认拖慢
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok', 'workers': self.server.workers, 'executor': self.server.backend})
+        elif self.path == '/metrics' and METRICS.enabled:
+            self._send_body(200, METRICS.render().encode('utf-8'), METRICS_CONTENT_TYPE)
+        else:
+            self._send_json(404, {'error': f'未知路径: {self.path}'})
+
+    def do_POST(self):
+        if not METRICS.enabled:
+            return self._handle_post()
+        METRICS.inc('tagc_queue_depth', 1, _LABELS_SERVER_QUEUE)
+        try:
+            with METRICS.timer('request'):
+                self._handle_post()
+        finally:
+            METRICS.inc('tagc_queue_depth', -1, _LABELS_SERVER_QUEUE)
+
+    def _handle_post(self):
+        try:
+            payload = self._read_json()
+            params = self.server.resolve_vocab(parse_params(payload))
+            if self.path == '/convert':
+                text = payload.get('text')
+                if not isinstance(text, str):
+                    raise ValueError('text 必须为字符串')
+                result = self.server.convert(params, [text])[0]
+                record_io(self._body_size, self._send_json(200, {'result': result}))
+            elif self.path == '/convert_batch':
+                texts = payload.get('texts')
+                if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                    raise ValueError('texts 必须为字符串列表')
+                results = self.server.convert(params, texts)
+                record_io(self._body_size, self._send_json(200, {'results': results}))
+            else:
+                self._send_json(404, {'error': f'未知路径: {self.path}'})
+        except (ValueError, TypeError) as e:
+            record_error(e)
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            record_error(e)
+            self._send_json(500, {'error': f'处理错误: {e}'})
+
+    def _read_json(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        # 以下几种情况请求体没有（完整）读出，连接上剩余的字节无法再按请求解析，回复后关闭连接
+        if length < 0:
+            self.close_connection = True
+            raise ValueError('Content-Length 无效')
+        if length > MAX_BODY_SIZE:
+            self.close_connection = True
+            raise ValueError('请求体过大')
+        body = self.rfile.read(length)
+        self._body_size = len(body)
+        if len(body) < length:
+            self.close_connection = True
+            raise ValueError('请求体不完整')
+        try:
+            payload = json.loads(body or b'{}')
+        except json.JSONDecodeError as e:
+            raise ValueError(f'JSON解析失败: {e}')
+        if not isinstance(payload, dict):
+            raise ValueError('请求体必须为JSON对象')
+        return payload
+
+    def _send_json(self, status, data):
+        return self._send_body(status, json.dumps(data, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+
+    def _send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def log_message(self, format, *args):
+        # 高并发下逐条打印访问日志会显著拖慢服务
+        pass
+
+
+def serve(host='127.0.0.1', port=8765, workers=None, inline_limit=INLINE_LIMIT, metrics=False, backend=None, vocab_dir=None):
+    """启动服务并阻塞运行，Ctrl+C 退出；metrics 为真时提供 GET /metrics"""
+    if metrics:
+        METRICS.enable()
+    server = TagConverterServer((host, port), workers, inline_limit, backend, vocab_dir)
+    kind = '线程数' if server.backend == 'thread' else '进程数'
+    print(f'Tag转换服务已启动: http://{host}:{port} ({kind} {server.workers})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Tag转换器本地HTTP服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口')
+    parser.add_argument('--workers', type=int, default=None, help='进程池（线程池）大小，默认为CPU核数')
+    parser.add_argument('--inline-limit', type=int, default=INLINE_LIMIT, help='小于该字符数的请求直接在线程内转换')
+    parser.add_argument('--metrics', action='store_true', help='记录运行指标，GET /metrics 以 OpenMetrics 文本格式返回')
+    parser.add_argument('--vocab-dir', default=None, help='请求中的 tag_vocab 为该目录下的词表文件名；不指定时不允许使用 tag_vocab')
+    add_executor_arguments(parser)
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, args.workers, args.inline_limit, args.metrics, args.executor, args.vocab_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+# 可分片、可断点续跑的批量转换。
+# 同一作业目录下先生成确定的文件清单（manifest.jsonl），各机器只处理清单的第 k/N 片，
+# 每完成一个文件就在本分片的检查点日志（只追加）里按文件路径记一行，中断后重新运行会跳过任一分片日志中已完成的文件，
+# 因此续跑时也可以改用不同的分片数 N；
+# 全部分片跑完后用 --merge 汇总各分片日志，核对清单中的每个文件都已成功转换。
+import glob
+import json
+import os
+import sys
+
+from tagc_batch import DEFAULT_SUFFIX, iter_source_files, output_path_for, run_batch
+from tagc_cache import add_cache_arguments, cache_from_args
+from tagc_core import add_pipeline_arguments, params_from_args
+
+MANIFEST_FILE = 'manifest.jsonl'
+MANIFEST_VERSION = 1
+
+
+def parse_shard(value):
+    """解析 'k/N' 形式的分片参数（k 从 0 开始），返回 (k, N)"""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f"分片格式应为 k/N: {value}") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"分片序号超出范围: {value}")
+    return index, count
+
+
+def _to_rel(path, root):
+    return os.path.relpath(path, root).replace(os.sep, '/')
+
+
+def _from_rel(rel, root):
+    return os.path.join(root, *rel.split('/'))
+
+
+def build_manifest(root, suffix=DEFAULT_SUFFIX, out_dir=None):
+    """列出目录下需要转换的文件，返回按相对路径排序的 [{"path": 相对路径, "size": 字节数}, ...]"""
+    entries = [{'path': _to_rel(path, root), 'size': os.path.getsize(path)}
+               for path in iter_source_files(root, suffix, out_dir)]
+    entries.sort(key=lambda entry: entry['path'])
+    return entries
+
+
+def write_manifest(path, params, entries):
+    """写出清单：首行为作业信息（含转换参数），其后每行一个文件。先写临时文件再替换"""
+    header = {'version': MANIFEST_VERSION, 'params': _params_to_json(params), 'count': len(entries)}
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(header, ensure_ascii=False) + '\n')
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    os.replace(tmp_path, path)
+
+
+def read_manifest(path):
+    """读取清单，返回 (作业信息, 文件列表)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header.get('version') != MANIFEST_VERSION:
+            raise ValueError(f"不支持的清单版本: {header.get('version')}")
+        entries = [json.loads(line) for line in f if line.strip()]
+    if len(entries) != header['count']:
+        raise ValueError(f"清单不完整: 应有 {header['count']} 项，实际 {len(entries)} 项")
+    return header, entries
+
+
+def _params_to_json(params):
+    return dict(params, options=list(params['options']))
+
+
+def load_or_create_manifest(job_dir, root, params, suffix=DEFAULT_SUFFIX, out_dir=None):
+    """
+    获取作业清单：作业目录中已有清单时直接使用（并检查转换参数一致），否则扫描目录生成。
+    多台机器同时生成时内容相同，后替换者覆盖先写入者不影响结果。
+    """
+    os.makedirs(job_dir, exist_ok=True)
+    path = os.path.join(job_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        write_manifest(path, params, build_manifest(root, suffix, out_dir))
+    header, entries = read_manifest(path)
+    if header['params'] != _params_to_json(params):
+        raise ValueError(f"转换参数与清单中记录的不一致: {header['params']}")
+    return entries
+
+
+def shard_entries(entries, index, count):
+    """按清单顺序轮流分配，第 index 片取下标模 count 等于 index 的文件"""
+    return entries[index::count]
+
+
+def checkpoint_path(job_dir, index, count):
+    return os.path.join(job_dir, f'shard-{index}-of-{count}.log')
+
+
+def read_checkpoint(path):
+    """
+    读取检查点日志，返回 {相对路径: 错误信息}，成功的文件错误信息为 None。
+    同一文件出现多次时以最后一次为准；崩溃时写了一半的末行直接忽略。
+    """
+    status = {}
+    try:
+        f = open(path, 'r', encoding='utf-8')
+    except FileNotFoundError:
+        return status
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            status[record['path']] = record.get('error')
+    return status
+
+
+def read_checkpoints(job_dir):
+    """
+    汇总作业目录中所有分片（含不同分片数的历次运行）的检查点，返回 {相对路径: 错误信息}；
+    同一文件只要有一次成功即视为完成。
+    """
+    status = {}
+    for log_path in sorted(glob.glob(os.path.join(job_dir, 'shard-*-of-*.log'))):
+        for rel, error in read_checkpoint(log_path).items():
+            if status.get(rel, 'missing') is not None:
+                status[rel] = error
+    return status
+
+
+class CheckpointLog:
+    """只追加的检查点日志，每条记录写完立即 flush，进程崩溃时最多丢失正在写的一行"""
+    def __init__(self, path):
+        self.f = open(path, 'ab+')
+        # 上次崩溃留下不完整的末行时先补换行，避免和新记录粘在一起
+        size = self.f.seek(0, os.SEEK_END)
+        if size > 0:
+            self.f.seek(size - 1)
+            if self.f.read(1) != b'\n':
+                self.f.write(b'\n')
+
+    def record(self, rel, error=None):
+        record = {'path': rel, 'error': error} if error else {'path': rel}
+        self.f.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.f.flush()
+
+    def close(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_shard(job_dir, root, params, index=0, count=1, out_dir=None, suffix=DEFAULT_SUFFIX, workers=None, cache=None, on_result=None):
+    """
+    转换清单的第 index/count 片，跳过任一分片检查点中已成功的文件（失败的文件会重试），
+    因此中断后可以换一个分片数 count 续跑。
+    Returns:
+        tuple: (本次转换的文件数, 失败数, 因已完成而跳过的文件数)
+    """
+    entries = shard_entries(load_or_create_manifest(job_dir, root, params, suffix, out_dir), index, count)
+    log_path = checkpoint_path(job_dir, index, count)
+    status = read_checkpoints(job_dir)
+    todo = [entry['path'] for entry in entries if entry['path'] not in status or status[entry['path']] is not None]
+    done = failed = 0
+    with CheckpointLog(log_path) as log:
+        paths = (_from_rel(rel, root) for rel in todo)
+        for path, out_path, error in run_batch(paths, params, root, out_dir, suffix, workers, cache=cache):
+            log.record(_to_rel(path, root), error)
+            done += 1
+            if error:
+                failed += 1
+            if on_result:
+                on_result(path, out_path, error)
+    return done, failed, len(entries) - len(todo)
+
+
+def merge_shards(job_dir, root, out_dir=None, suffix=DEFAULT_SUFFIX):
+    """
+    汇总作业目录中所有分片的检查点，核对清单中每个文件都已成功转换且结果文件存在。
+    Returns:
+        dict: {'total': 清单文件数, 'missing': [未处理的相对路径], 'failed': {相对路径: 错误信息}, 'no_output': [结果文件缺失的相对路径]}
+    """
+    header, entries = read_manifest(os.path.join(job_dir, MANIFEST_FILE))
+    status = read_checkpoints(job_dir)
+    report = {'total': len(entries), 'missing': [], 'failed': {}, 'no_output': []}
+    for entry in entries:
+        rel = entry['path']
+        if rel not in status:
+            report['missing'].append(rel)
+        elif status[rel] is not None:
+            report['failed'][rel] = status[rel]
+        elif not os.path.exists(output_path_for(_from_rel(rel, root), root, out_dir, suffix)):
+            report['no_output'].append(rel)
+    return report
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Tag转换器分片批量模式：按清单分片转换目录，支持断点续跑与完成度核对')
+    parser.add_argument('root', help='要转换的目录')
+    parser.add_argument('--job-dir', required=True, help='作业目录，存放清单与各分片的检查点日志（多机运行时放在共享存储上）')
+    parser.add_argument('--shard', default='0/1', help='本机处理的分片 k/N（k 从 0 开始）；已完成的文件按路径记录，续跑时可以改用不同的 N')
+    parser.add_argument('--merge', action='store_true', help='不转换，汇总所有分片的检查点并核对是否全部完成')
+    parser.add_argument('--out-dir', default=None, help='输出目录，省略时在源文件旁写出结果文件')
+    parser.add_argument('--suffix', default=DEFAULT_SUFFIX, help='旁路结果文件后缀')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认为CPU核数')
+    add_pipeline_arguments(parser)
+    add_cache_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.merge:
+        report = merge_shards(args.job_dir, args.root, args.out_dir, args.suffix)
+        for rel in report['missing']:
+            print(f'未处理 {rel}', file=sys.stderr)
+        for rel, error in report['failed'].items():
+            print(f'转换失败 {rel}: {error}', file=sys.stderr)
+        for rel in report['no_output']:
+            print(f'结果文件缺失 {rel}', file=sys.stderr)
+        incomplete = len(report['missing']) + len(report['failed']) + len(report['no_output'])
+        print(f"共 {report['total']} 个文件，完成 {report['total'] - incomplete} 个，未完成 {incomplete} 个")
+        return 1 if incomplete else 0
+    try:
+        index, count = parse_shard(args.shard)
+    except ValueError as e:
+        parser.error(str(e))
+
+    def report_error(path, out_path, error):
+        if error:
+            print(f'转换失败 {path}: {error}', file=sys.stderr)
+
+    cache = cache_from_args(args)
+    try:
+        done, failed, skipped = run_shard(args.job_dir, args.root, params_from_args(args), index, count,
+                                          args.out_dir, args.suffix, args.workers, cache, report_error)
+    except ValueError as e:
+        print(f'无法运行分片: {e}', file=sys.stderr)
+        return 2
+    if cache is not None:
+        cache.evict()
+    print(f'分片 {index}/{count}：本次转换 {done} 个（失败 {failed} 个），已完成跳过 {skipped} 个')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,398 @@
+# 语料统计：标签频次、各标签的权重分布、每条标注的标签数与含中文行的占比，用于调整 weight_limit、屏蔽词与短行阈值。
+# 标签解析与转换流水线共用 parse_tags；不同标签数在上限内时精确计数，超出后改用 Count-Min sketch 加 top-k 堆。
+# 上限按不同标签的个数而不是字节数计：精确模式的内存随不同标签数（及标签长度）增长，转为 sketch 后才有固定上界。
+# 统计结果可序列化为 JSON 并合并，多进程各自统计一部分输入后在主进程汇总。
+import hashlib
+import heapq
+import json
+import os
+import sys
+import tarfile
+from collections import Counter
+
+from tagc_batch import iter_source_files, read_source
+from tagc_core import add_executor_arguments, add_pipeline_arguments, get_pipeline, has_cjk, make_executor, params_from_args, parse_tags
+from tagc_tar import CAPTION_EXTS, is_shard_file
+from tagc_weights import DEFAULT_WEIGHT_MODEL
+
+STATS_VERSION = 1
+# 精确计数的不同标签数上限（个数而非字节数），超出后转为 sketch
+DEFAULT_MAX_EXACT_TAGS = 1000000
+DEFAULT_TOP_K = 1000
+DEFAULT_SKETCH_WIDTH = 1 << 16
+DEFAULT_SKETCH_DEPTH = 4
+# 权重直方图的分桶宽度
+WEIGHT_BUCKET = 0.05
+# 每个子进程任务处理的输入数
+BATCH_SIZE = 256
+
+
+def weight_bucket(weight):
+    """权重所在直方图分桶的键（分桶中心，保留两位小数）"""
+    return f'{round(weight / WEIGHT_BUCKET) * WEIGHT_BUCKET:.2f}'
+
+
+def _bucket_order(item):
+    # 分桶键是字符串，按数值排序，否则 '10.00' 会排在 '2.00' 前
+    return float(item[0])
+
+
+class CountMinSketch:
+    """
+    Count-Min sketch：depth 行、每行 width 个计数器，估计值只会偏大不会偏小。
+    每个键只算一次 blake2b，各行下标由两个 32 位哈希线性组合得出。
+    """
+    def __init__(self, width=DEFAULT_SKETCH_WIDTH, depth=DEFAULT_SKETCH_DEPTH, table=None):
+        self.width = width
+        self.depth = depth
+        self.table = table if table is not None else [[0] * width for _ in range(depth)]
+
+    def _indexes(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        h1 = int.from_bytes(digest[:4], 'little')
+        h2 = int.from_bytes(digest[4:], 'little') | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, key, count=1):
+        """增加计数并返回新的估计值"""
+        estimate = None
+        for row, index in zip(self.table, self._indexes(key)):
+            row[index] += count
+            estimate = row[index] if estimate is None else min(estimate, row[index])
+        return estimate
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.table, self._indexes(key)))
+
+    def merge(self, other):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError('sketch 尺寸不同，不能合并')
+        for row, other_row in zip(self.table, other.table):
+            for i, value in enumerate(other_row):
+                if value:
+                    row[i] += value
+
+
+class TagStats:
+    """
+    可合并的流式语料统计。
+    Args:
+        weight_model (str): 解析括号权重使用的模型
+        max_exact_tags (int): 精确计数的不同标签数上限，超出后转为 sketch 模式；按个数计，不限制字节数
+        top_k (int): sketch 模式下保留的高频标签数，也是输出的标签数
+        sketch_width, sketch_depth (int): Count-Min sketch 的尺寸，合并的统计必须相同
+    """
+    def __init__(self, weight_model=DEFAULT_WEIGHT_MODEL, max_exact_tags=DEFAULT_MAX_EXACT_TAGS, top_k=DEFAULT_TOP_K,
+                 sketch_width=DEFAULT_SKETCH_WIDTH, sketch_depth=DEFAULT_SKETCH_DEPTH):
+        self.weight_model = weight_model
+        self.max_exact_tags = max_exact_tags
+        self.top_k = top_k
+        self.sketch_width = sketch_width
+        self.sketch_depth = sketch_depth
+        self.captions = 0
+        self.lines = 0
+        self.cjk_lines = 0
+        self.tag_total = 0
+        self.tags_per_caption = Counter()
+        # 精确模式：tag -> 次数；sketch 模式下为 top-k 候选 tag -> 估计次数
+        self.counts = {}
+        # tag -> Counter(权重分桶 -> 次数)，sketch 模式下只保留 top-k 候选的直方图
+        self.weights = {}
+        self.sketch = None
+        # sketch 模式的最小堆，元素 (次数, tag)；次数与 counts 不一致的是过期元素，弹出时跳过
+        self._heap = []
+        # 读取失败而跳过的输入：[来源, 错误信息]
+        self.errors = []
+
+    @property
+    def exact(self):
+        return self.sketch is None
+
+    def add_caption(self, text):
+        """统计一条标注"""
+        self.captions += 1
+        for line in text.splitlines():
+            if line.strip():
+                self.lines += 1
+                if has_cjk(line):
+                    self.cjk_lines += 1
+        tags = parse_tags(text, self.weight_model)
+        self.tags_per_caption[len(tags)] += 1
+        self.tag_total += len(tags)
+        for tag, weight in tags:
+            self._add_tag(tag, weight)
+
+    def _add_tag(self, tag, weight, count=1, histogram=None):
+        if self.sketch is None:
+            self.counts[tag] = self.counts.get(tag, 0) + count
+            if len(self.counts) > self.max_exact_tags:
+                self._to_sketch()
+        else:
+            estimate = self.sketch.add(tag, count)
+            if tag not in self.counts:
+                if len(self.counts) >= self.top_k and estimate <= self._heap_min():
+                    return
+                if len(self.counts) >= self.top_k:
+                    self._evict()
+            self.counts[tag] = estimate
+            heapq.heappush(self._heap, (estimate, tag))
+            if len(self._heap) > 4 * self.top_k:
+                self._heap = [(c, t) for t, c in self.counts.items()]
+                heapq.heapify(self._heap)
+        hist = self.weights.get(tag)
+        if hist is None:
+            hist = self.weights[tag] = Counter()
+        if histogram is None:
+            hist[weight_bucket(weight)] += count
+        else:
+            hist.update(histogram)
+
+    def _heap_min(self):
+        heap, counts = self._heap, self.counts
+        while heap and counts.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else 0
+
+    def _evict(self):
+        self._heap_min()
+        count, tag = heapq.heappop(self._heap)
+        del self.counts[tag]
+        self.weights.pop(tag, None)
+
+    def _to_sketch(self):
+        """转为 sketch 模式：精确计数写入 sketch，只保留最高频的 top_k 个标签及其直方图"""
+        self.sketch = CountMinSketch(self.sketch_width, self.sketch_depth)
+        for tag, count in self.counts.items():
+            self.sketch.add(tag, count)
+        top = heapq.nlargest(self.top_k, self.counts.items(), key=lambda item: item[1])
+        self.counts = {tag: self.sketch.estimate(tag) for tag, count in top}
+        self.weights = {tag: self.weights[tag] for tag in self.counts if tag in self.weights}
+        self._heap = [(count, tag) for tag, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def merge(self, other):
+        """合并另一份统计（参数需相同），返回 self"""
+        self.captions += other.captions
+        self.lines += other.lines
+        self.cjk_lines += other.cjk_lines
+        self.tag_total += other.tag_total
+        self.tags_per_caption.update(other.tags_per_caption)
+        self.errors.extend(other.errors)
+        if self.exact and other.exact:
+            for tag, count in other.counts.items():
+                self._add_tag(tag, None, count, other.weights.get(tag))
+            return self
+        if self.exact:
+            self._to_sketch()
+        self.sketch.merge(other.sketch if other.sketch is not None else _sketch_of(other))
+        # 两边的候选与直方图取并集，再按合并后 sketch 的估计值重新选出 top-k
+        weights = {}
+        for source in (self.weights, other.weights):
+            for tag, hist in source.items():
+                weights.setdefault(tag, Counter()).update(hist)
+        candidates = set(self.counts) | set(other.counts)
+        top = heapq.nlargest(self.top_k, ((self.sketch.estimate(tag), tag) for tag in candidates))
+        self.counts = {tag: count for count, tag in top}
+        self.weights = {tag: weights[tag] for tag in self.counts if tag in weights}
+        self._heap = [(count, tag) for tag, count in self.counts.items()]
+        heapq.heapify(self._heap)
+        return self
+
+    def top_tags(self, limit=None):
+        """按次数从高到低返回 [(tag, 次数), ...]；sketch 模式下次数为估计值（可能偏大）"""
+        limit = self.top_k if limit is None else limit
+        return heapq.nlargest(limit, self.counts.items(), key=lambda item: item[1])
+
+    def report(self, limit=None):
+        """可读的汇总结果（dict，可直接 json.dumps）"""
+        return {
+            'mode': 'exact' if self.exact else 'sketch',
+            'captions': self.captions,
+            'lines': self.lines,
+            'cjk_lines': self.cjk_lines,
+            'cjk_line_share': self.cjk_lines / self.lines if self.lines else 0.0,
+            'tags': self.tag_total,
+            'distinct_tags': len(self.counts) if self.exact else None,
+            'failed_sources': len(self.errors),
+            'tags_per_caption': {str(n): c for n, c in sorted(self.tags_per_caption.items())},
+            'top_tags': [{'tag': tag, 'count': count, 'weights': dict(sorted(self.weights.get(tag, {}).items(), key=_bucket_order))}
+                         for tag, count in self.top_tags(limit)],
+        }
+
+    def to_dict(self):
+        """完整的可合并状态（含精确计数或 sketch 计数表），用于保存部分结果后再合并"""
+        return {
+            'version': STATS_VERSION,
+            'weight_model': self.weight_model,
+            'max_exact_tags': self.max_exact_tags,
+            'top_k': self.top_k,
+            'sketch_width': self.sketch_width,
+            'sketch_depth': self.sketch_depth,
+            'captions': self.captions,
+            'lines': self.lines,
+            'cjk_lines': self.cjk_lines,
+            'tags': self.tag_total,
+            'tags_per_caption': {str(n): c for n, c in self.tags_per_caption.items()},
+            'counts': self.counts,
+            'weights': {tag: dict(hist) for tag, hist in self.weights.items()},
+            'sketch': self.sketch.table if self.sketch is not None else None,
+            'errors': self.errors,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != STATS_VERSION:
+            raise ValueError(f"不支持的统计结果版本: {data.get('version')}")
+        stats = cls(data['weight_model'], data['max_exact_tags'], data['top_k'], data['sketch_width'], data['sketch_depth'])
+        stats.captions = data['captions']
+        stats.lines = data['lines']
+        stats.cjk_lines = data['cjk_lines']
+        stats.tag_total = data['tags']
+        stats.tags_per_caption = Counter({int(n): c for n, c in data['tags_per_caption'].items()})
+        stats.counts = dict(data['counts'])
+        stats.weights = {tag: Counter(hist) for tag, hist in data['weights'].items()}
+        stats.errors = [list(error) for error in data.get('errors', [])]
+        if data['sketch'] is not None:
+            stats.sketch = CountMinSketch(stats.sketch_width, stats.sketch_depth, data['sketch'])
+            stats._heap = [(count, tag) for tag, count in stats.counts.items()]
+            heapq.heapify(stats._heap)
+        return stats
+
+
+def _sketch_of(stats):
+    sketch = CountMinSketch(stats.sketch_width, stats.sketch_depth)
+    for tag, count in stats.counts.items():
+        sketch.add(tag, count)
+    return sketch
+
+
+def iter_captions(source, caption_exts=CAPTION_EXTS, line_captions=False, image_field=None, errors=None):
+    """
+    逐条产出输入源中的标注文本：tar 分片中的标注成员、.txt 文件、图片元数据中的提示词，'-' 为标准输入。
+    line_captions 为真时每个非空行视为一条标注（适合一行一个提示词的大列表）。
+    errors 为列表时，tar 分片中无法按 UTF-8 解码的成员记入 [来源, 错误信息] 后跳过，否则抛出异常。
+    """
+    if source == '-':
+        texts = [sys.stdin.read()]
+    elif is_shard_file(source):
+        texts = _iter_shard_captions(source, caption_exts, errors)
+    else:
+        texts = [read_source(source, image_field)]
+    for text in texts:
+        if line_captions:
+            yield from (line for line in text.splitlines() if line.strip())
+        else:
+            yield text
+
+
+def _iter_shard_captions(path, caption_exts, errors=None):
+    with tarfile.open(path, 'r|*') as tar:
+        for member in tar:
+            if member.isfile() and member.name.lower().endswith(caption_exts):
+                try:
+                    text = tar.extractfile(member).read().decode('utf-8')
+                except UnicodeDecodeError as e:
+                    if errors is None:
+                        raise
+                    errors.append([f'{path}:{member.name}', f'{type(e).__name__}: {e}'])
+                    continue
+                yield text
+
+
+def collect_stats(sources, stats_args, params=None, caption_exts=CAPTION_EXTS, line_captions=False, image_field=None):
+    """
+    统计一组输入源，返回 TagStats。无法读取或解码的输入记入 TagStats.errors 后跳过，不中断统计。
+    Args:
+        stats_args (dict): TagStats 的关键字参数
+        params (dict): 指定时先用转换流水线转换再统计，为 None 时统计原文
+    """
+    stats = TagStats(**stats_args)
+    pipeline = get_pipeline(**params) if params is not None else None
+    for source in sources:
+        try:
+            for text in iter_captions(source, caption_exts, line_captions, image_field, stats.errors):
+                stats.add_caption(pipeline(text) if pipeline is not None else text)
+        except (OSError, ValueError, tarfile.TarError) as e:
+            # tar 分片读到一半出错时，已读出的标注仍计入统计
+            stats.errors.append([source, f'{type(e).__name__}: {e}'])
+    return stats
+
+
+def _stats_task(args):
+    return collect_stats(*args)
+
+
+def run_stats(sources, stats_args, params=None, caption_exts=CAPTION_EXTS, line_captions=False, image_field=None, workers=None, backend=None):
+    """用进程池（无 GIL 时为线程池，见 tagc_core.make_executor）分批统计，各批的部分结果在主进程合并"""
+    stats = TagStats(**stats_args)
+    local = [source for source in sources if source == '-']
+    batches = [source for source in sources if source != '-']
+    batches = [batches[i:i + BATCH_SIZE] for i in range(0, len(batches), BATCH_SIZE)]
+    if local:
+        stats.merge(collect_stats(local, stats_args, params, caption_exts, line_captions, image_field))
+    if batches:
+        with make_executor(workers, backend) as pool:
+            tasks = ((batch, stats_args, params, caption_exts, line_captions, image_field) for batch in batches)
+            for partial in pool.map(_stats_task, tasks):
+                stats.merge(partial)
+    return stats
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Tag转换器统计模式：标签频次、权重分布、每条标签数与中文行占比，输出 JSON')
+    parser.add_argument('sources', nargs='*', help="目录、.txt/图片文件、tar 分片，'-' 为标准输入")
+    parser.add_argument('--merge', nargs='+', default=None, metavar='PARTIAL', help='不读取输入，合并 --partial 保存的部分结果')
+    parser.add_argument('--partial', action='store_true', help='输出可再合并的完整状态，而不是汇总结果')
+    parser.add_argument('--output', default=None, help='结果 JSON 文件，省略时输出到标准输出')
+    parser.add_argument('--convert', action='store_true', help='先按转换参数转换再统计（默认统计原文）')
+    parser.add_argument('--line-captions', action='store_true', help='每个非空行视为一条标注')
+    parser.add_argument('--caption-ext', default=','.join(CAPTION_EXTS), help='tar 分片中视为标注文本的成员扩展名，逗号分隔')
+    parser.add_argument('--image-field', choices=('positive', 'negative'), default=None, help='图片只统计正向或反向提示词')
+    parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K, help='输出（及 sketch 模式下保留）的高频标签数')
+    parser.add_argument('--max-exact-tags', type=int, default=DEFAULT_MAX_EXACT_TAGS, help='精确计数的不同标签数上限（按个数，不是字节数），超出后改用 Count-Min sketch')
+    parser.add_argument('--workers', type=int, default=None, help='进程数（线程数），默认为CPU核数')
+    add_pipeline_arguments(parser)
+    add_executor_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.merge:
+        stats = None
+        try:
+            for path in args.merge:
+                with open(path, 'r', encoding='utf-8') as f:
+                    partial = TagStats.from_dict(json.load(f))
+                stats = partial if stats is None else stats.merge(partial)
+        except ValueError as e:
+            print(f'无法合并 {path}: {e}', file=sys.stderr)
+            return 2
+    elif args.sources:
+        params = params_from_args(args)
+        stats_args = {'weight_model': params['weight_model'], 'max_exact_tags': args.max_exact_tags, 'top_k': args.top_k}
+        caption_exts = tuple(ext.strip() if ext.strip().startswith('.') else '.' + ext.strip()
+                             for ext in args.caption_ext.split(',') if ext.strip())
+        sources = []
+        for target in args.sources:
+            if os.path.isdir(target):
+                sources.extend(iter_source_files(target))
+                sources.extend(os.path.join(dirpath, name) for dirpath, dirnames, filenames in os.walk(target)
+                               for name in sorted(filenames) if is_shard_file(name))
+            else:
+                sources.append(target)
+        stats = run_stats(sources, stats_args, params if args.convert else None, caption_exts,
+                          args.line_captions, args.image_field, args.workers, args.executor)
+    else:
+        parser.error('需要指定输入或 --merge')
+    for source, error in stats.errors:
+        print(f'读取失败 {source}: {error}', file=sys.stderr)
+    result = stats.to_dict() if args.partial else stats.report(args.top_k)
+    text = json.dumps(result, ensure_ascii=False, indent=None if args.partial else 2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if stats.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
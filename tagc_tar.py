@@ -0,0 +1,233 @@
+# WebDataset 等 tar 分片的流式转换。
+# 按顺序读取分片中的成员，标注文本（默认 .txt）转换后写入新分片，图片等其他成员原样复制，
+# 全程不解压到磁盘；多个分片由进程池并行处理。
+import codecs
+import io
+import os
+import sys
+import tarfile
+import tempfile
+
+from tagc_batch import convert_text
+from tagc_cache import add_cache_arguments, cache_from_args, cached_convert
+from tagc_core import (STREAM_CHUNK_SIZE, add_executor_arguments, add_pipeline_arguments, convert_stream, get_pipeline, make_executor,
+                       params_from_args, resolve_backend)
+from tagc_memory import add_memory_arguments, memory_limit_from_args, peak_rss
+
+CAPTION_EXTS = ('.txt',)
+# 分片文件扩展名 -> 写出时使用的流式模式，保持与输入相同的压缩方式
+_WRITE_MODES = (
+    ('.tar.gz', 'w|gz'),
+    ('.tgz', 'w|gz'),
+    ('.tar.bz2', 'w|bz2'),
+    ('.tar.xz', 'w|xz'),
+    ('.tar', 'w|'),
+)
+
+
+def is_shard_file(path):
+    """判断是否为支持的 tar 分片"""
+    name = path.lower()
+    return any(name.endswith(ext) for ext, mode in _WRITE_MODES)
+
+
+def _write_mode(path):
+    name = path.lower()
+    for ext, mode in _WRITE_MODES:
+        if name.endswith(ext):
+            return mode
+    return 'w|'
+
+
+def iter_shard_files(targets):
+    """展开命令行给出的分片文件与目录（目录下按文件名顺序递归查找）"""
+    for target in targets:
+        if not os.path.isdir(target):
+            yield target
+            continue
+        for dirpath, dirnames, filenames in os.walk(target):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if is_shard_file(name):
+                    yield os.path.join(dirpath, name)
+
+
+class _Utf8Reader:
+    """按 read(size) 增量解码成员流（流式读取的 tar 成员不支持 seekable，不能直接套 TextIOWrapper）"""
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def read(self, size):
+        while True:
+            data = self.fileobj.read(size)
+            text = self.decoder.decode(data, final=not data)
+            # 读到的字节恰好都是未完成的多字节字符时继续读，空串只表示结束
+            if text or not data:
+                return text
+
+
+def _stream_member(fileobj, params):
+    """逐段转换一个超大标注成员，结果写入临时文件（addfile 需要预先知道成员大小），返回 (临时文件, 结果大小)"""
+    tmp = tempfile.TemporaryFile()
+    writer = io.TextIOWrapper(tmp, encoding='utf-8', newline='')
+    try:
+        convert_stream(get_pipeline(**params), _Utf8Reader(fileobj), writer.write)
+        writer.flush()
+    except BaseException:
+        tmp.close()
+        raise
+    finally:
+        # 只解除包装，不关闭底层的临时文件
+        writer.detach()
+    size = tmp.tell()
+    tmp.seek(0)
+    return tmp, size
+
+
+def convert_shard(src_path, dst_path, params, caption_exts=CAPTION_EXTS, cache=None, stream_over=None, streamed=None):
+    """
+    流式转换一个 tar 分片：标注成员转换后写入 dst_path，其余成员原样复制，成员顺序不变。
+    Args:
+        src_path (str): 源分片，压缩方式自动识别
+        dst_path (str): 结果分片，按扩展名选择压缩方式；先写临时文件再替换
+        params (dict): get_pipeline 关键字参数
+        caption_exts (tuple): 视为标注文本的成员扩展名
+        cache (ResultCache): 结果缓存，按标注内容查找
+        stream_over (int): 大于该字节数的标注成员不整体读入，逐段转换（不使用缓存），None 为不限
+        streamed (list): 逐段转换的成员名追加到该列表
+    Returns:
+        int: 转换的标注数量
+    """
+    caption_exts = tuple(ext.lower() for ext in caption_exts)
+    converted = 0
+    tmp_path = dst_path + '.tmp'
+    try:
+        with tarfile.open(src_path, 'r|*') as src, tarfile.open(tmp_path, _write_mode(dst_path)) as dst:
+            for member in src:
+                if not member.isfile():
+                    dst.addfile(member)
+                    continue
+                fileobj = src.extractfile(member)
+                if not member.name.lower().endswith(caption_exts):
+                    # 图片等成员直接从输入流复制到输出流，不整块读入
+                    dst.addfile(member, fileobj)
+                    continue
+                if stream_over is not None and member.size > stream_over:
+                    try:
+                        tmp, member.size = _stream_member(fileobj, params)
+                    except Exception as e:
+                        raise ValueError(f'{member.name}: {type(e).__name__}: {e}') from e
+                    member.pax_headers.pop('size', None)
+                    with tmp:
+                        dst.addfile(member, tmp)
+                    if streamed is not None:
+                        streamed.append(member.name)
+                    converted += 1
+                    continue
+                data = fileobj.read()
+                try:
+                    result = cached_convert(cache, params, data, lambda: convert_text(data, params))
+                except Exception as e:
+                    raise ValueError(f'{member.name}: {type(e).__name__}: {e}') from e
+                member.size = len(result)
+                member.pax_headers.pop('size', None)
+                dst.addfile(member, io.BytesIO(result))
+                converted += 1
+        os.replace(tmp_path, dst_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return converted
+
+
+def _convert_shard_task(args):
+    src_path, dst_path, params, caption_exts, cache, stream_over = args
+    streamed = []
+    try:
+        converted = convert_shard(src_path, dst_path, params, caption_exts, cache, stream_over, streamed)
+        return src_path, dst_path, converted, None, streamed, os.getpid(), peak_rss()
+    except Exception as e:
+        return src_path, None, 0, f'{type(e).__name__}: {e}', streamed, os.getpid(), peak_rss()
+
+
+def output_paths_for(shards, out_dir):
+    """按各分片相对于共同上级目录的路径计算结果分片路径"""
+    if not shards:
+        return []
+    paths = [os.path.abspath(path) for path in shards]
+    root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    return [os.path.join(out_dir, os.path.relpath(path, root)) for path in paths]
+
+
+def run_shards(shards, params, out_dir, caption_exts=CAPTION_EXTS, workers=None, cache=None, memory=None, backend=None):
+    """
+    用进程池（无 GIL 时为线程池，见 tagc_core.make_executor）并行转换多个分片，按输入顺序逐个产出 (源分片, 结果分片, 转换的标注数, 错误信息)。
+    结果分片按各分片相对于它们共同上级目录的路径写入 out_dir（只有一个目录时即为相同文件名），
+    不同目录下的同名分片不会写到同一个结果文件。
+    指定 memory（tagc_memory.MemoryLimit）时进程数取 memory.workers，每个进程同时只转换一条标注，
+    较大的标注成员改走逐段转换；各进程的峰值常驻内存记入 memory。
+    """
+    stream_over = None
+    if memory is not None:
+        workers = memory.workers
+        # tar 成员没有逐个抽样校正放大倍数，因此超过一段流式转换长度的标注一律逐段转换，峰值不会超过流式转换本身
+        stream_over = min(STREAM_CHUNK_SIZE, memory.capacity // memory.workers // max(1, int(memory.ratio)))
+    shards = list(shards)
+    tasks = [(path, dst_path, params, caption_exts, cache, stream_over) for path, dst_path in zip(shards, output_paths_for(shards, out_dir))]
+    seen = {}
+    for task in tasks:
+        if os.path.abspath(task[0]) == os.path.abspath(task[1]):
+            raise ValueError(f'输出目录不能与分片所在目录相同: {task[0]}')
+        # 同一分片被重复指定时两个任务会写同一个临时文件，在开始转换前拒绝
+        dst_key = os.path.abspath(task[1])
+        if dst_key in seen:
+            raise ValueError(f'分片 {seen[dst_key]} 与 {task[0]} 的结果路径相同: {task[1]}')
+        seen[dst_key] = task[0]
+    for dst_dir in {os.path.dirname(task[1]) for task in tasks}:
+        os.makedirs(dst_dir, exist_ok=True)
+    with make_executor(workers, backend) as pool:
+        for src_path, dst_path, converted, error, streamed, pid, rss in pool.map(_convert_shard_task, tasks):
+            if memory is not None:
+                memory.streamed.extend(f'{src_path}:{name}' for name in streamed)
+                memory.record(src_path, 0, None, False, pid, rss)
+            yield src_path, dst_path, converted, error
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Tag转换器 tar 分片模式：流式转换 WebDataset 分片中的标注，图片原样复制')
+    parser.add_argument('shards', nargs='+', help='要转换的 tar 分片或包含分片的目录')
+    parser.add_argument('--out-dir', required=True, help='结果分片的输出目录（保持各分片相对于共同上级目录的路径）')
+    parser.add_argument('--caption-ext', default=','.join(CAPTION_EXTS), help='视为标注文本的成员扩展名，逗号分隔')
+    parser.add_argument('--workers', type=int, default=None, help='同时处理的分片数，默认为CPU核数')
+    add_pipeline_arguments(parser)
+    add_cache_arguments(parser)
+    add_memory_arguments(parser)
+    add_executor_arguments(parser)
+    args = parser.parse_args(argv)
+    caption_exts = tuple(ext.strip() if ext.strip().startswith('.') else '.' + ext.strip()
+                         for ext in args.caption_ext.split(',') if ext.strip())
+    cache = cache_from_args(args)
+    memory = memory_limit_from_args(args, args.workers, threads=resolve_backend(args.executor) == 'thread')
+    failed = 0
+    try:
+        results = run_shards(iter_shard_files(args.shards), params_from_args(args), args.out_dir, caption_exts, args.workers, cache, memory, args.executor)
+        for src_path, dst_path, converted, error in results:
+            if error:
+                failed += 1
+                print(f'转换失败 {src_path}: {error}', file=sys.stderr)
+            else:
+                print(f'{src_path} -> {dst_path}（{converted} 条标注）')
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if cache is not None:
+        cache.evict()
+    if memory is not None:
+        memory.write_report(args.memory_report)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,331 @@
+# CLIP 分词计数与 75 词元分块预算。
+# SD 的文本编码器把提示词按 75 个词元切块分别编码，横跨块边界的标签及其权重表现异常。
+# 这里用本地的 CLIP BPE 合并规则文件（openai/CLIP 的 bpe_simple_vocab_16e6.txt.gz，
+# 或 HuggingFace 的 merges.txt / tokenizer.json，不随程序附带）计算每条提示词的词元数与分块，
+# 并可按预算删除低权重标签或在块边界前插入 BREAK。
+# 合并规则每个进程只加载一次，单词与标签的词元数都有缓存，适合在批量转换中对每条标注执行。
+import gzip
+import json
+import os
+import re
+import sys
+from functools import lru_cache
+
+from tagc_core import add_pipeline_arguments, get_pipeline, iter_tag_groups, params_from_args
+from tagc_weights import DEFAULT_WEIGHT_MODEL
+
+try:
+    import regex
+except ImportError:
+    regex = None
+
+CHUNK_SIZE = 75
+# CLIP 词表共 49408 项：256 个字节符号、其 </w> 形式、49152-256-2 条合并结果与两个特殊词元
+MAX_MERGES = 49152 - 256 - 2
+BUDGET_POLICIES = ('drop', 'break')
+# break 策略插入的独立 BREAK 组，后接逗号使下一组照常按标签组解析
+BREAK_GROUP = 'BREAK, '
+# 单词/标签词元数缓存的条目上限，超出后清空重建
+MEMO_LIMIT = 1000000
+
+# CLIP 的预分词规则；没有 regex 模块时用 re 近似 \p{L}/\p{N}
+if regex is not None:
+    _RE_WORD = regex.compile(r"""'s|'t|'re|'ve|'m|'ll|'d|[\p{L}]+|[\p{N}]|[^\s\p{L}\p{N}]+""", regex.IGNORECASE)
+else:
+    _RE_WORD = re.compile(r"""'s|'t|'re|'ve|'m|'ll|'d|[^\W\d_]+|\d|(?:[^\s\w]|_)+""", re.IGNORECASE)
+# WebUI 按单词边界识别 BREAK（区分大小写），不要求它独占一个标签
+_RE_BREAK = re.compile(r'\bBREAK\b')
+
+
+def _bytes_to_unicode():
+    """CLIP/GPT-2 的字节到可见字符映射，使 BPE 在不含空白与控制字符的字符串上进行"""
+    bs = list(range(ord('!'), ord('~') + 1)) + list(range(ord('¡'), ord('¬') + 1)) + list(range(ord('®'), ord('ÿ') + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, (chr(c) for c in cs)))
+
+
+_BYTE_ENCODER = _bytes_to_unicode()
+
+
+def load_merges(path):
+    """
+    读取 BPE 合并规则，返回 {(左, 右): 优先级}。
+    支持 CLIP 的 bpe_simple_vocab_16e6.txt[.gz]、HuggingFace 的 merges.txt 与 tokenizer.json。
+    """
+    if path.lower().endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            merges = json.load(f)['model']['merges']
+        pairs = [tuple(merge.split(' ', 1)) if isinstance(merge, str) else tuple(merge) for merge in merges]
+    else:
+        opener = gzip.open if path.lower().endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        # 首行是版本说明（CLIP 为 "bpe_simple_vocab_16e6.txt#version: 0.2"）
+        if lines and '#version' in lines[0]:
+            lines = lines[1:]
+        pairs = [tuple(line.split(' ', 1)) for line in lines[:MAX_MERGES] if ' ' in line]
+    return {pair: rank for rank, pair in enumerate(pairs[:MAX_MERGES])}
+
+
+class ClipTokenCounter:
+    """
+    CLIP 词元计数器：按 CLIP 的规则小写、预分词、逐词 BPE，只计数不生成词元 ID。
+    传给子进程时按词表路径在子进程内重新加载（每个进程只加载一次）。
+    Args:
+        vocab_path (str): BPE 合并规则文件
+    """
+    def __init__(self, vocab_path):
+        self.vocab_path = vocab_path
+        self.ranks = load_merges(vocab_path)
+        self._words = {}
+        self._texts = {}
+
+    def __reduce__(self):
+        return (get_token_counter, (self.vocab_path,))
+
+    def _bpe_length(self, word):
+        """单词 BPE 合并后的词元数"""
+        symbols = [_BYTE_ENCODER[b] for b in word.encode('utf-8')]
+        symbols[-1] += '</w>'
+        ranks = self.ranks
+        while len(symbols) > 1:
+            best, best_rank = None, None
+            for i in range(len(symbols) - 1):
+                rank = ranks.get((symbols[i], symbols[i + 1]))
+                if rank is not None and (best_rank is None or rank < best_rank):
+                    best, best_rank = i, rank
+            if best is None:
+                break
+            # 合并所有与最优组合相同的相邻对
+            pair = (symbols[best], symbols[best + 1])
+            merged, i = [], 0
+            while i < len(symbols):
+                if i < len(symbols) - 1 and (symbols[i], symbols[i + 1]) == pair:
+                    merged.append(symbols[i] + symbols[i + 1])
+                    i += 2
+                else:
+                    merged.append(symbols[i])
+                    i += 1
+            symbols = merged
+        return len(symbols)
+
+    def count(self, text):
+        """文本的词元数（不含起止词元）"""
+        result = self._texts.get(text)
+        if result is not None:
+            return result
+        words = self._words
+        result = 0
+        for word in _RE_WORD.findall(' '.join(text.split()).lower()):
+            length = words.get(word)
+            if length is None:
+                if len(words) >= MEMO_LIMIT:
+                    words.clear()
+                length = words[word] = self._bpe_length(word)
+            result += length
+        if len(self._texts) >= MEMO_LIMIT:
+            self._texts.clear()
+        self._texts[text] = result
+        return result
+
+
+@lru_cache(maxsize=4)
+def get_token_counter(vocab_path):
+    """获取（并在本进程内复用）词表对应的 ClipTokenCounter"""
+    return ClipTokenCounter(vocab_path)
+
+
+class TokenBudget:
+    """
+    提示词的 75 词元分块预算。
+    提示词按 iter_tag_groups 拆成标签组（单个标签或一个权重括号组），组的词元数为去掉权重语法后各标签的词元数加组内逗号；
+    BREAK 不论出现在标签开头还是中间都单独成组，按 WebUI 的规则把当前块补满、从下一块开始，其后的文本照常拆分标签组。
+    Args:
+        vocab_path (str): BPE 合并规则文件
+        max_chunks (int): drop 策略允许的最多块数
+        policy (str): apply 时的处理方式：drop 按权重从低到高（同权重先删靠后的）删除标签组直到不超过 max_chunks 块；
+                      break 在会横跨块边界的标签组前插入 BREAK，使每组完整地落在一个块内
+        weight_model (str): 解析括号权重使用的模型
+    """
+    def __init__(self, vocab_path, max_chunks=1, policy='drop', weight_model=DEFAULT_WEIGHT_MODEL, chunk_size=CHUNK_SIZE):
+        if policy not in BUDGET_POLICIES:
+            raise ValueError(f"未知的词元预算策略: {policy}")
+        self.vocab_path = vocab_path
+        self.max_chunks = max_chunks
+        self.policy = policy
+        self.weight_model = weight_model
+        self.chunk_size = chunk_size
+        self.counter = get_token_counter(vocab_path)
+
+    def __reduce__(self):
+        return (get_token_budget, (self.vocab_path, self.max_chunks, self.policy, self.weight_model, self.chunk_size))
+
+    def groups(self, text):
+        """
+        拆分标签组，返回 [(起始位置, 结束位置, 前导分隔符词元数, 词元数, 组内最高权重, 是否为 BREAK), ...]。
+        前导分隔符是该组与上一组之间的逗号等，计入上一组所在的块。
+        """
+        count = self.counter.count
+        comma = count(',')
+        groups = []
+        previous_end = 0
+        segment_start = 0
+        # 先在 BREAK 处把文本切成若干段，每段分别拆分标签组，位置换算回原文
+        breaks = [(match.start(), match.end()) for match in _RE_BREAK.finditer(text)]
+        for segment_end, break_end in breaks + [(len(text), None)]:
+            for start, end, tags in iter_tag_groups(text[segment_start:segment_end], self.weight_model):
+                start, end = start + segment_start, end + segment_start
+                gap = count(text[previous_end:start])
+                previous_end = end
+                tokens = sum(count(tag) for tag, weight in tags) + comma * (len(tags) - 1)
+                groups.append((start, end, gap, tokens, max(weight for tag, weight in tags), False))
+            if break_end is not None:
+                groups.append((segment_end, break_end, count(text[previous_end:segment_end]), 0, 0.0, True))
+                previous_end = segment_start = break_end
+        return groups
+
+    def _layout(self, groups):
+        """按顺序排布各组，返回 (总词元数, 块数, 每组 (起始词元位置, 结束词元位置))"""
+        size = self.chunk_size
+        position = 0
+        spans = []
+        for start, end, gap, tokens, weight, is_break in groups:
+            position += gap
+            if is_break:
+                if position % size:
+                    position += size - position % size
+                spans.append((position, position))
+                continue
+            spans.append((position, position + tokens))
+            position += tokens
+        return position, max(1, -(-position // size)), spans
+
+    def _straddles(self, span):
+        first, last = span
+        return last > first and first // self.chunk_size != (last - 1) // self.chunk_size
+
+    def plan(self, text):
+        """
+        分析提示词的分块情况。
+        Returns:
+            dict: {'tokens': 总词元数, 'chunks': 块数, 'straddling': [横跨块边界的标签组原文, ...]}
+        """
+        groups = self.groups(text)
+        total, chunks, spans = self._layout(groups)
+        straddling = [text[group[0]:group[1]] for group, span in zip(groups, spans) if self._straddles(span)]
+        return {'tokens': total, 'chunks': chunks, 'straddling': straddling}
+
+    def apply(self, text):
+        """按策略处理提示词，返回处理后的文本；不需要处理时原样返回"""
+        groups = self.groups(text)
+        if not groups:
+            return text
+        if self.policy == 'break':
+            return self._insert_breaks(text, groups)
+        return self._drop(text, groups)
+
+    def _drop(self, text, groups):
+        if self._layout(groups)[1] <= self.max_chunks:
+            return text
+        kept = list(range(len(groups)))
+        # 权重从低到高、同权重从后往前依次删除，直到排布后不超过 max_chunks 块
+        order = sorted((i for i, group in enumerate(groups) if not group[5]), key=lambda i: (groups[i][4], -i))
+        for i in order:
+            kept.remove(i)
+            if self._layout([groups[k] for k in kept])[1] <= self.max_chunks:
+                break
+        return _join_groups(text, groups, kept)
+
+    def _insert_breaks(self, text, groups):
+        size = self.chunk_size
+        if self._layout(groups)[1] <= 1:
+            return text
+        # 插入的 BREAK_GROUP 末尾的逗号计入下一块，与 plan 对结果的排布一致
+        comma = self.counter.count(',')
+        pieces = []
+        previous = 0
+        position = 0
+        for start, end, gap, tokens, weight, is_break in groups:
+            position += gap
+            if is_break:
+                position += -position % size
+                continue
+            if tokens + comma <= size and self._straddles((position, position + tokens)):
+                pieces.append(text[previous:start])
+                pieces.append(BREAK_GROUP)
+                previous = start
+                position += -position % size + comma
+            position += tokens
+        pieces.append(text[previous:])
+        return ''.join(pieces)
+
+
+def _join_groups(text, groups, kept):
+    """只保留下标在 kept 中的标签组：每组连同其后的分隔符一起保留，最后一组之后接原文的结尾部分"""
+    if not kept:
+        return text[:groups[0][0]] + text[groups[-1][1]:]
+    pieces = [text[:groups[0][0]]]
+    for n, k in enumerate(kept):
+        start, end = groups[k][0], groups[k][1]
+        if n + 1 < len(kept):
+            pieces.append(text[start:groups[k + 1][0]])
+        else:
+            pieces.append(text[start:end] + text[groups[-1][1]:])
+    return ''.join(pieces)
+
+
+@lru_cache(maxsize=8)
+def get_token_budget(vocab_path, max_chunks=1, policy='drop', weight_model=DEFAULT_WEIGHT_MODEL, chunk_size=CHUNK_SIZE):
+    """获取（并在本进程内复用）同参数的 TokenBudget"""
+    return TokenBudget(vocab_path, max_chunks, policy, weight_model, chunk_size)
+
+
+def add_token_arguments(parser):
+    """为命令行解析器添加词元预算参数（批量模式用）"""
+    parser.add_argument('--clip-vocab', default=None,
+                        help='CLIP BPE 合并规则文件（bpe_simple_vocab_16e6.txt.gz、merges.txt 或 tokenizer.json），启用词元预算时需要')
+    parser.add_argument('--token-budget', choices=BUDGET_POLICIES, default=None,
+                        help='转换后按 75 词元分块处理：drop 删除低权重标签直到不超过 --max-chunks 块，break 在横跨块边界的标签前插入 BREAK')
+    parser.add_argument('--max-chunks', type=int, default=1, help='drop 策略允许的最多块数')
+
+
+def token_budget_from_args(args, weight_model=DEFAULT_WEIGHT_MODEL):
+    """按 add_token_arguments 解析出的参数获取 TokenBudget，未指定 --token-budget 时返回 None"""
+    if not args.token_budget:
+        return None
+    if not args.clip_vocab:
+        raise ValueError('--token-budget 需要同时指定 --clip-vocab')
+    return get_token_budget(args.clip_vocab, args.max_chunks, args.token_budget, weight_model)
+
+
+def main(argv=None):
+    import argparse
+    from tagc_batch import iter_source_files, read_source
+    parser = argparse.ArgumentParser(description='Tag转换器词元统计：按 CLIP 分词统计每个文件的词元数、75 词元块数与横跨块边界的标签')
+    parser.add_argument('paths', nargs='+', help='要统计的目录或文件')
+    parser.add_argument('--vocab', required=True, help='CLIP BPE 合并规则文件')
+    parser.add_argument('--convert', action='store_true', help='先按转换参数转换再统计（默认统计原文）')
+    add_pipeline_arguments(parser)
+    args = parser.parse_args(argv)
+    params = params_from_args(args)
+    budget = get_token_budget(args.vocab, weight_model=params['weight_model'])
+    pipeline = get_pipeline(**params) if args.convert else None
+    over = 0
+    for target in args.paths:
+        for path in iter_source_files(target) if os.path.isdir(target) else [target]:
+            text = read_source(path)
+            plan = budget.plan(pipeline(text) if pipeline is not None else text)
+            over += plan['chunks'] > 1
+            print(f"{path}\t{plan['tokens']}\t{plan['chunks']}\t{' | '.join(plan['straddling'])}")
+    print(f'超过 {CHUNK_SIZE} 词元的文件 {over} 个', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
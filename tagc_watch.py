@@ -0,0 +1,240 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+from tagc_batch import DEFAULT_SUFFIX, is_source_file, iter_source_files, output_path_for, run_batch
+from tagc_cache import add_cache_arguments, cache_from_args
+from tagc_core import add_executor_arguments, add_pipeline_arguments, make_executor, params_from_args
+from tagc_metrics import MetricsFileWriter, add_metrics_arguments
+
+# inotify 事件掩码（见 <sys/inotify.h>）
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class _Inotify:
+    """
+    基于 ctypes 的最小 inotify 封装，仅在 Linux 可用。
+    只负责告诉监视器“哪些路径可能变了”，是否处理仍由 mtime 索引判定。
+    """
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._libc = libc
+        self.fd = libc.inotify_init1(_IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 失败')
+        self._dirs = {}
+
+    def add_dir(self, path):
+        if path in self._dirs.values():
+            return
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+        if wd >= 0:
+            self._dirs[wd] = path
+
+    def wait(self, timeout):
+        """等待事件，返回 (变化的文件路径集合, 新建目录列表, 是否溢出)"""
+        changed, new_dirs, overflow = set(), [], False
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed, new_dirs, overflow
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\x00')
+                offset += length
+                if mask & _IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                parent = self._dirs.get(wd)
+                if parent is None or not name:
+                    continue
+                path = os.path.join(parent, os.fsdecode(name))
+                if mask & _IN_ISDIR:
+                    new_dirs.append(path)
+                else:
+                    changed.add(path)
+        return changed, new_dirs, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    """
+    监视目录，自动转换新出现或被修改的 .txt 标注与 .png/.jpg/.webp 图片。
+    文件的 (mtime, 大小) 连续 settle 秒不变才视为写入完成，避免读到半个文件；
+    一次唤醒内就绪的文件合并为一批交给进程池（无 GIL 时为线程池）处理，以跟上成批出图的速度。
+    Args:
+        root (str): 监视的目录
+        params (dict): get_pipeline 关键字参数
+        out_dir (str): 输出目录，省略时在源文件旁写出结果文件
+        suffix (str): 旁路结果文件后缀
+        interval (float): 轮询间隔（秒），使用 inotify 时为最长等待时间
+        settle (float): 文件静止多久后才处理（秒）
+        workers (int): 进程数，默认为CPU核数
+        use_inotify (bool): 可用时是否使用 inotify
+        cache (ResultCache): 结果缓存，内容未变的文件（如仅被 touch）直接复用结果
+        backend (str): 执行器，见 tagc_core.make_executor
+    """
+    def __init__(self, root, params, out_dir=None, suffix=DEFAULT_SUFFIX, interval=1.0, settle=1.0, workers=None, use_inotify=True, cache=None, backend=None):
+        self.root = root
+        self.params = params
+        self.out_dir = out_dir
+        self.suffix = suffix
+        self.interval = interval
+        self.settle = settle
+        self.workers = workers
+        self.cache = cache
+        self.backend = backend
+        self._index = {}    # 路径 -> 已处理版本的 (mtime_ns, size)
+        self._pending = {}  # 路径 -> (最近一次看到的 (mtime_ns, size), 该签名首次出现的时间)
+        self._inotify = None
+        if use_inotify and sys.platform.startswith('linux'):
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError):
+                self._inotify = None
+
+    def _is_up_to_date(self, path, sig):
+        # 重启后已有且较新的结果文件不再重复转换
+        try:
+            return os.stat(output_path_for(path, self.root, self.out_dir, self.suffix)).st_mtime_ns >= sig[0]
+        except OSError:
+            return False
+
+    def _check(self, path, now):
+        """更新单个文件的状态，文件已静止足够久且需要处理时返回 True"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._pending.pop(path, None)
+            return False
+        sig = (st.st_mtime_ns, st.st_size)
+        if self._index.get(path) == sig:
+            self._pending.pop(path, None)
+            return False
+        seen = self._pending.get(path)
+        if seen is None or seen[0] != sig:
+            self._pending[path] = (sig, now)
+            return False
+        return now - seen[1] >= self.settle
+
+    def _full_scan(self):
+        if self._inotify is not None:
+            for dirpath, dirnames, filenames in os.walk(self.root):
+                self._inotify.add_dir(dirpath)
+        return set(iter_source_files(self.root, self.suffix, self.out_dir))
+
+    def _collect_ready(self, candidates):
+        now = time.monotonic()
+        ready = []
+        for path in sorted(candidates | set(self._pending)):
+            if self._check(path, now):
+                sig = self._pending.pop(path)[0]
+                if self._is_up_to_date(path, sig):
+                    self._index[path] = sig
+                else:
+                    ready.append((path, sig))
+        return ready
+
+    def _wait_for_changes(self):
+        if self._inotify is None:
+            time.sleep(self.interval)
+            return self._full_scan()
+        # 有文件处于待静止状态时缩短等待，以便按时复查
+        timeout = min(self.interval, self.settle) if self._pending else self.interval
+        changed, new_dirs, overflow = self._inotify.wait(timeout)
+        if overflow:
+            return self._full_scan()
+        for path in new_dirs:
+            for dirpath, dirnames, filenames in os.walk(path):
+                self._inotify.add_dir(dirpath)
+                changed.update(os.path.join(dirpath, name) for name in filenames)
+        return {path for path in changed if is_source_file(path, self.suffix) and not self._in_out_dir(path)}
+
+    def _in_out_dir(self, path):
+        if not self.out_dir:
+            return False
+        out_dir = os.path.abspath(self.out_dir)
+        return os.path.abspath(path).startswith(out_dir + os.sep)
+
+    def run(self, once=False, on_result=None):
+        """
+        持续监视并转换，Ctrl+C 退出。
+        Args:
+            once (bool): 只处理当前已有的文件后返回（等待它们静止）
+            on_result (callable): 每个文件处理完成时回调 (源路径, 结果路径, 错误信息)
+        """
+        candidates = self._full_scan()
+        with make_executor(self.workers, self.backend) as pool:
+            try:
+                while True:
+                    ready = self._collect_ready(candidates)
+                    if ready:
+                        sigs = dict(ready)
+                        for path, out_path, error in run_batch(sigs, self.params, self.root, self.out_dir, self.suffix, executor=pool, cache=self.cache):
+                            # 出错的文件同样记入索引，直到再次被修改才重试
+                            self._index[path] = sigs[path]
+                            if on_result:
+                                on_result(path, out_path, error)
+                    if once and not self._pending:
+                        return
+                    candidates = self._wait_for_changes()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                if self._inotify is not None:
+                    self._inotify.close()
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Tag转换器监视模式：自动转换目录中新出现的 .txt 标注与 .png/.jpg/.webp 图片')
+    parser.add_argument('root', help='要监视的目录')
+    parser.add_argument('--out-dir', default=None, help='输出目录，省略时在源文件旁写出结果文件')
+    parser.add_argument('--suffix', default=DEFAULT_SUFFIX, help='旁路结果文件后缀')
+    parser.add_argument('--interval', type=float, default=1.0, help='轮询间隔（秒）')
+    parser.add_argument('--settle', type=float, default=1.0, help='文件静止多久后才处理（秒）')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认为CPU核数')
+    parser.add_argument('--poll', action='store_true', help='强制使用轮询而不是 inotify')
+    parser.add_argument('--once', action='store_true', help='处理完已有文件后退出')
+    add_pipeline_arguments(parser)
+    add_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    add_executor_arguments(parser)
+    args = parser.parse_args(argv)
+
+    def report(path, out_path, error):
+        if error:
+            print(f'转换失败 {path}: {error}', file=sys.stderr)
+        else:
+            print(f'{path} -> {out_path}')
+
+    watcher = FolderWatcher(args.root, params_from_args(args), args.out_dir, args.suffix, args.interval, args.settle, args.workers, not args.poll, cache_from_args(args), args.executor)
+    if not args.metrics_file:
+        watcher.run(args.once, report)
+        return 0
+    with MetricsFileWriter(args.metrics_file):
+        watcher.run(args.once, report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import math
+
+# 权重→括号层数查找表覆盖的权重范围（按 0.001 量化），超出范围时直接计算
+WEIGHT_TABLE_MAX = 5
+WEIGHT_TABLE_SCALE = 1000
+
+_ROUNDING = {
+    'ceil': math.ceil,
+    'floor': math.floor,
+    'round': lambda value: math.floor(value + 0.5),
+}
+
+
+class WeightModel:
+    """
+    括号权重模型：NAI 的 {} 每层乘 up，[] 每层乘 down。
+    构造时预先计算 括号层数→权重 与 量化权重→括号层数 两张查找表，
+    转换时按表取值，不再逐个匹配调用 pow/ceil。
+    Args:
+        name (str): 模型名称，界面与命令行按名称选择
+        up (float): {} 每层的倍率
+        down (float): [] 每层的倍率
+        step (float): SD→NAI 时每层对应的线性权重步长；为 None 时按 up/down 取对数反推层数
+        rounding (str): 反推层数时的取整方式：ceil、floor 或 round（四舍五入）
+        digits (int): NAI→SD 权重保留的小数位数
+        precise_digits (int): 精确权重转换时保留的小数位数
+        max_depth (int): 层数→权重表的最大层数；对数反推时零权重也按该层数输出
+        description (str): 界面显示的说明
+    """
+    def __init__(self, name, up, down, step=None, rounding='ceil', digits=1, precise_digits=3, max_depth=32, description=''):
+        if rounding not in _ROUNDING:
+            raise ValueError(f"未知的取整方式: {rounding}")
+        self.name = name
+        self.up = up
+        self.down = down
+        self.step = step
+        self.rounding = rounding
+        self.digits = digits
+        self.precise_digits = precise_digits
+        self.max_depth = max_depth
+        self.description = description
+        self._round = _ROUNDING[rounding]
+        # (精确模式, 是否为{}) -> 各层数对应的权重
+        self._depth_weights = {}
+        for precise in (False, True):
+            ndigits = precise_digits if precise else digits
+            for is_up in (False, True):
+                base = up if is_up else down
+                self._depth_weights[precise, is_up] = [round(math.pow(base, depth), ndigits) for depth in range(max_depth + 1)]
+        self._weight_depths = [self._compute_brackets(k / WEIGHT_TABLE_SCALE) for k in range(WEIGHT_TABLE_MAX * WEIGHT_TABLE_SCALE + 1)]
+
+    def __repr__(self):
+        return f'WeightModel({self.name!r})'
+
+    def bracket_weight(self, is_up, depth, precise=False):
+        """NAI→SD：depth 层 {}（is_up 为真）或 [] 对应的权重"""
+        table = self._depth_weights[precise, is_up]
+        if depth < len(table):
+            return table[depth]
+        return round(math.pow(self.up if is_up else self.down, depth), self.precise_digits if precise else self.digits)
+
+    def brackets_for(self, weight):
+        """SD→NAI：返回 (是否使用{}, 层数)"""
+        key = round(weight * WEIGHT_TABLE_SCALE)
+        # 只有量化后能还原出同一个浮点数时才查表，保证与直接计算的结果完全一致
+        if 0 <= key < len(self._weight_depths) and key / WEIGHT_TABLE_SCALE == weight:
+            return self._weight_depths[key]
+        return self._compute_brackets(weight)
+
+    def _compute_brackets(self, weight):
+        if self.step is not None:
+            if weight >= 1:
+                return True, self._round((weight - 1) / self.step)
+            return False, self._round((1 - weight) / self.step)
+        if weight <= 0:
+            return False, self.max_depth
+        if weight >= 1:
+            return True, self._round(math.log(weight) / math.log(self.up))
+        return False, self._round(math.log(weight) / math.log(self.down))
+
+
+def _define_models(*models):
+    return {model.name: model for model in models}
+
+
+# 内置权重模型，第一个为默认模型
+WEIGHT_MODELS = _define_models(
+    # 本程序一直以来的换算：{} ×1.1、[] ×0.9，反向按每 0.1 一层向上取整
+    WeightModel('legacy', 1.1, 0.9, step=0.1, rounding='ceil', description='经典 ×1.1 / ×0.9'),
+    # 新版 NAI：{} ×1.05、[] ÷1.05，反向按对数四舍五入到最接近的层数
+    WeightModel('nai-v4', 1.05, 1 / 1.05, rounding='round', description='新版NAI ×1.05 / ÷1.05'),
+)
+DEFAULT_WEIGHT_MODEL = 'legacy'
+
+
+def get_weight_model(name=None):
+    """
+    按名称获取权重模型，name 为 None 或空字符串时返回默认模型。
+    Raises:
+        ValueError: 名称未定义
+    """
+    try:
+        return WEIGHT_MODELS[name or DEFAULT_WEIGHT_MODEL]
+    except KeyError:
+        raise ValueError(f"未知的权重模型: {name}（可选 {', '.join(WEIGHT_MODELS)}）") from None
@@ -0,0 +1,315 @@
+# 提示词模板展开：通配符 __name__ 与选择 <<a|b|c>>，展开结果直接流入转换流程。
+#
+# 选择用 <<...>> 而不是常见的 {a|b}，避免与 NAI 的 {} 权重括号冲突；通配符 __hair_color__ 读取
+# 通配符目录下的 hair_color.txt（每行一个取值，可含子目录 __hair/color__），取值中可以再嵌套模板。
+# 模板解析为树并预先算出每个节点的组合数，第 i 个组合按混合进制直接求出，
+# 因此全量展开只是从 0 数到组合数，随机抽样只是抽一个序号，都不需要把组合放进内存。
+import bisect
+import itertools
+import os
+import random
+import re
+import sys
+from functools import lru_cache
+
+from tagc_batch import _map_tasks
+from tagc_core import add_executor_arguments, add_pipeline_arguments, get_pipeline, params_from_args, parse_tags
+from tagc_export import DEFAULT_ROW_GROUP_SIZE, open_export_writer
+
+ALT_OPEN = '<<'
+ALT_CLOSE = '>>'
+ALT_SEP = '|'
+WILDCARD_EXT = '.txt'
+# 通配符取值中嵌套通配符的最大层数，超过时视为循环引用
+MAX_DEPTH = 16
+# 每个子进程任务包含的组合数，单个组合的转换很快，成组提交以摊薄进程间通信
+VARIANT_CHUNK_SIZE = 512
+
+_RE_TOKEN = re.compile(r'<<|>>|\||__([A-Za-z0-9][\w\-/.]*?)__')
+
+
+class _Choice:
+    """多选一：各选项的组合数之和，offsets 为各选项起始序号"""
+    __slots__ = ('options', 'offsets', 'count')
+
+    def __init__(self, options):
+        self.options = options
+        self.offsets = []
+        count = 0
+        for option in options:
+            self.offsets.append(count)
+            count += _count(option)
+        self.count = count
+
+
+class _Seq:
+    """顺序拼接：各部分组合数之积，前面的部分为高位"""
+    __slots__ = ('parts', 'strides', 'count')
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.strides = [0] * len(parts)
+        count = 1
+        for i in range(len(parts) - 1, -1, -1):
+            self.strides[i] = count
+            count *= _count(parts[i])
+        self.count = count
+
+
+def _count(node):
+    return 1 if isinstance(node, str) else node.count
+
+
+def _make_seq(parts):
+    # 相邻的字面文本合并，只有一部分时直接返回该部分
+    merged = []
+    for part in parts:
+        if isinstance(part, str) and merged and isinstance(merged[-1], str):
+            merged[-1] += part
+        elif part != '':
+            merged.append(part)
+    if not merged:
+        return ''
+    return merged[0] if len(merged) == 1 else _Seq(merged)
+
+
+def _parse(text, wildcard_dir, stack):
+    """把模板文本解析为组合树"""
+    node, pos = _parse_seq(text, 0, wildcard_dir, stack, nested=False)
+    if pos < len(text):
+        raise ValueError(f'多余的 {ALT_CLOSE}: {text}')
+    return node
+
+
+def _parse_seq(text, pos, wildcard_dir, stack, nested):
+    """解析到选择的 | 或 >> 为止（顶层时到文本结尾），返回 (节点, 停止位置)"""
+    parts = []
+    while True:
+        match = _RE_TOKEN.search(text, pos)
+        if match is None:
+            parts.append(text[pos:])
+            return _make_seq(parts), len(text)
+        parts.append(text[pos:match.start()])
+        token = match.group()
+        if token == ALT_OPEN:
+            options = []
+            pos = match.end()
+            while True:
+                option, pos = _parse_seq(text, pos, wildcard_dir, stack, nested=True)
+                options.append(option)
+                if text.startswith(ALT_CLOSE, pos):
+                    pos += len(ALT_CLOSE)
+                    break
+                if not text.startswith(ALT_SEP, pos):
+                    raise ValueError(f'未闭合的 {ALT_OPEN}: {text}')
+                pos += len(ALT_SEP)
+            parts.append(_Choice(options))
+        elif nested or token == ALT_CLOSE:
+            return _make_seq(parts), match.start()
+        elif token == ALT_SEP:
+            # 选择之外的 | 按普通文本处理
+            parts.append(token)
+            pos = match.end()
+        else:
+            parts.append(_load_wildcard(wildcard_dir, match.group(1), stack))
+            pos = match.end()
+
+
+def _load_wildcard(wildcard_dir, name, stack):
+    if name in stack:
+        raise ValueError(f'通配符循环引用: {" -> ".join(stack + (name,))}')
+    if len(stack) >= MAX_DEPTH:
+        raise ValueError(f'通配符嵌套超过 {MAX_DEPTH} 层: {" -> ".join(stack + (name,))}')
+    return load_wildcard(wildcard_dir, name, stack)
+
+
+@lru_cache(maxsize=1024)
+def load_wildcard(wildcard_dir, name, stack=()):
+    """
+    读取通配符文件并解析为多选一节点：每个非空行为一个取值，# 开头的行为注释。
+    Raises:
+        ValueError: 找不到通配符文件、文件为空或存在循环引用
+    """
+    if wildcard_dir is None:
+        raise ValueError(f'模板中使用了通配符 __{name}__，但未指定通配符目录')
+    path = os.path.join(wildcard_dir, *name.split('/')) + WILDCARD_EXT
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            values = [line.strip() for line in f]
+    except FileNotFoundError:
+        raise ValueError(f'找不到通配符文件: {path}') from None
+    values = [value for value in values if value and not value.startswith('#')]
+    if not values:
+        raise ValueError(f'通配符文件为空: {path}')
+    return _Choice([_parse(value, wildcard_dir, stack + (name,)) for value in values])
+
+
+def _unrank(node, index, out):
+    """把第 index 个组合的各段文本依次追加到 out"""
+    while True:
+        if isinstance(node, str):
+            out.append(node)
+            return
+        if isinstance(node, _Choice):
+            i = bisect.bisect_right(node.offsets, index) - 1
+            node, index = node.options[i], index - node.offsets[i]
+            continue
+        for part, stride in zip(node.parts, node.strides):
+            if isinstance(part, str):
+                out.append(part)
+            else:
+                _unrank(part, index // stride % part.count, out)
+        return
+
+
+class Template:
+    """
+    解析后的提示词模板，len() 为组合总数，template[i] 为第 i 个组合（按选项顺序，后面的选择变化最快）。
+    传给子进程时只传模板文本与通配符目录，在子进程内重新解析并缓存。
+    Args:
+        text (str): 模板文本
+        wildcard_dir (str): 通配符目录，模板不含通配符时可为 None
+    """
+    def __init__(self, text, wildcard_dir=None):
+        self.text = text
+        self.wildcard_dir = wildcard_dir
+        self._root = _parse(text, wildcard_dir, ())
+        self.count = _count(self._root)
+
+    def __reduce__(self):
+        return (get_template, (self.text, self.wildcard_dir))
+
+    def __len__(self):
+        # len() 要求结果不超过 sys.maxsize，组合数可能更大，超大时请用 count
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        out = []
+        _unrank(self._root, index, out)
+        return ''.join(out)
+
+    def indices(self, sample=None, seed=0, limit=None):
+        """
+        产出要展开的组合序号。
+        sample 为 None 时按顺序全量展开（最多 limit 个）；否则按 seed 可复现地有放回随机抽取 sample 个，
+        同一模板、同一 seed 每次得到相同的序列，与进程数无关。
+        """
+        if sample is None:
+            count = self.count if limit is None else min(self.count, limit)
+            return iter(range(count))
+        rng = random.Random(f'{seed}:{self.text}')
+        return (rng.randrange(self.count) for _ in range(sample))
+
+
+@lru_cache(maxsize=256)
+def get_template(text, wildcard_dir=None):
+    """获取（并在本进程内复用）解析后的模板"""
+    return Template(text, wildcard_dir)
+
+
+def iter_template_lines(paths):
+    """逐行读取模板文件（'-' 为标准输入），产出 (来源, 模板文本)；空行与 # 开头的注释行跳过"""
+    for path in paths:
+        f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+        try:
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield f'{path}:{lineno}', line
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def iter_variants(templates, wildcard_dir=None, sample=None, seed=0, limit=None):
+    """
+    依次展开各模板，产出 (来源, 模板, 组合序号)。只在取用时才生成下一个序号，内存占用与组合数无关。
+    Args:
+        templates (iterable): (来源, 模板文本) 序列
+        sample (int): 每个模板随机抽取的个数，None 为全量展开
+        limit (int): 全量展开时每个模板最多展开的个数
+    """
+    for source, text in templates:
+        template = get_template(text, wildcard_dir)
+        for index in template.indices(sample, seed, limit):
+            yield source, template, index
+
+
+def _variant_task(args):
+    """子进程任务：展开一个组合并转换，返回 (来源, 序号, 展开结果, 转换结果)"""
+    source, template, index, params = args
+    text = template[index]
+    return source, index, text, get_pipeline(**params)(text) if params is not None else text
+
+
+def convert_variants(variants, params, workers=None, backend=None):
+    """
+    用进程池（无 GIL 时为线程池）转换 iter_variants 产出的组合，按输入顺序产出 (来源, 序号, 展开结果, 转换结果)。
+    展开在子进程内完成，只提前提交有限的几组任务；params 为 None 时只展开不转换。
+    """
+    tasks = ((source, template, index, params) for source, template, index in variants)
+    return _map_tasks(_variant_task, tasks, workers, chunksize=VARIANT_CHUNK_SIZE, backend=backend)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='展开提示词模板（__通配符__ 与 <<a|b>> 选择）并转换每个组合')
+    parser.add_argument('paths', nargs='*', help='模板文件，每行一个模板；- 为标准输入')
+    parser.add_argument('-t', '--template', action='append', default=[], help='直接给出的模板，可重复')
+    parser.add_argument('--wildcards', default=None, help='通配符目录，__name__ 读取其中的 name.txt')
+    parser.add_argument('--random', type=int, default=None, metavar='N', help='每个模板按 --seed 随机抽取 N 个组合，而不是全量展开')
+    parser.add_argument('--seed', default='0', help='随机抽取的种子，相同种子得到相同结果')
+    parser.add_argument('--limit', type=int, default=None, help='全量展开时每个模板最多展开的组合数')
+    parser.add_argument('--count', action='store_true', help='只输出每个模板的组合数')
+    parser.add_argument('--no-convert', action='store_true', help='只展开，不转换')
+    parser.add_argument('--output', default=None, help='结果文本文件，每行一个组合，省略时输出到标准输出')
+    parser.add_argument('--export', default=None, help='把 path（来源#序号）、raw、converted、tags、weights 写入列式文件，见批量模式 --export')
+    parser.add_argument('--row-group-size', type=int, default=DEFAULT_ROW_GROUP_SIZE, help='列式导出每个行组的行数')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认为CPU核数')
+    add_pipeline_arguments(parser)
+    add_executor_arguments(parser)
+    args = parser.parse_args(argv)
+    templates = [(f'template:{i}', text) for i, text in enumerate(args.template)]
+    templates = itertools.chain(templates, iter_template_lines(args.paths))
+    try:
+        if args.count:
+            total = 0
+            for source, text in templates:
+                count = get_template(text, args.wildcards).count
+                total += count
+                print(f'{count}\t{source}')
+            print(f'{total}\t总计')
+            return 0
+        params = None if args.no_convert else params_from_args(args)
+        variants = iter_variants(templates, args.wildcards, args.random, args.seed, args.limit)
+        results = convert_variants(variants, params, args.workers, args.executor)
+        if args.export:
+            with open_export_writer(args.export, args.row_group_size) as writer:
+                for source, index, text, converted in results:
+                    tags = parse_tags(converted, args.weight_model)
+                    writer.write({
+                        'path': f'{source}#{index}',
+                        'raw': text,
+                        'converted': converted,
+                        'tags': [tag for tag, weight in tags],
+                        'weights': [weight for tag, weight in tags],
+                    })
+            print(f'已导出 {writer.rows} 行到 {writer.path}')
+            return 0
+        out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            for source, index, text, converted in results:
+                out.write(converted + '\n')
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    except ValueError as e:
+        print(f'模板错误: {e}', file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
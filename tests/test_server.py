@@ -0,0 +1,55 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from tagc_server import TagConverterServer
+
+
+@pytest.fixture(scope='module')
+def url():
+    server = TagConverterServer(('127.0.0.1', 0), workers=1, backend='thread')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/convert'
+    server.shutdown()
+    server.server_close()
+
+
+def _post(url, payload):
+    request = urllib.request.Request(url, json.dumps(payload).encode('utf-8'))
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+@pytest.mark.parametrize('key', ['tag_dedup', 'tag_order', 'tag_vocab', 'weight_model', 'precise_mode', 'weight_limit', 'mode'])
+def test_null_means_default(url, key):
+    assert _post(url, {'text': 'a, b', key: None}) == (200, {'result': 'a, b'})
+
+
+@pytest.mark.parametrize('key, value', [
+    ('precise_mode', 'false'),
+    ('precise_mode', 1),
+    ('weight_limit', '1.6'),
+    ('weight_limit', True),
+    ('short_line_threshold', 2.5),
+    ('compress_blank_threshold', '4'),
+    ('tag_dedup', 1),
+    ('weight_model', ['legacy']),
+    ('mode', True),
+])
+def test_wrong_type_is_rejected(url, key, value):
+    status, body = _post(url, {'text': 'a, b', key: value})
+    assert status == 400
+    assert key in body['error']
+
+
+def test_typed_values_are_accepted(url):
+    status, body = _post(url, {'text': '(a:1.2), a', 'mode': 1, 'precise_mode': False, 'weight_limit': 2,
+                               'short_line_threshold': 20.0, 'tag_dedup': 'max'})
+    assert status == 200
@@ -0,0 +1,43 @@
+import pytest
+
+from tagc_tokens import BREAK_GROUP, TokenBudget
+
+
+@pytest.fixture
+def vocab(tmp_path):
+    # 没有合并规则时每个字节各为一个词元，便于手算
+    path = tmp_path / 'merges.txt'
+    path.write_text('#version: 0.2\n', encoding='utf-8')
+    return str(path)
+
+
+def _kinds(budget, text):
+    return [(text[start:end], tokens, weight, is_break) for start, end, gap, tokens, weight, is_break in budget.groups(text)]
+
+
+@pytest.mark.parametrize('text, weight', [('BREAK (gh:0.9)', 0.9), ('BREAK [gh]', 0.9), ('BREAK {gh}', 1.1)])
+def test_break_followed_by_weighted_group(vocab, text, weight):
+    budget = TokenBudget(vocab)
+    assert _kinds(budget, text) == [('BREAK', 0, 0.0, True), (text[6:], 2, weight, False)]
+
+
+def test_break_inside_plain_tag(vocab):
+    budget = TokenBudget(vocab)
+    assert _kinds(budget, 'aa BREAK (gh:0.9)') == [('aa ', 2, 1.0, False), ('BREAK', 0, 0.0, True), ('(gh:0.9)', 2, 0.9, False)]
+
+
+def test_drop_sees_weight_after_break(vocab):
+    budget = TokenBudget(vocab, max_chunks=2, chunk_size=10)
+    assert budget.apply('abcdef, BREAK (gh:0.5), ijklmnop') == 'abcdef, BREAK ijklmnop'
+
+
+def test_break_policy_output_replans_consistently(vocab):
+    budget = TokenBudget(vocab, policy='break', chunk_size=10)
+    text = 'abcdef, ghijkl, (mn:0.9), opqrstu, [vw]'
+    result = budget.apply(text)
+    assert result == 'abcdef, ' + BREAK_GROUP + 'ghijkl, (mn:0.9), opqrstu, ' + BREAK_GROUP + '[vw]'
+    plan = budget.plan(result)
+    assert plan['straddling'] == []
+    # 每个插入的 BREAK 后的逗号计入下一块：6+1 | 1+6+1+2+1+7+1 | 1+2
+    assert plan['chunks'] == 4
+    assert budget.apply(result) == result